@@ -0,0 +1,95 @@
+#!/usr/bin/python
+"""Per link overhead of the downloader backends
+
+Both backends download from a local stub extractor which writes a small file, so the timings
+are the cost of getting to the extractor: shell + interpreter start + imports for the subprocess
+backend, a method call on a reused YoutubeDL object for the library backend.
+The subprocess stub imports yt_dlp/youtube_dl when installed, like the real youtube-dl command does.
+Usage : python benchmarks/bench_downloader.py [-n links]
+"""
+import os,sys
+import argparse
+import shutil
+import stat
+import tempfile
+import types
+from timeit import default_timer as timer
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from youtubeClass import Youtubedl
+from downloaderModule import LibraryBackend
+
+#youtube-dl command replacement : youtube-dl -o <template> ... --exec "echo YTDL_FILE: {}" ... <link>
+STUB_COMMAND = """#!{python}
+import sys
+try:
+    import yt_dlp
+except ImportError:
+    try:
+        import youtube_dl
+    except ImportError:
+        pass
+link = sys.argv[-1]
+path = sys.argv[sys.argv.index('-o') + 1] % {{'title' : link, 'ext' : 'mp4'}}
+open(path, 'w').write(link)
+print('YTDL_FILE: ' + path)
+"""
+
+
+class StubExtractor(object):
+    """In process replacement of YoutubeDL
+    """
+
+    def __init__(self,params):
+        self.params = dict(params,outtmpl='%(title)s.%(ext)s')
+
+    def prepare_filename(self,info):
+        return(self.params['outtmpl'] % info)
+
+    def extract_info(self,url,download=True):
+        info = {'title' : url, 'ext' : 'mp4'}
+        with open(self.prepare_filename(info),'w') as fh:
+            fh.write(url)
+        return(info)
+
+
+def run(name,folder,links):
+    """Function to download links with one backend
+    Output : seconds per link
+    """
+    yt = Youtubedl(','.join(links),1,os.path.join(folder,name)+'/',backend='subprocess')
+    yt.checkYoutubeDl = lambda: None
+    yt.obj.logger.setLevel('WARNING')
+    if name == 'library':
+        yt.backend = LibraryBackend(yt,library=types.SimpleNamespace(YoutubeDL=StubExtractor))
+    t1 = timer()
+    for link in links:
+        job = yt.newJob(link)
+        if yt.downloadVideo(job) is None:
+            raise SystemExit("{} backend failed on {}".format(name,link))
+        yt.cleanUp(job)
+    t2 = timer()
+    yt.ledger.close()
+    return((t2-t1)/len(links))
+
+
+def getArgs():
+    parser = argparse.ArgumentParser(description='Per link overhead of the downloader backends')
+    parser.add_argument('-n','--links',dest='links',type=int,default=20,help='Links downloaded per backend (default 20)')
+    return(parser.parse_args())
+
+
+if __name__ == "__main__":
+    args = getArgs()
+    folder = tempfile.mkdtemp()
+    try:
+        command = os.path.join(folder,'youtube-dl')
+        with open(command,'w') as fh:
+            fh.write(STUB_COMMAND.format(python=sys.executable))
+        os.chmod(command,stat.S_IRWXU)
+        os.environ['PATH'] = folder+os.pathsep+os.environ['PATH']
+        links = ['link{}'.format(i) for i in range(args.links)]
+        for name in ('subprocess','library'):
+            print("{:<12} {:8.2f} ms per link".format(name,run(name,folder,links)*1000))
+    finally:
+        shutil.rmtree(folder)
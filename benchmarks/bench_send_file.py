@@ -0,0 +1,88 @@
+#!/usr/bin/python
+"""Loopback benchmark of the server file send paths
+
+Compares the old 1024 byte read/send loop with FileSender's buffered and sendfile() paths.
+Usage : python benchmarks/bench_send_file.py [-s size_in_mb] [-r repeats]
+"""
+import os,sys
+import argparse
+import socket
+import tempfile
+import threading
+from timeit import default_timer as timer
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from transferModule import FileSender
+
+
+def drain(sock,size):
+    """Function to read and discard size bytes
+    """
+    buf = bytearray(1024*1024)
+    received = 0
+    while received < size:
+        n = sock.recv_into(buf)
+        if not n:
+            break
+        received += n
+    sock.close()
+
+
+def legacy_send(sock,fh,size):
+    """Old ServerConnect.send_data loop
+    """
+    data = fh.read(1024)
+    while data:
+        sock.sendall(data)
+        data = fh.read(1024)
+
+
+def run(name,send,path,size):
+    """Function to time one send of the whole file over a loopback TCP connection
+    """
+    listener = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1',0))
+    listener.listen(1)
+    client = socket.create_connection(listener.getsockname())
+    (server,addr) = listener.accept()
+    listener.close()
+    t = threading.Thread(target=drain,args=(client,size))
+    t.start()
+    with open(path,'rb') as fh:
+        t1 = timer()
+        send(server,fh,size)
+        server.shutdown(socket.SHUT_WR)
+        t.join()
+        t2 = timer()
+    server.close()
+    return(t2-t1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Loopback benchmark of file send paths')
+    parser.add_argument('-s','--size',dest='size',type=int,default=256,help='File size in MB (default 256)')
+    parser.add_argument('-r','--repeats',dest='repeats',type=int,default=3,help='Runs per method, best is reported (default 3)')
+    args = parser.parse_args()
+
+    size = args.size*1024*1024
+    (fd,path) = tempfile.mkstemp(suffix='.mp4')
+    with os.fdopen(fd,'wb') as fh:
+        block = os.urandom(1024*1024)
+        for i in range(args.size):
+            fh.write(block)
+
+    methods = [
+        ('legacy 1024B loop',legacy_send),
+        ('buffered 1MB',lambda sock,fh,count: FileSender(use_sendfile=False).send_range(sock,fh,0,count)),
+        ('sendfile',lambda sock,fh,count: FileSender().send_range(sock,fh,0,count)),
+    ]
+    try:
+        for (name,send) in methods:
+            best = min(run(name,send,path,size) for i in range(args.repeats))
+            print("{:20s} {:8.1f} MB/s".format(name,args.size/best))
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
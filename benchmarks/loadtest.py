@@ -0,0 +1,220 @@
+#!/usr/bin/python
+"""Loopback load test of ServerConnect and ClientServer
+
+Starts the server on 127.0.0.1 with a stub downloader which writes synthetic mp4/mp3 files of the
+given size, then runs N clients at the same time, each in its own process and folder.
+Reports files/sec, MB/s, latency percentiles per stage and peak RSS of server and clients.
+
+Stages (seconds, measured by the clients):
+    connect     : connect + sending LINKS/RESUME
+    first_file  : end of connect until the first FILE_HEADER arrives
+    file        : transfer of one file, FILE_HEADER to FILE_END
+    session     : whole client run
+
+Usage : python benchmarks/loadtest.py [-n clients] [-l links] [-s size_in_mb] [-d download_delay]
+                                      [--shared] [--json out.json] [--compare old.json]
+Results written with --json carry the git revision and parameters, --compare prints the change
+against such a file, so runs of two commits can be compared.
+"""
+import os,sys
+import argparse
+import json
+import resource
+import shutil
+import subprocess as sp
+import tempfile
+import threading
+import time
+import multiprocessing
+from timeit import default_timer as timer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0,ROOT)
+from logModule import setupLogging
+from downloaderModule import DownloaderBackend
+import server_oop
+from youtubeClass import Youtubedl
+
+
+class StubBackend(DownloaderBackend):
+    """Downloader writing synthetic media instead of calling youtube-dl
+    """
+    name = 'stub'
+    #Set by main() before the server starts
+    size = 1024*1024
+    delay = 0.0
+    block = os.urandom(1024*1024)
+
+    def write(self,path,size):
+        with open(path,'wb') as fh:
+            while size > 0:
+                fh.write(self.block[:size])
+                size -= len(self.block)
+
+    def download(self,job,extractAudio=True):
+        time.sleep(self.delay)
+        videoFile = "{}{}.mp4".format(job.folder,job.link)
+        self.write(videoFile,self.size)
+        if extractAudio:
+            self.write(os.path.splitext(videoFile)[0]+'.mp3',max(1,self.size//10))
+        return(videoFile,'')
+
+
+def stubYoutubedl(parentFolder):
+    """Function to build the Youtubedl factory used by the server
+    """
+    def factory(links,concurrency):
+        yt = Youtubedl(links,concurrency,parentFolder,backend='subprocess')
+        yt.checkYoutubeDl = lambda: None
+        yt.backend = StubBackend(yt)
+        return(yt)
+    return(factory)
+
+
+def runClient(port,links,folder,ready,start,results):
+    """Function run in every client process. Waits for start so process start up is not measured
+    """
+    os.chdir(folder)
+    setupLogging(level='WARNING')
+    from client_oop import ClientServer
+    client = ClientServer(','.join(links),'127.0.0.1',port)
+    ready.release()
+    start.wait()
+    durations = []
+    real_recv_file = client.recv_file
+
+    def recv_file(receiver,header):
+        taken = real_recv_file(receiver,header)
+        durations.append(taken)
+        return(taken)
+    client.recv_file = recv_file
+    t1 = timer()
+    client.setup_client()
+    client.send_data()
+    t2 = timer()
+    client.recv_data()
+    client.cobj.close()
+    t3 = timer()
+    size = sum(os.path.getsize(name) for name in os.listdir('.') if name.endswith(('.mp3','.mp4')))
+    results.put({'connect' : t2-t1, 'first_file' : client.first_file_time, 'file' : durations, 'session' : t3-t1,
+                 'files' : len(durations), 'bytes' : size, 'failed' : len(client.failed_files),
+                 'maxrss_kb' : resource.getrusage(resource.RUSAGE_SELF).ru_maxrss})
+
+
+def percentiles(values):
+    values = sorted(v for v in values if v is not None)
+    if not values:
+        return({})
+    pick = lambda p: values[min(len(values)-1,int(round(p/100.0*(len(values)-1))))]
+    return({'p50' : pick(50), 'p90' : pick(90), 'p99' : pick(99), 'max' : values[-1]})
+
+
+def gitRevision():
+    try:
+        return(sp.check_output(['git','rev-parse','--short','HEAD'],cwd=ROOT,stderr=sp.DEVNULL).decode().strip())
+    except (OSError,sp.CalledProcessError):
+        return(None)
+
+
+def run(args,folder):
+    """Function to run one load test
+    Output : result dictionary
+    """
+    StubBackend.size = int(args.size*1024*1024)
+    StubBackend.delay = args.delay
+    os.chdir(folder)
+    server_oop.Youtubedl = stubYoutubedl(os.path.join(folder,'server')+'/')
+    server = server_oop.ServerConnect('127.0.0.1',0,args.clients,args.concurrency,os.path.join(folder,'cache'),args.cache_size)
+    server.setup_server()
+    port = server.so_obj.getsockname()[1]
+    threading.Thread(target=server.run_server,name='server',daemon=True).start()
+
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    ready = context.Semaphore(0)
+    start = context.Event()
+    processes = []
+    for index in range(args.clients):
+        clientFolder = os.path.join(folder,'client{}'.format(index))
+        os.makedirs(clientFolder)
+        prefix = 'shared' if args.shared else 'c{}'.format(index)
+        links = ['{}l{}'.format(prefix,i) for i in range(args.links)]
+        processes.append(context.Process(target=runClient,args=(port,links,clientFolder,ready,start,results)))
+    for p in processes:
+        p.start()
+    for p in processes:
+        ready.acquire()
+    t1 = timer()
+    start.set()
+    clients = [results.get() for p in processes]
+    elapsed = timer()-t1
+    for p in processes:
+        p.join()
+
+    files = sum(c['files'] for c in clients)
+    size = sum(c['bytes'] for c in clients)
+    return({'revision' : gitRevision(),
+            'params' : {'clients' : args.clients, 'links' : args.links, 'size_mb' : args.size, 'delay' : args.delay,
+                        'shared' : args.shared, 'concurrency' : args.concurrency},
+            'elapsed' : elapsed, 'files' : files, 'failed' : sum(c['failed'] for c in clients),
+            'files_per_sec' : files/elapsed, 'mb_per_sec' : size/(1024.0*1024)/elapsed,
+            'latency' : dict((stage,percentiles([v for c in clients for v in (c[stage] if stage == 'file' else [c[stage]])]))
+                             for stage in ('connect','first_file','file','session')),
+            'cache' : server.media_cache.stats(),
+            'server_maxrss_kb' : resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            'client_maxrss_kb' : max(c['maxrss_kb'] for c in clients)})
+
+
+def report(result,old=None):
+    """Function to print a result, with the change against an older result
+    """
+    def line(name,value,oldValue,unit):
+        change = ""
+        if oldValue:
+            change = " ({:+.1f}%)".format(100.0*(value-oldValue)/oldValue)
+        print("{:<24} {:>12.3f} {}{}".format(name,value,unit,change))
+    old = old or {}
+    print("revision {} params {}".format(result['revision'],result['params']))
+    print("files {} failed {} in {:.2f} sec".format(result['files'],result['failed'],result['elapsed']))
+    line('files/sec',result['files_per_sec'],old.get('files_per_sec'),'')
+    line('MB/sec',result['mb_per_sec'],old.get('mb_per_sec'),'')
+    for (stage,values) in result['latency'].items():
+        for (p,value) in values.items():
+            line("{} {}".format(stage,p),value*1000,old.get('latency',{}).get(stage,{}).get(p,0)*1000,'ms')
+    line('server peak RSS',result['server_maxrss_kb']/1024.0,old.get('server_maxrss_kb',0)/1024.0,'MB')
+    line('client peak RSS',result['client_maxrss_kb']/1024.0,old.get('client_maxrss_kb',0)/1024.0,'MB')
+    print("media cache {}".format(result['cache']))
+
+
+def getArgs():
+    parser = argparse.ArgumentParser(description='Loopback load test of the download server and client')
+    parser.add_argument('-n','--clients',dest='clients',type=int,default=4,help='Concurrent clients (default 4)')
+    parser.add_argument('-l','--links',dest='links',type=int,default=4,help='Links per client (default 4)')
+    parser.add_argument('-s','--size',dest='size',type=float,default=8,help='Size of every synthetic mp4 in MB, mp3 is a tenth (default 8)')
+    parser.add_argument('-d','--delay',dest='delay',type=float,default=0,help='Seconds every stub download takes (default 0)')
+    parser.add_argument('-c','--concurrency',dest='concurrency',type=int,default=1,help='Server download concurrency per client (default 1)')
+    parser.add_argument('--shared',dest='shared',action='store_true',help='All clients ask for the same links (media cache hits)')
+    parser.add_argument('--cache-size',dest='cache_size',type=int,default=10*1024,help='Media cache budget in MB (default 10240)')
+    parser.add_argument('--json',dest='json',help='Write the result to this file')
+    parser.add_argument('--compare',dest='compare',help='Result file of an earlier run to compare with')
+    return(parser.parse_args())
+
+
+if __name__ == "__main__":
+    args = getArgs()
+    setupLogging(level='WARNING',outputLevel='WARNING')
+    cwd = os.getcwd()
+    folder = tempfile.mkdtemp()
+    try:
+        result = run(args,folder)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(folder)
+    old = None
+    if args.compare:
+        with open(args.compare) as fh:
+            old = json.load(fh)
+    report(result,old)
+    if args.json:
+        with open(args.json,'w') as fh:
+            json.dump(result,fh,indent=2)
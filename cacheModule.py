@@ -0,0 +1,156 @@
+#!/usr/bin/python
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from linkModule import video_id
+
+
+class MediaCache(object):
+    """Class to keep downloaded media on the server, keyed by video id and format.
+       Files live in <folder>/<video id>/<format>/<file name>. Total size is kept under max_bytes by
+       evicting the least recently used entries. Entries being sent to a client are pinned and never evicted
+    """
+    def __init__(self,folder,max_bytes):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        #key -> {'path' : path, 'size' : size}, least recently used first
+        self.entries = OrderedDict()
+        #key -> number of sessions using the entry
+        self.pins = {}
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+        self.load()
+
+    def key(self,link,fmt):
+        return("{}/{}".format(video_id(link),fmt))
+
+    def load(self):
+        """Function to index the files left by a previous run, oldest modification time first
+        """
+        found = []
+        for vid in os.listdir(self.folder):
+            for fmt in os.listdir(os.path.join(self.folder,vid)):
+                entry_folder = os.path.join(self.folder,vid,fmt)
+                names = os.listdir(entry_folder)
+                if len(names) != 1:
+                    #Interrupted put, drop it
+                    shutil.rmtree(entry_folder,ignore_errors=True)
+                    continue
+                path = os.path.join(entry_folder,names[0])
+                st = os.stat(path)
+                found.append((st.st_mtime,"{}/{}".format(vid,fmt),path,st.st_size))
+        for (mtime,key,path,size) in sorted(found):
+            self.entries[key] = {'path' : path, 'size' : size}
+            self.total_bytes += size
+        with self.lock:
+            self.evict(0)
+
+    def contains(self,link,fmt):
+        """Function to check if a file is cached, without pinning it or counting a lookup
+        """
+        with self.lock:
+            return(self.key(link,fmt) in self.entries)
+
+    def lookup(self,link,fmt):
+        """Function to check if a file a client asked for is cached, counting a hit or a miss.
+        Called once per requested file, pinning with acquire() is not counted
+        """
+        with self.lock:
+            found = self.key(link,fmt) in self.entries
+            if found:
+                self.hits += 1
+            else:
+                self.misses += 1
+            return(found)
+
+    def acquire(self,link,fmt):
+        """Function to pin a cached file until release()
+        Output : path or None when it is not cached
+        """
+        key = self.key(link,fmt)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return(None)
+            self.entries.move_to_end(key)
+            self.pins[key] = self.pins.get(key,0)+1
+        #Modification time keeps the LRU order across restarts
+        try:
+            os.utime(entry['path'])
+        except OSError:
+            pass
+        return(entry['path'])
+
+    def release(self,link,fmt):
+        """Function to unpin an entry returned by acquire() or put()
+        """
+        key = self.key(link,fmt)
+        with self.lock:
+            count = self.pins.get(key,0)-1
+            if count > 0:
+                self.pins[key] = count
+            else:
+                self.pins.pop(key,None)
+            self.evict(0)
+
+    def put(self,link,fmt,path):
+        """Function to move a downloaded file into the cache. The entry is returned pinned.
+        Files larger than the whole budget are not cached
+        Output : cached path or None if the file was not cached
+        """
+        key = self.key(link,fmt)
+        size = os.path.getsize(path)
+        if size > self.max_bytes:
+            return(None)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.evict(size)
+                entry_folder = os.path.join(self.folder,key)
+                os.makedirs(entry_folder,exist_ok=True)
+                target = os.path.join(entry_folder,os.path.basename(path))
+                shutil.move(path,target)
+                entry = {'path' : target, 'size' : size}
+                self.entries[key] = entry
+                self.total_bytes += size
+            else:
+                #Same video cached meanwhile by another session
+                self.entries.move_to_end(key)
+            self.pins[key] = self.pins.get(key,0)+1
+            return(entry['path'])
+
+    def evict(self,needed):
+        """Function to remove unpinned least recently used entries until needed more bytes fit in the budget.
+        Called with self.lock held
+        """
+        for key in list(self.entries):
+            if self.total_bytes+needed <= self.max_bytes:
+                break
+            if key in self.pins:
+                continue
+            entry = self.entries.pop(key)
+            entry_folder = os.path.dirname(entry['path'])
+            shutil.rmtree(entry_folder,ignore_errors=True)
+            try:
+                #Video folder goes too once its last format is evicted
+                os.rmdir(os.path.dirname(entry_folder))
+            except OSError:
+                pass
+            self.total_bytes -= entry['size']
+            self.evictions += 1
+            self.evicted_bytes += entry['size']
+
+    def stats(self):
+        """Function to return the cache counters
+        """
+        with self.lock:
+            return({'hits' : self.hits, 'misses' : self.misses, 'evictions' : self.evictions,
+                    'evicted_bytes' : self.evicted_bytes, 'entries' : len(self.entries),
+                    'bytes' : self.total_bytes, 'max_bytes' : self.max_bytes})
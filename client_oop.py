@@ -10,8 +10,11 @@ try:
     import pdb
     import socket
     from timeit import default_timer as timer
-    from logModule import Logs
-    import os
+    from logModule import Logs, setupLogging
+    import protocolModule as protocol
+    from transferModule import FileReceiver, HashCache, hash_file
+    from linkModule import LinkSource, iter_unique, batched
+    from profileModule import FormatProfile, KINDS
 except ImportError:
     raise ImportError("\n -E- Encountered import python exception!!!")
 
@@ -19,17 +22,44 @@ except ImportError:
 class ClientServer(object):
     """Class to setup Client server connection, send and receive messages
     """
-    def __init__(self,link):
+    def __init__(self,link,server_ip='192.168.0.101',port=1947,job=None):
         #self.link = link.split(',')
         self.link = link
+        #Server job to fetch instead of sending links, set by the server's JOB reply otherwise
+        self.job = job
         #Create logger instance to save the logs
         self.lobj = Logs("client_logs.txt")
         #Create socket
         self.cobj = ""
-        #Server Side download status check
-        self.download_status_flag = 1
-        #Download (File recv) speed over the network
+        #Latest state of every link reported by the server : link -> PROGRESS update
+        self.progress = {}
+        #Aggregate download (File recv) speed over the network in MB/s
         self.nw_speed = 0
+        #Per file download speed in MB/s
+        self.file_speeds = {}
+        #Partially received files : name -> sha256 hasher of the prefix which can be resumed
+        self.partials = {}
+        #Files which failed the integrity check
+        self.failed_files = []
+        #Only submit the links, the files are fetched later with the job id
+        self.detach = False
+        #Files wanted of every link and the mp3 bitrate. The server downloads only what it asks for
+        self.profile = FormatProfile()
+        #Send a manifest of the files in the current folder, so the server skips the ones held already
+        self.sync = False
+        #sha256 of the local files, kept in hash_file across runs. Opened on first use
+        self.hash_file = "client_hashes.db"
+        self.hash_cache = None
+        #Files the server did not send because they are held already
+        self.skipped = 0
+        #Seconds between waiting for the server and the first file arriving
+        self.first_file_time = None
+        #Server Local IP
+        self.server_ip = server_ip
+        #Server Public IP
+        #self.server_ip = '73.90.155.22'
+        #Connect to server on this port
+        self.port = port
 
     def setup_client(self):
         """Function to setup client 
@@ -41,13 +71,6 @@ class ClientServer(object):
             self.lobj.logger(e)
             self.lobj.logger.error("Fail to create a socket")
             raise e
-        
-        #Server Local IP
-        self.server_ip = '192.168.0.101'
-        #Server Public IP
-        #self.server_ip = '73.90.155.22'
-        #Connect to server on this port
-        self.port = 1947 
 
     def connect_server(self):
         try:
@@ -59,94 +82,233 @@ class ClientServer(object):
             self.lobj.logger.error("Failed to connect to server")
             raise e
 
+    def send_links(self,msg_type):
+        """Function to send the links in msg_type messages of at most LINK_BATCH links, then an empty one.
+        A link file is read lazily and repeated videos are dropped, so the server starts on the first
+        batch while the rest of the file is still being read
+        Output : number of links sent
+        """
+        count = 0
+        for batch in batched(iter_unique(LinkSource(self.link)),protocol.LINK_BATCH):
+            protocol.send_json(self.cobj,msg_type,batch)
+            count += len(batch)
+        protocol.send_json(self.cobj,msg_type,[])
+        self.lobj.logger.info("Sent {} links to server".format(count))
+        return(count)
+
     def send_data(self):
-        """Function to send data to server
+        """Function to send the links, or the id of the job to fetch, to server
         """
-        '''
-        self.lobj.logger.info("Receiving below handshake signal from server {}".format(socket.gethostname()))
-        try:
-            self.lobj.logger.info("{}".format(self.cobj.recv(1024)))
-            #self.lobj.logger.info("Data received successfully.")
-        except Exception as e:
-            self.lobj.logger.error(e)
-            self.lobj.logger.error("Could not recv data from server")
-            raise e
-        '''
         self.connect_server()
-        self.lobj.logger.info("Sending below youtube-link(s) to server")
         try:
-            #for link in self.link:
-            self.lobj.logger.info(self.link)
-                #self.cobj.send(link)
-            self.cobj.sendall(self.link)
+            if self.job:
+                self.lobj.logger.info("Fetching job {} from server".format(self.job))
+                protocol.send_json(self.cobj,protocol.MSG_FETCH,{'job' : self.job})
+            else:
+                self.lobj.logger.info("Sending youtube-link(s) from {} to server".format(self.link))
+                protocol.send_json(self.cobj,protocol.MSG_PROFILE,self.profile.to_json())
+                self.send_links(protocol.MSG_LINKS)
+            protocol.send_json(self.cobj,protocol.MSG_RESUME,self.find_partials())
+            protocol.send_json(self.cobj,protocol.MSG_MANIFEST,self.build_manifest() if self.sync else {})
         except Exception as e:
             self.lobj.logger.error(e)
             self.lobj.logger.error("Failure to send the data")
 
-        self.cobj.shutdown(socket.SHUT_WR)
+    def submit(self):
+        """Function to queue the links on the server without waiting for the files
+        Output : job id to fetch the files with later
+        """
+        self.connect_server()
+        protocol.send_json(self.cobj,protocol.MSG_PROFILE,self.profile.to_json())
+        self.send_links(protocol.MSG_SUBMIT)
+        self.job = self.expect_json(protocol.MSG_JOB)['job']
+        self.lobj.logger.info("Server queued job {}. Fetch its files with --job {}".format(self.job,self.job))
+        return(self.job)
+
+
+    def find_partials(self):
+        """Function to collect the .part files left by an interrupted transfer.
+        The .part.progress file tells how many bytes are really on disk, even if the client was killed
+        and the .part file still has its preallocated size. Offset is rounded down to a resume block
+        Output : list of {'name','offset','sha256'} to send to server
+        """
+        partials = []
+        for part in glob.glob('*.part'):
+            name = part[:-len('.part')]
+            offset = os.path.getsize(part)
+            try:
+                with open(part+'.progress') as fh:
+                    offset = min(offset,int(fh.read()))
+            except (IOError,ValueError):
+                pass
+            offset -= offset % protocol.RESUME_BLOCK
+            if not offset:
+                continue
+            hasher = hash_file(part,offset)
+            self.partials[name] = (offset,hasher)
+            partials.append({'name' : name, 'offset' : offset, 'sha256' : hasher.hexdigest()})
+            self.lobj.logger.info("Found partial file {} with {} bytes".format(name,offset))
+        return(partials)
+
+    def hashes(self):
+        """Function to return the hash cache of the local files, opening it on first use
+        """
+        if self.hash_cache is None:
+            self.hash_cache = HashCache(protocol.RESUME_BLOCK,self.hash_file)
+        return(self.hash_cache)
+
+    def build_manifest(self):
+        """Function to list the media files in the current folder with their size and sha256.
+        Hashes come from the hash cache, only files new or changed since the last run are read
+        Output : {name : [size,sha256]} to send to server
+        """
+        manifest = {}
+        for name in glob.glob('*.mp*'):
+            if name.endswith(('.part','.progress')) or not os.path.isfile(name):
+                continue
+            manifest[name] = [os.path.getsize(name),self.hashes().digest(name)]
+        self.lobj.logger.info("Manifest of {} local files".format(len(manifest)))
+        return(manifest)
 
+    def show_progress(self,payload):
+        """Function to record and display the link states of a PROGRESS message
+        """
+        for update in protocol.decode_json(payload):
+            self.progress[update['link']] = update
+            if update['state'] != 'downloading':
+                self.lobj.logger.info("{} : {}".format(update['link'],update['state']))
+                continue
+            total = update.get('total_bytes') or 0
+            done = update.get('downloaded_bytes') or 0
+            percent = 100.0*done/total if total else 0.0
+            speed = "{:.2f} MB/sec".format(update['speed']/(1024*1024)) if update.get('speed') else "unknown speed"
+            eta = "{} sec".format(update['eta']) if update.get('eta') is not None else "unknown"
+            self.lobj.logger.info("{} : downloading {:.1f}% of {:.2f} MB at {} ETA {}".format(update['link'],percent,float(total)/(1024*1024),speed,eta))
 
-    def check_status(self):
-        """Function to check the server status every 5 sec
+    def expect_json(self,msg_type):
+        """Function to read the next control message of the given type, showing PROGRESS messages sent before it
         """
-        #time.sleep(5)
-        self.lobj.logger.info("Receiving Download Status from Server {}".format(socket.gethostname()))
-        while self.download_status_flag:
-            self.lobj.logger.info("Downloading is in progress")
-            time.sleep(5)
+        while True:
+            (received_type,payload) = protocol.recv_message(self.cobj)
+            if received_type != protocol.MSG_PROGRESS:
+                break
+            self.show_progress(payload)
+        if received_type == protocol.MSG_ERROR:
+            raise protocol.ProtocolError("Server reported error: {}".format(protocol.decode_json(payload)))
+        if received_type != msg_type:
+            raise protocol.ProtocolError("Expected {} but got {}".format(protocol.MSG_NAMES[msg_type],protocol.MSG_NAMES[received_type]))
+        return(protocol.decode_json(payload))
 
-    def recv_file(self,filename,size):
+    def recv_file(self,receiver,header):
+        """Function to receive the CHUNK messages of one file into name.part, check its FILE_END
+        sha256 against the hash computed while receiving and rename it
+        Output : time taken in seconds
+        """
+        (filename,size,offset) = (header['name'],header['size'],header['offset'])
+        part = filename+'.part'
+        progress = part+'.progress'
         self.lobj.logger.info("Receiving dowloaded mp3 from server..")
-        with open(filename,'wb') as fh:
-            t1 = timer()
-            data = self.cobj.recv(1024)
-            fh.write(data)
-            recv_data = len(data)
+        t1 = timer()
+        hasher = None
+        if offset:
+            (partial_offset,hasher) = self.partials.pop(filename,(None,None))
+            if partial_offset != offset:
+                raise protocol.ProtocolError("Server resumes {} at {} but no such partial file exists".format(filename,offset))
+        incoming = receiver.open_file(part,size,offset,hasher,progress)
+        recv_data = offset
+        try:
             while recv_data < size:
-                try:
-                    data = self.cobj.recv(1024)
-                    fh.write(data)
-                    recv_data += len(data)
-                except Exception as e:
-                    self.lobj.logger.error("Failed to recv data from server")
-            t2 = time.time()
-        self.lobj.logger.info("Finished Receiving")
-        self.nw_speed = (float(size)/(1024*1024)) / (t2 - t1)
+                (msg_type,length) = protocol.recv_header(self.cobj)
+                if msg_type == protocol.MSG_PROGRESS:
+                    #Progress of other links is sent between chunks
+                    self.show_progress(protocol.recv_exact(self.cobj,length))
+                    continue
+                if msg_type == protocol.MSG_ERROR:
+                    raise protocol.ProtocolError("Server reported error: {}".format(protocol.decode_json(protocol.recv_exact(self.cobj,length))))
+                if msg_type != protocol.MSG_CHUNK:
+                    raise protocol.ProtocolError("Expected CHUNK but got {}".format(protocol.MSG_NAMES[msg_type]))
+                receiver.recv_into_file(self.cobj,incoming,length)
+                recv_data += length
+        except Exception:
+            #Close the file without hiding the original error. Partial file stays for the next attempt
+            try:
+                receiver.finish_file(incoming)
+            except Exception as e:
+                self.lobj.logger.error("Failed to write {}: {}".format(part,e))
+            raise
+        receiver.finish_file(incoming)
+        trailer = self.expect_json(protocol.MSG_FILE_END)
+        t2 = timer()
+        #Hash was computed while receiving, no second read of the file
+        if incoming.hasher.hexdigest() != trailer['sha256']:
+            self.lobj.logger.error("Checksum mismatch for {}. Discarding it".format(filename))
+            os.remove(part)
+            self.failed_files.append(filename)
+        else:
+            os.replace(part,filename)
+            if self.sync:
+                #Hash was computed while receiving, next manifest does not read the file
+                self.hashes().put(self.hashes().key(filename),trailer['sha256'],[])
+        os.remove(progress)
+        self.file_speeds[filename] = (float(size-offset)/(1024*1024)) / max(t2 - t1,1e-9)
+        self.lobj.logger.info("Finished Receiving {} at {:.2f} MB/sec".format(filename,self.file_speeds[filename]))
+        return(t2 - t1)
         
 
     def recv_data(self):
         """Function to receive the data (downloaded youtube file) from server
-        For each link server will send mp3 and mp4 file
-        1. Based on total no of links twice no of files will be created
+        For each link server will send mp3 and mp4 file, then an END message
         """
-        i = 0
         self.lobj.logger.info("Waiting for server to send the files")
-        no_of_files = self.cobj.recv(1024)
-        self.lobj.logger.info("Total no of files to be received from server is : {}".format(no_of_files))
-        while i < int(no_of_files):
-            length_of_file = int(self.cobj.recv(1024))
-            self.download_status_flag=0 #Reset download_status flag indicating server is ready to transfert the file
-            time.sleep(1)
-            name_of_file = self.cobj.recv(1024)
-            self.lobj.logger.info("Receiving File From Server :: Name -> {} Size -> {} bytes".format(name_of_file,length_of_file))
-            time.sleep(1)
-            self.recv_file(name_of_file,length_of_file)
-            time.sleep(2)
-            i += 1
+        receiver = FileReceiver()
+        total_size = 0
+        total_time = 0
+        t0 = timer()
+        try:
+            while True:
+                (msg_type,payload) = protocol.recv_message(self.cobj)
+                if msg_type == protocol.MSG_END:
+                    end = protocol.decode_json(payload)
+                    self.skipped = end.get('skipped',0)
+                    self.lobj.logger.info("Total no of files received from server is : {}, already held : {}".format(end['files'],self.skipped))
+                    break
+                if msg_type == protocol.MSG_PROGRESS:
+                    self.show_progress(payload)
+                    continue
+                if msg_type == protocol.MSG_JOB:
+                    self.job = protocol.decode_json(payload)['job']
+                    self.lobj.logger.info("Server job {}. If the connection is lost fetch its files with --job {}".format(self.job,self.job))
+                    continue
+                if msg_type == protocol.MSG_ERROR:
+                    raise protocol.ProtocolError("Server reported error: {}".format(protocol.decode_json(payload)))
+                if msg_type != protocol.MSG_FILE_HEADER:
+                    raise protocol.ProtocolError("Expected FILE_HEADER but got {}".format(protocol.MSG_NAMES[msg_type]))
+                header = protocol.decode_json(payload)
+                if self.first_file_time is None:
+                    #Server streams each file as soon as its link is downloaded
+                    self.first_file_time = timer() - t0
+                    self.lobj.logger.info("First file arrived after {:.2f} sec".format(self.first_file_time))
+                self.lobj.logger.info("Receiving File From Server :: Name -> {} Size -> {} bytes Offset -> {}".format(header['name'],header['size'],header['offset']))
+                total_time += self.recv_file(receiver,header)
+                total_size += header['size'] - header['offset']
+        finally:
+            receiver.close()
+        if total_time:
+            self.nw_speed = (float(total_size)/(1024*1024)) / total_time
          
 
     def runTest(self):
         #Define steps here
         self.setup_client()
+        if self.detach:
+            self.submit()
+            self.cobj.close()
+            return
         self.send_data()
-        t1 = threading.Thread(target=self.check_status)
-        t2 = threading.Thread(target=self.recv_data)
-        t1.start()
-        t2.start()
-        t1.join()
-        t2.join()
-        time.sleep(1)
-        self.lobj.logger.info("Network Speed is {} mb/sec".format(self.nw_speed))
+        #Server pushes PROGRESS messages with the files, no status polling needed
+        self.recv_data()
+        self.cobj.close()
+        self.lobj.logger.info("Network Speed is {:.2f} MB/sec".format(self.nw_speed))
         self.lobj.logger.info("Thank-you for downloading....Exit")
         #self.recv_data()
         #Just wait
@@ -156,13 +318,27 @@ def getArgs():
     """Function to get command line arguments
     """
     parser = argparse.ArgumentParser(description='Script to send youtube links to server which will download the files and will send  back to client', formatter_class=argparse.RawTextHelpFormatter)
-    parser.add_argument('-l','--link',dest='link',help='Single or multiple links separated by csv or a file containing youtube links per line',required=True)
+    parser.add_argument('-l','--link',dest='link',default='',help='Single or multiple links separated by csv or a file containing youtube links per line')
+    parser.add_argument('-j','--job',dest='job',help='Fetch the files of a job submitted earlier instead of sending links')
+    parser.add_argument('-d','--detach',dest='detach',action='store_true',help='Only queue the links on the server and print the job id to fetch them with')
+    parser.add_argument('-f','--formats',dest='formats',choices=KINDS,default='both',help='audio : mp3 only, the server downloads an audio only stream\nvideo : mp4 only\nboth : mp3 and mp4 (default)')
+    parser.add_argument('--bitrate',dest='bitrate',type=int,help='Bitrate of the mp3 in kbit/s (default VBR quality of the server)')
+    parser.add_argument('--sync',dest='sync',action='store_true',help='Send the list of files in the current folder, the server sends\nonly the files missing or changed here')
+    parser.add_argument('-s','--server',dest='server',default='192.168.0.101',help='Server IP (default 192.168.0.101)')
+    parser.add_argument('-p','--port',dest='port',type=int,default=1947,help='Server port (default 1947)')
+    parser.add_argument('--log-level',dest='log_level',default='DEBUG',choices=['DEBUG','INFO','WARNING','ERROR'],help='Console log level (default DEBUG)')
     args = parser.parse_args()
-    return args.link
+    if not args.link and not args.job:
+        parser.error('one of -l/--link or -j/--job is required')
+    return args
 
 
 if __name__ == '__main__':
-    link = getArgs()
-    obj = ClientServer(link.strip())
+    args = getArgs()
+    setupLogging(level=args.log_level)
+    obj = ClientServer(args.link.strip(),args.server,args.port,args.job)
+    obj.detach = args.detach
+    obj.sync = args.sync
+    obj.profile = FormatProfile(args.formats,args.bitrate)
     obj.runTest()
 
@@ -0,0 +1,179 @@
+#!/usr/bin/python
+import os
+import time
+import threading
+
+#youtube-dl library, yt-dlp preferred. Only needed by LibraryBackend
+try:
+    import yt_dlp as ytdlLibrary
+except ImportError:
+    try:
+        import youtube_dl as ytdlLibrary
+    except ImportError:
+        ytdlLibrary = None
+
+#Names accepted by makeBackend
+BACKENDS = ('auto','subprocess','library')
+
+#Start of the line youtube-dl --exec prints with the path of the final file
+FILE_MARKER = 'YTDL_FILE:'
+
+
+class DownloadTimeout(Exception):
+    """Raised by LibraryBackend.progressHook to stop a download running longer than the runner timeout
+    """
+    pass
+
+
+def makeBackend(name,yt):
+    """Function to create the downloader backend of a Youtubedl object.
+       'auto' uses the library when it can be imported and falls back to the youtube-dl command
+    """
+    if name == 'auto':
+        name = 'library' if ytdlLibrary is not None else 'subprocess'
+    if name == 'library':
+        return(LibraryBackend(yt))
+    if name == 'subprocess':
+        return(SubprocessBackend(yt))
+    raise ValueError("Unknown downloader backend {}".format(name))
+
+
+class DownloaderBackend(object):
+    """Interface of a downloader. A backend fetches one job into job.folder
+    """
+    name = None
+
+    def __init__(self,yt):
+        #Youtubedl object owning logger and audio settings
+        self.yt = yt
+
+    def download(self,job,extractAudio=True):
+        """Function to download the mp4 of a job, and its mp3 when extractAudio is set.
+        When the profile of the Youtubedl object wants no video, only an audio stream is fetched
+        and the mp3 is extracted from it
+        Output : (path of the downloaded file, the mp3 path being derived from it, or None,output)
+        """
+        raise NotImplementedError
+
+
+class SubprocessBackend(DownloaderBackend):
+    """Runs the youtube-dl command once per link
+    """
+    name = 'subprocess'
+
+    def buildCmd(self,job,extractAudio):
+        """Function to build the youtube-dl command of a job.
+        restrict filename option is to create a file with ASCII char only. No space and & in filename.
+        --exec prints the path of the final file once it is post processed, so nothing has to be searched afterwards.
+        --print-json would do the same but silences youtube-dl, and the runner needs the progress lines
+        for progress events and to tell a running download from a stalled one.
+        --newline prints every progress update on its own line.
+        --continue resumes the .part file a failed attempt left in the job folder
+        """
+        options = "-f mp4"
+        if extractAudio:
+            audio = "-x --audio-quality {} --audio-format mp3".format(self.yt.profile.audio_quality(self.yt.audioQuality))
+            #Without video the smallest source is an audio only stream, deleted once the mp3 is extracted
+            options = "-k {} -f mp4".format(audio) if self.yt.profile.video else "{} -f bestaudio".format(audio)
+        return(r"""youtube-dl -o '{}%(title)s.%(ext)s' --restrict-filenames --continue --newline --exec "echo {} {{}}" {} {}""".format(
+            job.folder,FILE_MARKER,options,job.link))
+
+    def parseOutput(self,output):
+        """Function to read the path of the final file from the line printed by --exec
+        Output : path or None
+        """
+        for line in reversed(output.splitlines()):
+            if line.startswith(FILE_MARKER):
+                return(line[len(FILE_MARKER):].strip() or None)
+        return(None)
+
+    def download(self,job,extractAudio=True):
+        (output,statusCode) = self.yt.runCmd(self.buildCmd(job,extractAudio),1,onProgress=lambda event: self.yt.reportProgress(job,event))
+        if statusCode != 0:
+            return(None,output)
+        path = self.parseOutput(output)
+        #--exec runs after the extraction and reports the mp3. The kept video is the -f mp4 file next to it
+        if path and extractAudio and self.yt.profile.video:
+            path = os.path.splitext(path)[0]+'.mp4'
+        return(path,output)
+
+
+class LibraryBackend(DownloaderBackend):
+    """Calls the youtube-dl library in this process.
+       Every thread keeps one YoutubeDL object, so interpreter start and extractor setup are paid once per thread
+       instead of once per link. YoutubeDL objects are not thread safe and are never shared
+    """
+    name = 'library'
+
+    def __init__(self,yt,library=None):
+        DownloaderBackend.__init__(self,yt)
+        self.library = library or ytdlLibrary
+        if self.library is None:
+            raise ImportError("Neither yt_dlp nor youtube_dl can be imported")
+        self.local = threading.local()
+
+    def params(self,extractAudio):
+        """Function to build the YoutubeDL options equivalent to the youtube-dl command line
+        """
+        #No data for the stall timeout of the runner fails the download, same as for the youtube-dl command
+        params = {'format' : 'mp4', 'restrictfilenames' : True, 'quiet' : True, 'noprogress' : True,
+                  'continuedl' : True, 'socket_timeout' : self.yt.runner.stallTimeout, 'progress_hooks' : [self.progressHook]}
+        if extractAudio:
+            profile = self.yt.profile
+            if profile.video:
+                params['keepvideo'] = True
+            else:
+                params['format'] = 'bestaudio'
+            #preferredquality above 10 is a bitrate in kbit/s, else a VBR quality
+            quality = profile.bitrate if profile.bitrate is not None else self.yt.audioQuality
+            params['postprocessors'] = [{'key' : 'FFmpegExtractAudio', 'preferredcodec' : 'mp3', 'preferredquality' : str(quality)}]
+        return(params)
+
+    def progressHook(self,status):
+        """Function called by YoutubeDL while downloading, turns its status into the progress event of runnerModule.
+        Raising here aborts the download, which is how the runner timeout is enforced in this process
+        """
+        job = getattr(self.local,'job',None)
+        if job is None or status.get('status') != 'downloading':
+            return
+        if self.local.deadline is not None and time.monotonic() > self.local.deadline:
+            raise DownloadTimeout("Download of {} timed out after {} sec".format(job.link,self.yt.runner.timeout))
+        downloaded = status.get('downloaded_bytes') or 0
+        total = status.get('total_bytes') or status.get('total_bytes_estimate') or 0
+        self.yt.reportProgress(job,{'percent' : 100.0*downloaded/total if total else 0.0,
+                                    'downloaded_bytes' : downloaded, 'total_bytes' : total,
+                                    'speed' : status.get('speed'), 'eta' : status.get('eta')})
+
+    def downloader(self,extractAudio):
+        """Function to return the YoutubeDL object of this thread, creating it on first use
+        """
+        downloaders = getattr(self.local,'downloaders',None)
+        if downloaders is None:
+            downloaders = self.local.downloaders = {}
+        if extractAudio not in downloaders:
+            downloaders[extractAudio] = self.library.YoutubeDL(self.params(extractAudio))
+        return(downloaders[extractAudio])
+
+    def download(self,job,extractAudio=True):
+        ydl = self.downloader(extractAudio)
+        template = "{}%(title)s.%(ext)s".format(job.folder)
+        #Output template is read on every download, yt-dlp keeps it as a dict of templates
+        if isinstance(ydl.params.get('outtmpl'),dict):
+            ydl.params['outtmpl'] = {'default' : template}
+        else:
+            ydl.params['outtmpl'] = template
+        #Job of this thread and the time it has to be done by, for progressHook
+        self.local.job = job
+        self.local.deadline = time.monotonic()+self.yt.runner.timeout if self.yt.runner.timeout else None
+        try:
+            info = ydl.extract_info(job.link,download=True)
+        except Exception as e:
+            return(None,str(e))
+        finally:
+            self.local.job = None
+        videoFile = ydl.prepare_filename(info)
+        #Audio only source is gone after the extraction, the mp3 is what has to be there
+        expected = videoFile if not extractAudio or self.yt.profile.video else os.path.splitext(videoFile)[0]+'.mp3'
+        if not os.path.exists(expected):
+            return(None,"Downloaded file {} not found".format(expected))
+        return(videoFile,"")
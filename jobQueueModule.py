@@ -0,0 +1,159 @@
+#!/usr/bin/python
+import json
+import time
+import uuid
+import sqlite3
+import threading
+
+#States of a link of a job
+QUEUED = 'queued'
+RUNNING = 'running'
+FINISHED = 'finished'
+FAILED = 'failed'
+FINAL_STATES = (FINISHED,FAILED)
+
+
+class JobQueue(object):
+    """Persistent queue of download jobs. A job is the list of links a client submitted in one go.
+       Jobs and the state of every link are kept in sqlite, so queued work outlives the connection which
+       submitted it and a restart of the server. Links left running by a previous run are queued again on open
+    """
+
+    def __init__(self,job_file):
+        self.job_file = job_file
+        #Single connection shared by all threads, guarded by a lock
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.job_file,check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        #profile is the JSON of the format profile of the job
+        self.conn.execute("CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, created REAL, folder TEXT, profile TEXT)")
+        #Job files of earlier versions have no profile, their jobs keep the default one
+        if 'profile' not in [row[1] for row in self.conn.execute("PRAGMA table_info(jobs)")]:
+            self.conn.execute("ALTER TABLE jobs ADD COLUMN profile TEXT")
+        #audio/video are set only for finished files the media cache did not take
+        self.conn.execute("CREATE TABLE IF NOT EXISTS links (job TEXT, position INTEGER, link TEXT, state TEXT, "
+                          "audio TEXT, video TEXT, PRIMARY KEY (job, position))")
+        #Jobs of many links are updated one link at a time and checked for links still to do
+        self.conn.execute("CREATE INDEX IF NOT EXISTS links_link ON links (job, link)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS links_state ON links (job, state)")
+        #Downloads interrupted by the end of the previous run
+        self.recovered = self.conn.execute("UPDATE links SET state = ? WHERE state = ?",(QUEUED,RUNNING)).rowcount
+        self.conn.commit()
+
+    def submit(self,links,profile=None):
+        """Function to add a job
+        Input : links, JSON of the format profile or None for the default
+        Output : job id
+        """
+        job_id = uuid.uuid4().hex[:12]
+        with self.lock:
+            self.conn.execute("INSERT INTO jobs (id, created, profile) VALUES (?, ?, ?)",
+                              (job_id,time.time(),json.dumps(profile) if profile else None))
+            self.conn.executemany("INSERT INTO links (job, position, link, state) VALUES (?, ?, ?, ?)",
+                                  [(job_id,position,link,QUEUED) for (position,link) in enumerate(links)])
+            self.conn.commit()
+        return(job_id)
+
+    def add_links(self,job_id,links):
+        """Function to add links at the end of a job
+        """
+        with self.lock:
+            row = self.conn.execute("SELECT MAX(position) FROM links WHERE job = ?",(job_id,)).fetchone()
+            start = 0 if row[0] is None else row[0]+1
+            self.conn.executemany("INSERT INTO links (job, position, link, state) VALUES (?, ?, ?, ?)",
+                                  [(job_id,start+position,link,QUEUED) for (position,link) in enumerate(links)])
+            self.conn.commit()
+
+    def exists(self,job_id):
+        with self.lock:
+            return(self.conn.execute("SELECT 1 FROM jobs WHERE id = ?",(job_id,)).fetchone() is not None)
+
+    def profile(self,job_id):
+        """Function to return the JSON of the format profile of a job, None for the default
+        """
+        with self.lock:
+            row = self.conn.execute("SELECT profile FROM jobs WHERE id = ?",(job_id,)).fetchone()
+        return(json.loads(row[0]) if row and row[0] else None)
+
+    def links(self,job_id):
+        """Function to return the links of a job in submit order, every link once
+        Output : list of {'link','state','audio','video'}
+        """
+        with self.lock:
+            rows = self.conn.execute("SELECT link, state, audio, video FROM links WHERE job = ? ORDER BY position",(job_id,)).fetchall()
+        links = []
+        seen = set()
+        for (link,state,audio,video) in rows:
+            if link not in seen:
+                seen.add(link)
+                links.append({'link' : link, 'state' : state, 'audio' : audio, 'video' : video})
+        return(links)
+
+    def pending_jobs(self):
+        """Function to return the ids of the jobs with queued links, oldest first
+        """
+        with self.lock:
+            rows = self.conn.execute("SELECT DISTINCT jobs.id, jobs.created FROM jobs JOIN links ON links.job = jobs.id "
+                                     "WHERE links.state = ? ORDER BY jobs.created",(QUEUED,)).fetchall()
+        return([row[0] for row in rows])
+
+    def claim(self,job_id):
+        """Function to mark the queued links of a job running
+        Output : claimed links, empty when another worker got them first
+        """
+        with self.lock:
+            rows = self.conn.execute("SELECT link FROM links WHERE job = ? AND state = ? ORDER BY position",(job_id,QUEUED)).fetchall()
+            self.conn.execute("UPDATE links SET state = ? WHERE job = ? AND state = ?",(RUNNING,job_id,QUEUED))
+            self.conn.commit()
+        links = []
+        seen = set()
+        for (link,) in rows:
+            if link not in seen:
+                seen.add(link)
+                links.append(link)
+        return(links)
+
+    def set_state(self,job_id,link,state,audio=None,video=None):
+        with self.lock:
+            self.conn.execute("UPDATE links SET state = ?, audio = ?, video = ? WHERE job = ? AND link = ?",(state,audio,video,job_id,link))
+            self.conn.commit()
+
+    def requeue_failed(self):
+        """Function to queue the failed links of every job again
+        Output : ids of the jobs with links queued again
+        """
+        with self.lock:
+            rows = self.conn.execute("SELECT DISTINCT job FROM links WHERE state = ?",(FAILED,)).fetchall()
+            self.conn.execute("UPDATE links SET state = ? WHERE state = ?",(QUEUED,FAILED))
+            self.conn.commit()
+        return([row[0] for row in rows])
+
+    def set_folder(self,job_id,folder):
+        """Function to record the folder holding the files of a job which are not in the media cache
+        """
+        with self.lock:
+            self.conn.execute("UPDATE jobs SET folder = ? WHERE id = ?",(folder,job_id))
+            self.conn.commit()
+
+    def done(self,job_id):
+        """Function to check if every link of a job reached a final state
+        """
+        with self.lock:
+            row = self.conn.execute("SELECT COUNT(*) FROM links WHERE job = ? AND state IN (?, ?)",(job_id,QUEUED,RUNNING)).fetchone()
+        return(row[0] == 0)
+
+    def remove(self,job_id):
+        """Function to forget a job whose results were delivered
+        Output : folder of the job or None
+        """
+        with self.lock:
+            row = self.conn.execute("SELECT folder FROM jobs WHERE id = ?",(job_id,)).fetchone()
+            self.conn.execute("DELETE FROM links WHERE job = ?",(job_id,))
+            self.conn.execute("DELETE FROM jobs WHERE id = ?",(job_id,))
+            self.conn.commit()
+        return(row[0] if row else None)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,209 @@
+#!/usr/bin/python
+import os
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+#Ledgers opened in this process, one per ledger file
+ledgers = {}
+ledgersLock = threading.Lock()
+
+
+def getLedger(ledgerFile,legacyFile=None):
+    """Function to return the process wide ledger of ledgerFile, opening it on first use.
+       Sharing one instance keeps a single sqlite connection and a warm cache for all Youtubedl objects
+    """
+    with ledgersLock:
+        ledger = ledgers.get(ledgerFile)
+        if ledger is None:
+            ledger = DownloadLedger(ledgerFile,legacyFile)
+            ledgers[ledgerFile] = ledger
+        return(ledger)
+
+
+class DownloadLedger(object):
+    """Indexed ledger of already downloaded youtube links.
+       Entries are kept in a sqlite table keyed by link, with a small in-memory cache in front of it.
+    """
+
+    #sqlite limits the number of host parameters per statement, so batch lookups are chunked
+    batchSize = 500
+
+    def __init__(self,ledgerFile,legacyFile=None,cacheSize=10000,compactEvery=10000):
+        self.ledgerFile = ledgerFile
+        self.legacyFile = legacyFile
+        self.cacheSize = cacheSize
+        #link -> downloaded file, most recently used entries at the end
+        self.cache = OrderedDict()
+        #compact() runs automatically after this many inserts
+        self.compactEvery = compactEvery
+        self.inserts = 0
+        #Single connection shared by all threads, guarded by a lock
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.ledgerFile,check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS ledger (link TEXT PRIMARY KEY, filename TEXT)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        #Links whose last download failed, to be retried later
+        self.conn.execute("CREATE TABLE IF NOT EXISTS failed (link TEXT PRIMARY KEY, failures INTEGER, time REAL)")
+        self.conn.commit()
+        #Number of entries imported from the legacy text file on this start
+        self.imported = 0
+        if self.legacyFile and not self.getMeta('legacy_imported'):
+            self.imported = self.importLegacyFile(self.legacyFile)
+            if self.imported:
+                self.compact()
+
+    def getMeta(self,key):
+        """Function to read a value from the meta table
+        """
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = ?",(key,)).fetchone()
+        return(row[0] if row else None)
+
+    def setMeta(self,key,value):
+        """Function to store a value in the meta table
+        """
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",(key,value))
+            self.conn.commit()
+
+    def importLegacyFile(self,legacyFile):
+        """Function to import the old 'link,filename' per line text file into the ledger
+        Output : number of imported lines
+        """
+        count = 0
+        if os.path.exists(legacyFile):
+            with open(legacyFile) as fh:
+                rows = []
+                for line in fh:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    (link,_,filename) = line.partition(',')
+                    rows.append((link,filename))
+                    count += 1
+            with self.lock:
+                #First entry for a link wins, same as the old linear scan
+                self.conn.executemany("INSERT OR IGNORE INTO ledger (link, filename) VALUES (?, ?)",rows)
+                self.conn.commit()
+        self.setMeta('legacy_imported','1')
+        return(count)
+
+    def cacheGet(self,link):
+        """Function to return (hit,filename) from the in-memory cache
+        """
+        with self.lock:
+            if link in self.cache:
+                self.cache.move_to_end(link)
+                return(True,self.cache[link])
+        return(False,None)
+
+    def cachePut(self,link,filename):
+        """Function to add a link to the in-memory cache and evict the oldest entries
+        """
+        with self.lock:
+            self.cache[link] = filename
+            self.cache.move_to_end(link)
+            while len(self.cache) > self.cacheSize:
+                self.cache.popitem(last=False)
+
+    def getFile(self,link):
+        """Function to return the downloaded file of a link, or None if link was never downloaded
+        """
+        (hit,filename) = self.cacheGet(link)
+        if hit:
+            return(filename)
+        with self.lock:
+            row = self.conn.execute("SELECT filename FROM ledger WHERE link = ?",(link,)).fetchone()
+        if row:
+            self.cachePut(link,row[0])
+            return(row[0])
+        return(None)
+
+    def isDownloaded(self,link):
+        """Function to check if link is present in the ledger
+        """
+        return(self.getFile(link) is not None)
+
+    def lookupLinks(self,links):
+        """Function to check a whole list of links in one go
+        Input : iterable of links
+        Output : dictionary of link -> downloaded file for links present in the ledger
+        """
+        found = {}
+        missing = []
+        for link in links:
+            (hit,filename) = self.cacheGet(link)
+            if hit:
+                found[link] = filename
+            else:
+                missing.append(link)
+        for i in range(0,len(missing),self.batchSize):
+            batch = missing[i:i+self.batchSize]
+            query = "SELECT link, filename FROM ledger WHERE link IN ({})".format(','.join('?'*len(batch)))
+            with self.lock:
+                rows = self.conn.execute(query,batch).fetchall()
+            for (link,filename) in rows:
+                found[link] = filename
+                self.cachePut(link,filename)
+        return(found)
+
+    def addLink(self,link,filename):
+        """Function to record a downloaded link and its file
+        """
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO ledger (link, filename) VALUES (?, ?)",(link,filename))
+            self.conn.commit()
+            self.inserts += 1
+            needCompact = self.compactEvery and self.inserts % self.compactEvery == 0
+        self.cachePut(link,filename)
+        if needCompact:
+            self.compact()
+
+    def addFailure(self,link):
+        """Function to record a failed download of link
+        """
+        with self.lock:
+            self.conn.execute("INSERT OR IGNORE INTO failed (link, failures, time) VALUES (?, 0, ?)",(link,time.time()))
+            self.conn.execute("UPDATE failed SET failures = failures + 1, time = ? WHERE link = ?",(time.time(),link))
+            self.conn.commit()
+
+    def removeFailure(self,link):
+        """Function to forget the failures of a link which was downloaded
+        """
+        with self.lock:
+            self.conn.execute("DELETE FROM failed WHERE link = ?",(link,))
+            self.conn.commit()
+
+    def failedLinks(self):
+        """Function to return the links whose last download failed, oldest failure first
+        """
+        with self.lock:
+            rows = self.conn.execute("SELECT link FROM failed ORDER BY time").fetchall()
+        return([row[0] for row in rows])
+
+    def count(self):
+        """Function to return the number of links in the ledger
+        """
+        with self.lock:
+            return(self.conn.execute("SELECT COUNT(*) FROM ledger").fetchone()[0])
+
+    def compact(self):
+        """Function to checkpoint the write ahead log and reclaim free pages.
+           Called after a legacy import and every compactEvery inserts
+        """
+        with self.lock:
+            self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self.conn.execute("VACUUM")
+
+    def close(self):
+        """Function to close the connection and forget the process wide instance
+        """
+        with ledgersLock:
+            if ledgers.get(self.ledgerFile) is self:
+                del ledgers[self.ledgerFile]
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,86 @@
+#!/usr/bin/python
+import os
+import re
+import hashlib
+
+#11 character video id of the usual youtube link forms (watch?v=, youtu.be/, embed/, shorts/, live/),
+#wherever v= stands among the query parameters
+VIDEO_ID = re.compile(r'(?:[?&]v=|youtu\.be/|/embed/|/shorts/|/live/|/v/)([A-Za-z0-9_-]{11})(?![A-Za-z0-9_-])')
+
+
+def video_id(link):
+    """Function to return the video id of a youtube link.
+    Links without a recognisable id are keyed by a hash of the whole link
+    """
+    match = VIDEO_ID.search(link)
+    if match:
+        return(match.group(1))
+    if re.match(r'^[A-Za-z0-9_-]{11}$',link):
+        return(link)
+    return("url-"+hashlib.sha1(link.encode()).hexdigest()[:16])
+
+
+def canonical_link(link):
+    """Function to return the same link for every variant of a youtube link.
+    Other links are only stripped
+    """
+    link = link.strip()
+    vid = video_id(link)
+    if vid.startswith("url-"):
+        return(link)
+    return("https://www.youtube.com/watch?v={}".format(vid))
+
+
+def iter_unique(links,seen=None):
+    """Function to yield the links naming a video not seen before. First variant and order are kept.
+    Only the video ids are remembered, in seen when given so several calls can share them
+    """
+    seen = set() if seen is None else seen
+    for link in links:
+        vid = video_id(link.strip())
+        if vid not in seen:
+            seen.add(vid)
+            yield link
+
+
+def unique_links(links):
+    """Function to drop the links naming a video which is already in links
+    """
+    return(list(iter_unique(links)))
+
+
+def batched(links,size):
+    """Function to yield lists of at most size links, reading links only as far as needed
+    """
+    batch = []
+    for link in links:
+        batch.append(link)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class LinkSource(object):
+    """Links given with -l/--link: a file with links per line, or links separated by commas.
+       A file is read line by line every time the source is iterated, so it is never held in memory.
+       Blank lines and lines starting with # are skipped, a line may hold several links separated by commas
+    """
+
+    def __init__(self,source):
+        self.source = source
+
+    def __iter__(self):
+        if os.path.isfile(self.source):
+            with open(self.source) as fh:
+                for line in fh:
+                    if line.lstrip().startswith('#'):
+                        continue
+                    for link in line.split(','):
+                        if link.strip():
+                            yield link.strip()
+        else:
+            for link in self.source.split(','):
+                if link.strip():
+                    yield link.strip()
@@ -1,36 +1,104 @@
-#!/usr/bin/python
-import logging
-
-class Logs(object):
-    # Function to display script logs and save it in the log file
-
-    def __init__(self,logfile):
-        self.logfile = logfile
-        # 1.Create logger instance
-        self.logger = logging.getLogger()
-        self.logger.setLevel(logging.DEBUG)
-        # 2.Create file handler to save test logs to file.
-        log_fh = logging.FileHandler(self.logfile,mode='w')
-        log_fh.setLevel(logging.DEBUG)
-        # 3.Create console handler to ouput logs to Console as well.
-        log_ch = logging.StreamHandler()
-        log_ch.setLevel(logging.DEBUG)
-        # 4.Create log formatter string
-        # formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)8s - %(message)s')
-        formatter = logging.Formatter('%(asctime)s - %(threadName)10s - %(levelname)8s - %(message)s')
-        log_fh.setFormatter(formatter)
-        log_ch.setFormatter(formatter)
-        # 5.Add 4 to handlers
-        self.logger.addHandler(log_fh)
-        self.logger.addHandler(log_ch)
-
-    def runTest(self):
-        self.logger.info("Collect info logs")
-        self.logger.debug("collect debug logs")
-        self.logger.error("collect error logs")
-
-if __name__ == '__main__':
-    temp_file = "abc_logs.txt"
-    obj = Logs(temp_file)
-    #obj.collect_logs()
-    obj.runTest()
+#!/usr/bin/python
+import atexit
+import logging
+import logging.handlers
+import queue
+import threading
+
+# Logger of the output of external commands (youtube-dl, avconv), with its own level
+OUTPUT_LOGGER = 'output'
+
+# Process wide logging state. Handlers are attached once, every log file only once
+logLock = threading.Lock()
+listener = None
+logFiles = {}
+# Number of trailing lines of a command output which are logged, 0 logs everything
+outputLines = 20
+
+
+def setupLogging(logfile=None,level=None,outputLevel=None,lines=None):
+    """Function to configure logging of this process. Safe to call any number of times.
+       Root logger gets a single QueueHandler, the file and console handlers run in the QueueListener thread,
+       so logging calls never wait for disk or terminal. A new logfile is added to the listener once.
+       level (console), outputLevel (command output) and lines are changed only when given
+    """
+    global listener, outputLines
+    with logLock:
+        if listener is None:
+            formatter = logging.Formatter('%(asctime)s - %(threadName)10s - %(levelname)8s - %(message)s')
+            console = logging.StreamHandler()
+            console.setLevel(logging.DEBUG)
+            console.setFormatter(formatter)
+            logQueue = queue.Queue(-1)
+            root = logging.getLogger()
+            root.setLevel(logging.DEBUG)
+            root.addHandler(logging.handlers.QueueHandler(logQueue))
+            listener = logging.handlers.QueueListener(logQueue,console,respect_handler_level=True)
+            listener.start()
+            atexit.register(stopLogging)
+        if level is not None:
+            listener.handlers[0].setLevel(level)
+        if outputLevel is not None:
+            logging.getLogger(OUTPUT_LOGGER).setLevel(outputLevel)
+        if lines is not None:
+            outputLines = lines
+        if logfile and logfile not in logFiles:
+            # 1.Create file handler to save logs to file, truncated on first use in this process
+            fileHandler = logging.FileHandler(logfile,mode='w')
+            fileHandler.setLevel(logging.DEBUG)
+            fileHandler.setFormatter(listener.handlers[0].formatter)
+            logFiles[logfile] = fileHandler
+            # 2.Listener iterates over its handlers tuple for every record, replacing it is thread safe
+            listener.handlers = listener.handlers+(fileHandler,)
+
+
+def stopLogging():
+    """Function to write out queued records and remove the handlers. setupLogging() can be called again afterwards
+    """
+    global listener
+    with logLock:
+        if listener is None:
+            return
+        listener.stop()
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            if isinstance(handler,logging.handlers.QueueHandler):
+                root.removeHandler(handler)
+        for handler in listener.handlers:
+            handler.close()
+        listener = None
+        logFiles.clear()
+
+
+def logOutput(output,level=logging.DEBUG):
+    """Function to log the output of an external command on the output logger, keeping only its last lines
+    """
+    logger = logging.getLogger(OUTPUT_LOGGER)
+    if not output or not logger.isEnabledFor(level):
+        return
+    lines = output.splitlines()
+    if outputLines and len(lines) > outputLines:
+        logger.log(level,"... {} lines skipped".format(len(lines)-outputLines))
+        lines = lines[-outputLines:]
+    logger.log(level,'\n'.join(lines))
+
+
+class Logs(object):
+    # Function to display script logs and save it in the log file.
+    # Every instance shares the process wide handlers set up by setupLogging()
+
+    def __init__(self,logfile):
+        self.logfile = logfile
+        setupLogging(self.logfile)
+        self.logger = logging.getLogger()
+
+    def runTest(self):
+        self.logger.info("Collect info logs")
+        self.logger.debug("collect debug logs")
+        self.logger.error("collect error logs")
+
+if __name__ == '__main__':
+    temp_file = "abc_logs.txt"
+    obj = Logs(temp_file)
+    #obj.collect_logs()
+    obj.runTest()
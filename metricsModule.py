@@ -0,0 +1,200 @@
+#!/usr/bin/python
+import os
+import json
+import time
+import cProfile
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+#Upper bounds in seconds of the stage duration histogram buckets
+BUCKETS = (0.001,0.005,0.01,0.05,0.1,0.5,1,5,10,30,60,300,float('inf'))
+
+#Prefix of every exported metric name
+PREFIX = 'youtube'
+
+
+class Metrics(object):
+    """Process wide stage timers, counters and gauges.
+       Stages are timed into histograms, counters only go up, gauges are read from a callback when exported
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        #stage -> {'count','sum','max','buckets'}
+        self.stages = {}
+        #name -> value
+        self.counters = {}
+        #name -> callable returning a number or a dictionary of numbers
+        self.gauges = {}
+        #Per job profiling, off unless profileFolder is set
+        self.profileFolder = None
+        self.traceMemory = False
+        #cProfile can profile one thread at a time, other jobs run unprofiled meanwhile
+        self.profileLock = threading.Lock()
+
+    def observe(self,stage,seconds):
+        """Function to record one duration of a stage
+        """
+        with self.lock:
+            entry = self.stages.get(stage)
+            if entry is None:
+                entry = self.stages[stage] = {'count' : 0, 'sum' : 0.0, 'max' : 0.0, 'buckets' : [0]*len(BUCKETS)}
+            entry['count'] += 1
+            entry['sum'] += seconds
+            entry['max'] = max(entry['max'],seconds)
+            for (index,bound) in enumerate(BUCKETS):
+                if seconds <= bound:
+                    entry['buckets'][index] += 1
+                    break
+
+    @contextmanager
+    def timer(self,stage):
+        """Function to time the body of a with statement as one duration of stage
+        """
+        t1 = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(stage,time.monotonic()-t1)
+
+    def inc(self,name,value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name,0)+value
+
+    def addGauge(self,name,function):
+        with self.lock:
+            self.gauges[name] = function
+
+    def gaugeValues(self):
+        """Function to read every gauge
+        Output : dictionary of name -> number
+        """
+        with self.lock:
+            gauges = list(self.gauges.items())
+        values = {}
+        for (name,function) in gauges:
+            try:
+                value = function()
+            except Exception:
+                continue
+            if isinstance(value,dict):
+                values.update(("{}_{}".format(name,key),v) for (key,v) in value.items())
+            else:
+                values[name] = value
+        return(values)
+
+    def snapshot(self):
+        """Function to return all metrics as one dictionary, served as JSON
+        """
+        with self.lock:
+            stages = dict((stage,{'count' : e['count'], 'sum' : e['sum'], 'max' : e['max'],
+                                  'buckets' : dict(zip([str(b) for b in BUCKETS],e['buckets']))})
+                          for (stage,e) in self.stages.items())
+            counters = dict(self.counters)
+        return({'stages' : stages, 'counters' : counters, 'gauges' : self.gaugeValues()})
+
+    def prometheus(self):
+        """Function to return all metrics in the Prometheus text format
+        """
+        lines = []
+        with self.lock:
+            stages = [(stage,dict(e,buckets=list(e['buckets']))) for (stage,e) in sorted(self.stages.items())]
+            counters = sorted(self.counters.items())
+        name = "{}_stage_seconds".format(PREFIX)
+        lines.append("# TYPE {} histogram".format(name))
+        for (stage,entry) in stages:
+            cumulative = 0
+            for (bound,count) in zip(BUCKETS,entry['buckets']):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append('{}_bucket{{stage="{}",le="{}"}} {}'.format(name,stage,le,cumulative))
+            lines.append('{}_sum{{stage="{}"}} {}'.format(name,stage,entry['sum']))
+            lines.append('{}_count{{stage="{}"}} {}'.format(name,stage,entry['count']))
+        lines.append("# TYPE {}_stage_seconds_max gauge".format(PREFIX))
+        for (stage,entry) in stages:
+            lines.append('{}_stage_seconds_max{{stage="{}"}} {}'.format(PREFIX,stage,entry['max']))
+        for (counter,value) in counters:
+            lines.append("# TYPE {}_{}_total counter".format(PREFIX,counter))
+            lines.append("{}_{}_total {}".format(PREFIX,counter,value))
+        for (gauge,value) in sorted(self.gaugeValues().items()):
+            lines.append("# TYPE {}_{} gauge".format(PREFIX,gauge))
+            lines.append("{}_{} {}".format(PREFIX,gauge,value))
+        return('\n'.join(lines)+'\n')
+
+    @contextmanager
+    def profile(self,name):
+        """Function to capture a cProfile and optionally a tracemalloc diff of the body of a with statement.
+        Does nothing unless profileFolder is set. Output goes to <profileFolder>/<name>.prof and <name>.mem.txt
+        """
+        if not self.profileFolder or not self.profileLock.acquire(blocking=False):
+            yield
+            return
+        try:
+            if self.traceMemory and not tracemalloc.is_tracing():
+                tracemalloc.start()
+            before = tracemalloc.take_snapshot() if self.traceMemory else None
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                yield
+            finally:
+                profiler.disable()
+                os.makedirs(self.profileFolder,exist_ok=True)
+                path = os.path.join(self.profileFolder,name)
+                profiler.dump_stats(path+'.prof')
+                if before is not None:
+                    after = tracemalloc.take_snapshot()
+                    with open(path+'.mem.txt','w') as fh:
+                        for stat in after.compare_to(before,'lineno')[:30]:
+                            fh.write("{}\n".format(stat))
+        finally:
+            self.profileLock.release()
+
+
+#Metrics of this process
+metrics = Metrics()
+
+
+def getMetrics():
+    """Function to return the process wide metrics
+    """
+    return(metrics)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """GET /metrics returns the Prometheus text format, GET /metrics.json the JSON snapshot
+    """
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            body = metrics.prometheus().encode()
+            contentType = 'text/plain; version=0.0.4'
+        elif self.path == '/metrics.json':
+            body = json.dumps(metrics.snapshot()).encode()
+            contentType = 'application/json'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type',contentType)
+        self.send_header('Content-Length',str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self,format,*args):
+        #Scrapes are not logged
+        pass
+
+
+def startMetricsServer(host='127.0.0.1',port=9947):
+    """Function to serve the metrics endpoint from a daemon thread
+    Output : the HTTP server, server_address holds the bound port
+    """
+    server = ThreadingHTTPServer((host,port),MetricsHandler)
+    server.daemon_threads = True
+    t = threading.Thread(target=server.serve_forever,name='metrics')
+    t.daemon = True
+    t.start()
+    return(server)
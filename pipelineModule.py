@@ -0,0 +1,109 @@
+#!/usr/bin/python
+import os
+import queue
+import time
+import threading
+import subprocess as sp
+from concurrent.futures import ProcessPoolExecutor
+
+
+def transcodeToMp3(videoFile,audioFile,quality=2,transcoder='avconv'):
+    """Function run in the transcoder processes. Extracts the audio of videoFile into audioFile
+    Output : (statusCode,output)
+    """
+    #-q:a 2 is the same VBR quality youtube-dl used with --audio-quality 2
+    cmd = [transcoder,'-y','-i',videoFile,'-vn','-codec:a','libmp3lame','-q:a',str(quality),audioFile]
+    try:
+        result = sp.run(cmd,stdout=sp.PIPE,stderr=sp.STDOUT)
+    except OSError as e:
+        return(1,str(e))
+    #Keep only the end of the output, it is sent back to the parent process
+    return(result.returncode,result.stdout[-2000:].decode(errors='replace'))
+
+
+class DownloadPipeline(object):
+    """Class to download links and extract their audio in two overlapping stages.
+       Download threads (network bound) feed a bounded queue drained into a process pool of
+       transcoders (cpu bound), so downloads of later links run while earlier ones are transcoded
+    """
+
+    def __init__(self,yt,transcoders=None,queueSize=None):
+        #Youtubedl object owning folders, logger and ledger
+        self.yt = yt
+        self.downloaders = yt.concurrency
+        self.transcoders = transcoders or os.cpu_count() or 1
+        #Downloaded videos waiting for a transcoder. Bounded so downloads pause when transcoding falls behind
+        self.transcodeQueue = queue.Queue(maxsize=queueSize or self.transcoders)
+        #At most one queued job per transcoder process inside the pool
+        self.slots = threading.BoundedSemaphore(self.transcoders)
+
+    def downloadStage(self,links):
+        """Function run by each download thread
+        """
+        while True:
+            link = self.yt.nextLink(links)
+            if link is None:
+                break
+            #Every link is a job with its own folder
+            job = self.yt.newJob(link)
+            if self.yt.downloadVideo(job) is None:
+                self.yt.recordFailure(link)
+                self.yt.cleanUp(job)
+                continue
+            #Blocks while the queue is full
+            self.transcodeQueue.put(job)
+
+    def transcodeStage(self,pool):
+        """Function run by the dispatcher thread. Submits queued videos to the process pool
+        """
+        while True:
+            job = self.transcodeQueue.get()
+            if job is None:
+                break
+            #Output path is derived from the reported video path, no folder scan needed
+            job.audioFile = os.path.splitext(job.videoFile)[0]+'.mp3'
+            self.slots.acquire()
+            self.yt.obj.logger.info("Transcoding {}".format(job.videoFile))
+            #A slot is free, so the transcode starts now and its time is not spent waiting in the pool
+            started = time.monotonic()
+            future = pool.submit(transcodeToMp3,job.videoFile,job.audioFile,self.yt.audioQuality,self.yt.transcoder)
+            future.add_done_callback(lambda future,job=job,started=started:self.finalize(future,job,started))
+
+    def finalize(self,future,job,started):
+        """Function called when a transcode finishes. Records the link and moves its files
+        """
+        self.yt.metrics.observe('transcode',time.monotonic()-started)
+        try:
+            try:
+                (statusCode,output) = future.result()
+            except Exception as e:
+                (statusCode,output) = (1,str(e))
+            if statusCode != 0:
+                self.yt.obj.logger.error("Failed to extract audio of {}".format(job.link))
+                self.yt.obj.logger.debug(output)
+                job.error = 1
+            else:
+                self.yt.finalizeJob(job)
+            if job.error:
+                self.yt.recordFailure(job.link)
+            self.yt.cleanUp(job)
+        finally:
+            self.slots.release()
+
+    def run(self,links):
+        """Function to push all links through the pipeline and wait for the last transcode
+        """
+        links = iter(links)
+        with ProcessPoolExecutor(max_workers=self.transcoders) as pool:
+            dispatcher = threading.Thread(target=self.transcodeStage,args=(pool,),name="transcode")
+            dispatcher.start()
+            threads = []
+            for index in range(self.downloaders):
+                t = threading.Thread(target=self.downloadStage,args=(links,),name="download{}".format(index))
+                threads.append(t)
+                t.start()
+            for t in threads:
+                t.join()
+            self.transcodeQueue.put(None)
+            dispatcher.join()
+        #Leaving the with block waits for the remaining transcodes and their finalize callbacks
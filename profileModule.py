@@ -0,0 +1,63 @@
+#!/usr/bin/python
+
+#Kinds of profile
+AUDIO = 'audio'
+VIDEO = 'video'
+BOTH = 'both'
+KINDS = (AUDIO,VIDEO,BOTH)
+
+#Files produced for a link, audio first. Paths of a link are passed around as (audio,video) in this order
+FORMATS = ('mp3','mp4')
+
+#mp3 bitrates accepted, in kbit/s
+MIN_BITRATE = 32
+MAX_BITRATE = 320
+
+
+class FormatProfile(object):
+    """Files a client wants of every link: the mp3, the mp4 or both, and the bitrate of the mp3.
+       The profile decides what youtube-dl fetches, so an audio only client costs no video bytes,
+       and which media cache entries serve it
+    """
+
+    def __init__(self,kind=BOTH,bitrate=None):
+        if kind not in KINDS:
+            raise ValueError("Unknown profile {}, expected one of {}".format(kind,', '.join(KINDS)))
+        if bitrate is not None and not MIN_BITRATE <= int(bitrate) <= MAX_BITRATE:
+            raise ValueError("Bitrate {} is not between {} and {} kbit/s".format(bitrate,MIN_BITRATE,MAX_BITRATE))
+        self.kind = kind
+        #None keeps the VBR quality of the downloader
+        self.bitrate = int(bitrate) if bitrate is not None else None
+        self.audio = kind in (AUDIO,BOTH)
+        self.video = kind in (VIDEO,BOTH)
+        self.formats = tuple(fmt for (fmt,wanted) in zip(FORMATS,(self.audio,self.video)) if wanted)
+        #Downloads of the same video for the same profile are shared
+        self.key = kind if self.bitrate is None else "{}-{}k".format(kind,self.bitrate)
+
+    def cache_format(self,fmt):
+        """Function to return the media cache format of fmt. mp3 of another bitrate is another entry,
+        an mp3 or mp4 of the default quality serves every profile asking for it
+        """
+        if fmt == 'mp3' and self.bitrate is not None:
+            return("mp3-{}k".format(self.bitrate))
+        return(fmt)
+
+    def audio_quality(self,default):
+        """Function to return the --audio-quality of youtube-dl, a bitrate like 128K or the VBR default
+        """
+        return("{}K".format(self.bitrate) if self.bitrate is not None else default)
+
+    def to_json(self):
+        return({'formats' : self.kind, 'bitrate' : self.bitrate})
+
+    def __repr__(self):
+        return("FormatProfile({})".format(self.key))
+
+
+def profile_from_json(obj):
+    """Function to build a profile from a PROFILE message or a stored job. Missing fields keep the defaults
+    """
+    obj = obj or {}
+    if not isinstance(obj,dict):
+        raise ValueError("Profile must be an object, got {!r}".format(obj))
+    return(FormatProfile(obj.get('formats') or BOTH,obj.get('bitrate')))
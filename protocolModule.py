@@ -0,0 +1,160 @@
+#!/usr/bin/python
+"""Framing protocol used between server_oop.py and client_oop.py
+
+Every message starts with a fixed 12 byte header followed by the payload:
+
+    magic (2 bytes, b'YT') | version (1 byte) | type (1 byte) | payload length (8 bytes, network order)
+
+Control messages (profile, links, resume, manifest, file header, file end, end, error, progress, submit, fetch, job)
+carry a small JSON payload.
+CHUNK messages carry raw file data, so a file is sent as one FILE_HEADER followed
+by CHUNK messages until the announced size is reached, then a FILE_END trailer.
+
+Conversation:
+    client -> server : optional PROFILE {formats,bitrate} of the files wanted, formats being audio, video or both
+                       (default both) and bitrate the kbit/s of the mp3 (default VBR quality),
+                       then LINKS [links] messages ended by an empty LINKS [], or FETCH {job} of an earlier job,
+                       then RESUME (partial files the client already holds)
+                       and MANIFEST {name : [size,sha256]} of the whole files it holds, {} when not syncing
+    server -> client : JOB {job,links (count)}, then FILE_HEADER {name,size,offset} + CHUNKs + FILE_END {sha256} per file,
+                       then END {files,skipped}. Files found with the same size and sha256 in the manifest are skipped
+
+Links are sent in messages of at most LINK_BATCH links, the server queues every message as it arrives.
+
+Submitting without waiting:
+    client -> server : optional PROFILE, then SUBMIT [links] messages ended by an empty SUBMIT []
+    server -> client : JOB {job,links}, connection is closed and the server downloads the job on its own.
+                       Files are fetched later with FETCH {job}, also after a lost connection or a server restart.
+                       A job keeps the profile it was submitted with, a PROFILE before FETCH is ignored
+
+PROGRESS messages may come at any point of the server side, also between two CHUNKs of a file.
+Payload is a list of {link,state,downloaded_bytes,total_bytes,speed,eta}, state being one of
+queued, cached, downloading, finished, failed
+"""
+import json
+import struct
+
+MAGIC = b'YT'
+PROTOCOL_VERSION = 7
+
+#Message types
+MSG_LINKS = 1
+MSG_FILE_HEADER = 2
+MSG_CHUNK = 3
+MSG_END = 4
+MSG_ERROR = 5
+MSG_RESUME = 6
+MSG_FILE_END = 7
+MSG_PROGRESS = 8
+MSG_SUBMIT = 9
+MSG_FETCH = 10
+MSG_JOB = 11
+MSG_MANIFEST = 12
+MSG_PROFILE = 13
+
+MSG_NAMES = {
+    MSG_LINKS : 'LINKS',
+    MSG_FILE_HEADER : 'FILE_HEADER',
+    MSG_CHUNK : 'CHUNK',
+    MSG_END : 'END',
+    MSG_ERROR : 'ERROR',
+    MSG_RESUME : 'RESUME',
+    MSG_FILE_END : 'FILE_END',
+    MSG_PROGRESS : 'PROGRESS',
+    MSG_SUBMIT : 'SUBMIT',
+    MSG_FETCH : 'FETCH',
+    MSG_JOB : 'JOB',
+    MSG_MANIFEST : 'MANIFEST',
+    MSG_PROFILE : 'PROFILE',
+}
+
+HEADER = struct.Struct('!2sBBQ')
+HEADER_SIZE = HEADER.size
+
+#Transfers resume only at multiples of this size, server keeps the sha256 of every such prefix
+RESUME_BLOCK = 4*1024*1024
+
+#Links per LINKS/SUBMIT message
+LINK_BATCH = 1000
+
+#Largest control message accepted, protects against garbage length fields
+MAX_CONTROL_SIZE = 16*1024*1024
+
+
+class ProtocolError(Exception):
+    """Raised when the peer sends something which is not a valid frame or closes the connection mid frame
+    """
+    pass
+
+
+def pack_header(msg_type,length):
+    """Function to build the frame header of a message
+    """
+    return(HEADER.pack(MAGIC,PROTOCOL_VERSION,msg_type,length))
+
+
+def send_message(sock,msg_type,payload=b''):
+    """Function to send one framed message
+    """
+    sock.sendall(pack_header(msg_type,len(payload))+payload)
+
+
+def send_json(sock,msg_type,obj):
+    """Function to send a control message with a JSON payload
+    """
+    send_message(sock,msg_type,json.dumps(obj,separators=(',',':')).encode())
+
+
+def recv_exact(sock,size):
+    """Function to read exactly size bytes from the socket
+    """
+    buf = bytearray(size)
+    view = memoryview(buf)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:],size-received)
+        if not n:
+            raise ProtocolError("Connection closed after {} of {} bytes".format(received,size))
+        received += n
+    return(bytes(buf))
+
+
+def recv_header(sock):
+    """Function to read and validate a frame header
+    Output : (msg_type,length)
+    """
+    (magic,version,msg_type,length) = HEADER.unpack(recv_exact(sock,HEADER_SIZE))
+    if magic != MAGIC:
+        raise ProtocolError("Bad frame magic {!r}".format(magic))
+    if version != PROTOCOL_VERSION:
+        raise ProtocolError("Unsupported protocol version {}".format(version))
+    if msg_type not in MSG_NAMES:
+        raise ProtocolError("Unknown message type {}".format(msg_type))
+    return(msg_type,length)
+
+
+def recv_message(sock):
+    """Function to read a whole control message. CHUNK payloads should be read by the caller after recv_header
+    Output : (msg_type,payload)
+    """
+    (msg_type,length) = recv_header(sock)
+    if length > MAX_CONTROL_SIZE:
+        raise ProtocolError("{} message of {} bytes is too large".format(MSG_NAMES[msg_type],length))
+    return(msg_type,recv_exact(sock,length))
+
+
+def decode_json(payload):
+    """Function to decode the JSON payload of a control message
+    """
+    return(json.loads(payload.decode()))
+
+
+def expect_json(sock,msg_type):
+    """Function to read a control message of the given type and return its decoded payload
+    """
+    (received_type,payload) = recv_message(sock)
+    if received_type == MSG_ERROR:
+        raise ProtocolError("Peer reported error: {}".format(decode_json(payload)))
+    if received_type != msg_type:
+        raise ProtocolError("Expected {} but got {}".format(MSG_NAMES[msg_type],MSG_NAMES[received_type]))
+    return(decode_json(payload))
@@ -0,0 +1,125 @@
+#!/usr/bin/python
+import os
+import re
+import time
+import signal
+import selectors
+import subprocess as sp
+from collections import deque
+
+#Status returned for a command killed by a timeout, same as timeout(1)
+TIMEOUT_STATUS = 124
+
+#[download]  45.3% of ~10.00MiB at  1.23MiB/s ETA 00:05
+PROGRESS = re.compile(r'\[download\]\s+(?P<percent>[\d.]+)%\s+of\s+~?\s*(?P<total>[\d.]+)\s*(?P<unit>[KMGT]?i?B)'
+                      r'(?:\s+at\s+(?P<speed>[\d.]+)\s*(?P<speedUnit>[KMGT]?i?B)/s)?(?:\s+ETA\s+(?P<eta>[\d:]+))?')
+UNITS = {'B' : 1, 'KiB' : 1024, 'MiB' : 1024**2, 'GiB' : 1024**3, 'TiB' : 1024**4,
+         'KB' : 1000, 'MB' : 1000**2, 'GB' : 1000**3, 'TB' : 1000**4}
+
+
+def parseProgress(line):
+    """Function to parse a youtube-dl progress line
+    Output : {'percent','downloaded_bytes','total_bytes','speed','eta'} or None if line is not a progress line.
+             speed is in bytes/s, eta in seconds, both None when youtube-dl does not know them yet
+    """
+    match = PROGRESS.search(line)
+    if not match:
+        return(None)
+    percent = float(match.group('percent'))
+    total = int(float(match.group('total'))*UNITS.get(match.group('unit'),1))
+    speed = None
+    if match.group('speed'):
+        speed = float(match.group('speed'))*UNITS.get(match.group('speedUnit'),1)
+    eta = None
+    if match.group('eta'):
+        eta = 0
+        for part in match.group('eta').split(':'):
+            eta = eta*60+int(part)
+    return({'percent' : percent, 'downloaded_bytes' : int(total*percent/100), 'total_bytes' : total,
+            'speed' : speed, 'eta' : eta})
+
+
+class CommandRunner(object):
+    """Runs a shell command and reads its output while it runs.
+       Progress lines are turned into events instead of being kept, other lines are kept up to keepLines,
+       so memory use does not grow with the output. The command is killed when it runs longer than timeout
+       or prints nothing for stallTimeout seconds
+    """
+
+    def __init__(self,timeout=None,stallTimeout=None,keepLines=200,maxLineLength=1024*1024):
+        self.timeout = timeout
+        self.stallTimeout = stallTimeout
+        self.keepLines = keepLines
+        #Longer lines are cut, no youtube-dl line is expected to come close
+        self.maxLineLength = maxLineLength
+        #Seconds between two timeout checks while the command is silent
+        self.pollInterval = 1
+
+    def run(self,cmd,onProgress=None):
+        """Function to run cmd, calling onProgress(event) for every progress line
+        Output : (output,statusCode), output being the last keepLines non progress lines
+        """
+        lines = deque(maxlen=self.keepLines)
+
+        def handleLine(data):
+            line = data.decode(errors='replace').rstrip()
+            if not line:
+                return
+            event = parseProgress(line)
+            if event is None:
+                lines.append(line)
+            elif onProgress:
+                onProgress(event)
+
+        #Own process group so the shell and everything it started are killed together
+        proc = sp.Popen(cmd,shell=True,stdout=sp.PIPE,stderr=sp.STDOUT,start_new_session=True)
+        fd = proc.stdout.fileno()
+        start = lastOutput = time.monotonic()
+        pending = b''
+        #True while dropping the rest of a line longer than maxLineLength
+        skipping = False
+        timedOut = None
+        with selectors.DefaultSelector() as selector:
+            selector.register(fd,selectors.EVENT_READ)
+            while True:
+                now = time.monotonic()
+                if self.timeout and now-start > self.timeout:
+                    timedOut = "Killed after running for {} sec".format(self.timeout)
+                    break
+                if self.stallTimeout and now-lastOutput > self.stallTimeout:
+                    timedOut = "Killed after {} sec without output".format(self.stallTimeout)
+                    break
+                if not selector.select(self.pollInterval):
+                    continue
+                data = os.read(fd,65536)
+                if not data:
+                    break
+                lastOutput = time.monotonic()
+                #youtube-dl redraws its progress line with \r
+                parts = re.split(b'[\r\n]',pending+data)
+                pending = parts.pop()
+                if skipping:
+                    if not parts:
+                        pending = b''
+                        continue
+                    parts.pop(0)
+                    skipping = False
+                for part in parts:
+                    handleLine(part)
+                if len(pending) > self.maxLineLength:
+                    handleLine(pending[:self.maxLineLength])
+                    pending = b''
+                    skipping = True
+        if not skipping:
+            handleLine(pending)
+        if timedOut:
+            try:
+                os.killpg(proc.pid,signal.SIGKILL)
+            except OSError:
+                pass
+            lines.append(timedOut)
+        statusCode = proc.wait()
+        proc.stdout.close()
+        if timedOut:
+            statusCode = TIMEOUT_STATUS
+        return('\n'.join(lines),statusCode)
@@ -0,0 +1,232 @@
+#!/usr/bin/python
+import re
+import time
+import random
+import logging
+import threading
+from collections import deque
+from urllib.parse import urlparse
+from linkModule import video_id
+from metricsModule import getMetrics
+
+#Output of a download the remote host refused for too many requests
+THROTTLED = re.compile(r'HTTP Error (?:429|503)|Too Many Requests',re.I)
+#Output of a download which fails the same way however often it is retried
+PERMANENT = re.compile(r'Unsupported URL|Video unavailable|is private|has been removed|is not a valid URL|'
+                       r'Incomplete YouTube ID|not available in your country|copyright',re.I)
+
+
+def hostOf(link):
+    """Function to return the host a link is downloaded from. Every variant of a youtube link is the same host
+    """
+    link = link.strip()
+    if not video_id(link).startswith('url-'):
+        return('youtube.com')
+    return(urlparse(link).hostname or 'unknown')
+
+
+class TokenBucket(object):
+    """Lets downloads start at rate per second on average, with bursts of up to burst downloads
+    """
+
+    def __init__(self,rate,burst=1):
+        self.rate = rate
+        self.burst = max(1,burst)
+        self.tokens = float(self.burst)
+        self.stamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self):
+        """Function to take a token
+        Output : 0 when a token was taken, else seconds until the next one
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst,self.tokens+(now-self.stamp)*self.rate)
+            self.stamp = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return(0)
+            return((1-self.tokens)/self.rate)
+
+    def acquire(self):
+        while True:
+            wait = self.take()
+            if not wait:
+                return
+            time.sleep(wait)
+
+
+class RetryPolicy(object):
+    """Exponential backoff with jitter between the attempts of a failed download.
+       The wait before retry n is drawn between half and all of min(cap,base*2**(n-1)) seconds,
+       so downloads which failed together do not come back together
+    """
+
+    def __init__(self,attempts=4,base=2.0,cap=60.0):
+        #Attempts per download, the first one included
+        self.attempts = max(1,attempts)
+        self.base = base
+        self.cap = cap
+
+    def retryable(self,output):
+        """Function to check if a failure may go away on its own
+        """
+        return(not PERMANENT.search(output or ''))
+
+    def delay(self,attempt):
+        """Function to return the seconds to wait before retry number attempt, 1 being the first retry
+        """
+        ceiling = min(self.cap,self.base*2**(attempt-1))
+        return(random.uniform(ceiling/2,ceiling))
+
+
+class HostState(object):
+    """Concurrency limit, token bucket and throughput window of one host
+    """
+
+    def __init__(self,name,limit,bucket):
+        self.name = name
+        self.limit = limit
+        self.active = 0
+        self.bucket = bucket
+        #Downloads finished in the current window and their bytes. A window is limit downloads
+        self.windowStart = None
+        self.windowBytes = 0
+        self.windowDone = 0
+        #Throughput of the previous window in bytes/s, None right after a decrease
+        self.throughput = None
+        #Failures of downloads started before the last decrease do not decrease again
+        self.lastDecrease = 0
+
+
+class Slot(object):
+    """Permission to run one download, returned by DownloadScheduler.acquire()
+    """
+
+    def __init__(self,host):
+        self.host = host
+        self.started = time.monotonic()
+
+
+class DownloadScheduler(object):
+    """Gates downloads per host. A token bucket limits how often downloads start, an AIMD limit how many run at once:
+       the limit grows by one while throughput rises from one window of limit downloads to the next,
+       and is halved on a failure, on throttling by the host or when throughput falls.
+       Worker threads beyond the limit wait in acquire()
+    """
+
+    def __init__(self,initial=2,maximum=16,rate=None,burst=1,adaptive=True):
+        self.initial = initial
+        self.maximum = maximum
+        self.minimum = 1
+        #Downloads started per second per host, None for no rate limit
+        self.rate = rate
+        self.burst = burst
+        #False keeps every host at maximum
+        self.adaptive = adaptive
+        #Throughput change between two windows taken as a rise or a fall
+        self.rise = 1.05
+        self.fall = 0.7
+        self.cond = threading.Condition()
+        self.hosts = {}
+        #Latest decisions : (time,host,old limit,new limit,reason)
+        self.decisions = deque(maxlen=100)
+        self.logger = logging.getLogger()
+        self.metrics = getMetrics()
+        self.metrics.addGauge('scheduler',self.stats)
+
+    def hostState(self,name):
+        """Function to return the state of a host, created on first use. Called with self.cond held
+        """
+        state = self.hosts.get(name)
+        if state is None:
+            limit = min(self.initial,self.maximum) if self.adaptive else self.maximum
+            state = self.hosts[name] = HostState(name,limit,TokenBucket(self.rate,self.burst) if self.rate else None)
+        return(state)
+
+    def acquire(self,link):
+        """Function to wait until a download of link may start
+        Output : slot to hand back to release()
+        """
+        with self.cond:
+            state = self.hostState(hostOf(link))
+            while state.active >= state.limit:
+                self.cond.wait()
+            state.active += 1
+            if state.windowStart is None:
+                state.windowStart = time.monotonic()
+        #Waiting for a token does not block other hosts
+        if state.bucket:
+            state.bucket.acquire()
+        return(Slot(state.name))
+
+    def release(self,slot,ok,size=0,output=''):
+        """Function to end a download and adapt the limit of its host
+        Input : slot of acquire(), success, bytes downloaded, output of the downloader to look for throttling
+        """
+        with self.cond:
+            state = self.hosts[slot.host]
+            state.active -= 1
+            if output and THROTTLED.search(output):
+                self.decrease(state,slot,"throttled")
+            elif not ok:
+                self.decrease(state,slot,"download failed")
+            else:
+                state.windowBytes += size
+                state.windowDone += 1
+                if state.windowDone >= state.limit:
+                    self.evaluate(state)
+            self.cond.notify_all()
+
+    def evaluate(self,state):
+        """Function to compare the throughput of the window which just ended with the previous one
+        """
+        now = time.monotonic()
+        throughput = state.windowBytes/max(now-state.windowStart,1e-6)
+        previous = state.throughput
+        (state.windowStart,state.windowBytes,state.windowDone) = (now,0,0)
+        state.throughput = throughput
+        if previous is None or throughput > previous*self.rise:
+            self.change(state,min(self.maximum,state.limit+1),"throughput {:.0f} B/s".format(throughput))
+        elif throughput < previous*self.fall:
+            self.decrease(state,None,"throughput fell from {:.0f} to {:.0f} B/s".format(previous,throughput))
+
+    def decrease(self,state,slot,reason):
+        """Function to halve the limit of a host. Called with self.cond held
+        """
+        if slot is not None and slot.started < state.lastDecrease:
+            return
+        self.change(state,max(self.minimum,state.limit//2),reason)
+        state.lastDecrease = time.monotonic()
+        #Next window is compared with nothing, so the limit starts growing again
+        (state.windowStart,state.windowBytes,state.windowDone,state.throughput) = (time.monotonic(),0,0,None)
+
+    def change(self,state,limit,reason):
+        if not self.adaptive or limit == state.limit:
+            return
+        self.logger.info("Scheduler {} : concurrency {} -> {} ({})".format(state.name,state.limit,limit,reason))
+        self.metrics.inc('scheduler_increases' if limit > state.limit else 'scheduler_decreases')
+        self.decisions.append((time.time(),state.name,state.limit,limit,reason))
+        state.limit = limit
+
+    def stats(self):
+        """Function to return the limit and running downloads of every host
+        """
+        with self.cond:
+            values = {}
+            for state in self.hosts.values():
+                name = re.sub(r'[^A-Za-z0-9_]','_',state.name)
+                values["{}_limit".format(name)] = state.limit
+                values["{}_active".format(name)] = state.active
+            return(values)
+
+
+#Scheduler of this process, shared by every Youtubedl object
+scheduler = DownloadScheduler()
+
+
+def getScheduler():
+    """Function to return the process wide download scheduler
+    """
+    return(scheduler)
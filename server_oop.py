@@ -1,38 +1,122 @@
 #!/usr/bin/python
 try:
     import os,sys,time
+    import itertools
+    import shutil
     import glob
     import subprocess as sp
     import argparse
     import re
     import threading
+    import queue
     import glob
     import pdb
     import socket
-    from logModule import Logs
+    from logModule import Logs, setupLogging
+    import protocolModule as protocol
+    import hashlib
+    from transferModule import FileSender, HashCache
+    from cacheModule import MediaCache
+    from linkModule import video_id, iter_unique
+    from jobQueueModule import JobQueue, QUEUED, FINISHED, FAILED, FINAL_STATES
+    from profileModule import FormatProfile, profile_from_json, FORMATS
+    from metricsModule import getMetrics, startMetricsServer
+    from schedulerModule import getScheduler
     from youtubeClass import Youtubedl
 except ImportError:
     raise ImportError("\n -E- Encountered import python exception!!!")
 
+#Item of ClientSession.ready telling the sender that progress updates are pending
+PROGRESS_READY = 'progress'
+
+
+class ClientSession(object):
+    """Class to hold the state of one client connection
+    """
+    #Source of unique session ids
+    ids = itertools.count(1)
+
+    def __init__(self,cs,addr):
+        #Unique id of this connection
+        self.id = next(ClientSession.ids)
+        #Client_socket object
+        self.cs = cs
+        #Client address
+        self.addr = addr
+        #Server job whose results are sent to this client
+        self.job_id = None
+        #Number of links of the job
+        self.link_count = 0
+        #Client only submitted the links and will fetch the files with another connection
+        self.detach = False
+        #True once every file of the job was sent and END went out
+        self.delivered = False
+        #Files to send : (link,format,path,cached). Cached files stay pinned in the media cache until the session ends
+        self.files = []
+        #Files ready to be sent, filled while links are still downloading. None marks the end of the batch
+        self.ready = queue.Queue()
+        #Partial files held by the client : name -> {'offset','sha256'}
+        self.resume = {}
+        #Whole files held by the client : name -> [size,sha256]. Files found in it are not sent again
+        self.manifest = {}
+        #Files wanted of every link, the profile of the job once attached
+        self.profile = FormatProfile()
+        #Latest progress of every link not sent yet : link -> state. Sent as PROGRESS messages
+        self.progress = {}
+        self.progress_lock = threading.Lock()
+        #True while CHUNK data is being written, no other message may be sent then
+        self.mid_frame = False
+        #File sender with its own reusable buffer
+        self.sender = FileSender()
+
+
 class ServerConnect(object):
     """Class to setup initial settings of server
     """
-    def __init__(self):
+    def __init__(self,server_ip='192.168.0.101',server_port=1947,max_clients=1,concurrency=1,cache_folder='/home/neo/youtube/cache/',cache_size=10*1024,stream=True,workers=None,job_file=None):
 
         #Create a logger object
         self.obj = Logs("server_logs.txt")  
         #Create a socket object
         self.so_obj = ''
-        #Client_socket object
-        self.cs = ''
-        #Yotubedl Object instance
-        self.yt = ''
-        #Set Buffer Size
-        self.buffer_size = 1024
-        #List of youtube links recieved from client
-        self.client_youtube_links = []
-        #Download status flag
-        self.download_flag = 1
+        #Server IP
+        self.server_ip = server_ip
+        #Reserve a port
+        self.server_port = server_port
+        #Number of clients served at the same time
+        self.max_clients = max(1,max_clients)
+        self.client_slots = threading.BoundedSemaphore(self.max_clients)
+        #Number of links of one client downloaded in parallel
+        self.concurrency = max(1,concurrency)
+        #Size of the CHUNK messages used to send files. Each chunk goes out with one sendfile() call.
+        #Same as the resume block so every chunk boundary is a valid resume point
+        self.chunk_size = protocol.RESUME_BLOCK
+        #Downloaded media of all clients, keyed by video id and format. cache_size is in MB
+        self.media_cache = MediaCache(cache_folder,cache_size*1024*1024)
+        #sha256 of served files and of their block prefixes, shared by all client sessions.
+        #Kept next to the media cache, which created the folders, so a restart does not read the served files again
+        self.hash_cache = HashCache(protocol.RESUME_BLOCK,os.path.join(os.path.dirname(os.path.normpath(cache_folder)),'hashes.db'))
+        #Send every file as soon as its link is downloaded instead of after the whole batch
+        self.stream = stream
+        #Stage timers and counters, media cache counters are exported with them
+        self.metrics = getMetrics()
+        self.metrics.addGauge('media_cache',self.media_cache.stats)
+        #Submitted jobs, kept next to the media cache unless job_file is given. Survives restarts
+        self.jobs = JobQueue(job_file or os.path.join(os.path.dirname(os.path.normpath(cache_folder)),'jobs.db'))
+        #Ids of jobs with queued links, drained by the worker threads independently of client connections
+        self.pending = queue.Queue()
+        #Number of jobs downloaded at the same time, each one with concurrency parallel links
+        self.worker_count = max(1,workers or self.max_clients)
+        self.workers = []
+        #job id -> sessions streaming the results of the job. Guards job states and deliveries too
+        self.watchers = {}
+        self.watch_lock = threading.Lock()
+        #video id -> {'job','waiters'} of every download running. Jobs asking for the same video meanwhile
+        #wait in waiters as (job id,link) and share the result instead of downloading it again
+        self.inflight = {}
+        self.inflight_lock = threading.Lock()
+        #job id -> format profile, read once from the job file
+        self.profiles = {}
 
     def setup_server(self):
         """Function to create socket, bind, listen
@@ -45,10 +129,6 @@ class ServerConnect(object):
             self.obj.logger.error("Failed to create a socket")
             raise e
 
-        #Server IP
-        self.server_ip = '192.168.0.101'
-        #Reserve a port
-        self.server_port = 1947
         #Bind to server IP and port
         self.obj.logger.info("Binding to host {} and port {}".format(self.server_ip,self.server_port))
         #self.so_obj.bind(('',self.server_port)) # Empty IP : This makes server to listen to the request coming from other clients on the same network.
@@ -56,122 +136,553 @@ class ServerConnect(object):
         self.so_obj.bind((self.server_ip,self.server_port))
         #Put socket into listening mode
         self.obj.logger.info("Socket is listening")
-        self.so_obj.listen(5)   # Tells the socket library that we want it to queue up as many as 5 connect requests (the normal max) before refusing outside connections
+        self.so_obj.listen(max(5,self.max_clients))   # Queue up connect requests before refusing outside connections. At least 5 (the normal max)
 
-    def receive_data(self):
-        """Function to send and receive data to/from client
+    def receive_data(self,session):
+        """Function to receive the request of the client: new links (LINKS or SUBMIT) or the id of an earlier job (FETCH)
         """
-        '''
-        self.obj.logger.info("Sending handshake to Client")
-        try:
-            self.cs.send("Hello Client, thank you for connecting\n")
-        except Exception as e:
-            self.obj.logger.error(e)
-            self.obj.logger.error("Failed to send data to client")
-            raise e
-        '''
         self.obj.logger.info("Now receiving data from Client")
-        self.client_data = self.cs.recv(self.buffer_size)
-        self.client_youtube_links = self.client_data.split(',')
+        with self.metrics.timer('receive'):
+            (msg_type,payload) = protocol.recv_message(session.cs)
+            if msg_type == protocol.MSG_PROFILE:
+                try:
+                    session.profile = profile_from_json(protocol.decode_json(payload))
+                except ValueError as e:
+                    raise protocol.ProtocolError(str(e))
+                (msg_type,payload) = protocol.recv_message(session.cs)
+            if msg_type == protocol.MSG_FETCH:
+                session.job_id = protocol.decode_json(payload)['job']
+                if not self.jobs.exists(session.job_id):
+                    raise protocol.ProtocolError("Unknown job {}".format(session.job_id))
+                session.link_count = len(self.jobs.links(session.job_id))
+                self.obj.logger.info("Client {} fetches job {}".format(session.addr,session.job_id))
+            elif msg_type in (protocol.MSG_LINKS,protocol.MSG_SUBMIT):
+                session.detach = msg_type == protocol.MSG_SUBMIT
+                self.receive_links(session,msg_type,payload)
+                self.obj.logger.info("Received {} links from client {} as job {}".format(session.link_count,session.addr,session.job_id))
+            else:
+                raise protocol.ProtocolError("Expected LINKS, SUBMIT or FETCH but got {}".format(protocol.MSG_NAMES[msg_type]))
+            if not session.detach:
+                partials = protocol.expect_json(session.cs,protocol.MSG_RESUME)
+                session.resume = dict((partial['name'],partial) for partial in partials)
+                session.manifest = protocol.expect_json(session.cs,protocol.MSG_MANIFEST)
+        if session.resume:
+            self.obj.logger.info("Client {} holds partial files: {}".format(session.addr,list(session.resume)))
+        if session.manifest:
+            self.obj.logger.info("Client {} holds {} files".format(session.addr,len(session.manifest)))
+
+    def receive_links(self,session,msg_type,payload):
+        """Function to receive the links of a new job. Links come in messages of msg_type until an empty one,
+        every message is queued as soon as it arrives so the workers start on a long list right away
+        """
+        #Video ids of the job, variants of one video are downloaded and sent once
+        seen = set()
         while True:
-             self.client_data = self.cs.recv(self.buffer_size)
-             if self.client_data:
-                self.obj.logger.info("More data coming")
-             else:
-                self.obj.logger.info("No more data")
+            links = [link for link in protocol.decode_json(payload) if link]
+            if not links:
                 break
-        self.obj.logger.info("List of Youtube Links received from client: {} ".format(self.client_youtube_links))
+            links = list(iter_unique(links,seen))
+            if links:
+                session.job_id = self.submit(links,session.job_id,session.profile)
+                session.link_count += len(links)
+            (received_type,payload) = protocol.recv_message(session.cs)
+            if received_type != msg_type:
+                raise protocol.ProtocolError("Expected {} but got {}".format(protocol.MSG_NAMES[msg_type],protocol.MSG_NAMES[received_type]))
+        if session.job_id is None:
+            session.job_id = self.submit([],None,session.profile)
 
+    def resume_offset(self,session,path,name,file_size):
+        """Function to find from where a file can be resumed.
+        Client's partial copy is used only if its hash matches the same prefix of the server file
+        """
+        partial = session.resume.get(name)
+        if not partial or not 0 < partial['offset'] <= file_size:
+            return(0)
+        if self.hash_cache.prefix_digest(path,partial['offset']) != partial['sha256']:
+            self.obj.logger.info("Partial copy of {} on client does not match, sending whole file".format(name))
+            return(0)
+        return(partial['offset'])
+
+    def report_progress(self,session,link,state,event=None):
+        """Function to record the state of a link. Called from the download threads.
+        Updates of one link are merged until the sender picks them up, the sender is woken only once
+        """
+        update = {'link' : link, 'state' : state}
+        if event:
+            update.update((key,event.get(key)) for key in ('downloaded_bytes','total_bytes','speed','eta'))
+        with session.progress_lock:
+            wake = not session.progress
+            session.progress[link] = update
+        if wake:
+            session.ready.put(PROGRESS_READY)
+
+    def send_progress(self,session):
+        """Function to send the pending progress updates in one PROGRESS message
+        """
+        with session.progress_lock:
+            updates = list(session.progress.values())
+            session.progress = {}
+        if updates:
+            protocol.send_json(session.cs,protocol.MSG_PROGRESS,updates)
 
-    def send_data(self):
-        """Function to send dowloaded files to client. For each link mp3 and mp4 file will be sent
+    def file_name(self,path):
+        """Function to return the name a file is sent under, alphanumeric characters and the extension
+        """
+        basename = os.path.basename(path)
+        return(''.join(e for e in basename[:-4] if e.isalnum())+basename[-4:])
+
+    def client_has(self,session,path):
+        """Function to check if the manifest of the client lists the same file. Sizes are compared first,
+        the sha256 comes from the hash cache and is computed only for files never hashed before
+        """
+        held = session.manifest.get(self.file_name(path))
+        if not held or held[0] != os.path.getsize(path):
+            return(False)
+        return(held[1] == self.hash_cache.digest(path))
+
+    def send_file(self,session,path):
+        """Function to send one file as FILE_HEADER, CHUNK messages and a FILE_END trailer with its sha256.
+        A file not hashed yet is hashed while it is streamed, later sends use sendfile() and the cached hash
+        """
+        file_size = os.path.getsize(path)
+        name = self.file_name(path)
+        offset = self.resume_offset(session,path,name,file_size)
+        key = self.hash_cache.key(path)
+        entry = self.hash_cache.get(path)
+        #Resuming always leaves a cached entry, so hashing on the way only happens from offset 0
+        hasher = hashlib.sha256() if entry is None else None
+        blocks = []
+        self.obj.logger.info("Sending {} ({} bytes from offset {}) to client".format(name,file_size,offset))
+        t1 = time.monotonic()
+        start = offset
+        #Open before the header goes out so a missing file can still be reported with an ERROR message
+        with open(path,'rb') as fh:
+            protocol.send_json(session.cs,protocol.MSG_FILE_HEADER,{'name' : name, 'size' : file_size, 'offset' : offset})
+            session.mid_frame = True
+            while offset < file_size:
+                count = min(self.chunk_size,file_size-offset)
+                session.cs.sendall(protocol.pack_header(protocol.MSG_CHUNK,count))
+                offset += session.sender.send_range(session.cs,fh,offset,count,hasher)
+                if hasher is not None and offset % self.chunk_size == 0:
+                    blocks.append(hasher.copy().hexdigest())
+                #Progress of other links goes out between two chunks, not after the whole file
+                if session.progress:
+                    self.send_progress(session)
+            session.mid_frame = False
+        if hasher is not None:
+            self.hash_cache.put(key,hasher.hexdigest(),blocks)
+            digest = hasher.hexdigest()
+        else:
+            digest = entry['sha256']
+        protocol.send_json(session.cs,protocol.MSG_FILE_END,{'sha256' : digest})
+        self.metrics.observe('transfer',time.monotonic()-t1)
+        self.metrics.inc('files_sent')
+        self.metrics.inc('bytes_sent',file_size-start)
+        self.obj.logger.info("Sending {} to client complete.".format(name))
+
+    def send_data(self,session):
+        """Function to send dowloaded files to client. For each link mp3 and mp4 file will be sent.
+        Files are taken from the session queue as they become ready, until the end of the batch.
+        Files the client already holds are skipped
         """
-        #Getting mp3 files
-        #self.cs.send("Save data in file dont print.")
-        #return
         try:
-            #mp3_files = glob.glob("/home/neo/public_html/myDrive/youtube_downloads/audio/*mp3")
-            mp3_files = glob.glob("/home/neo/public_html/myDrive/youtube_downloads/*.mp*")
-            self.obj.logger.info("Total no of files to be sent : {}".format(len(mp3_files)))
-            self.cs.send(str(len(mp3_files)))
-            for mp3 in mp3_files:
-                #Send file-size and name of audio file
-                self.obj.logger.info("Send file size of "+mp3)
-                file_size = os.path.getsize(mp3)
-                self.cs.send(str(file_size))
-                time.sleep(1)
-                basename = os.path.basename(mp3)
-                #ext = basename[-4:]
-                mp3_name = ''.join(e for e in basename[:-4] if e.isalnum())+basename[-4:]
-                self.obj.logger.info("Send file name "+mp3_name)
-                self.cs.send(str(mp3_name))
-                time.sleep(1)
-                self.obj.logger.info("Sending {} data to client".format(mp3_name))
-                fh = open(mp3,'rb')
-                data = fh.read(1024)
-                while data:
-                    self.cs.send(data)
-                    data = fh.read(1024)
-                fh.close()
-                self.obj.logger.info("Sending {} to client complete.".format(mp3_name))
-                time.sleep(2)
+            sent = 0
+            skipped = 0
+            t1 = time.time()
+            #Files held back in batch mode
+            held = []
+            while True:
+                item = session.ready.get()
+                if item is None:
+                    break
+                if item is PROGRESS_READY:
+                    self.send_progress(session)
+                    continue
+                if self.client_has(session,item[2]):
+                    self.obj.logger.info("Client {} already holds {}".format(session.addr,self.file_name(item[2])))
+                    self.metrics.inc('files_skipped')
+                    self.metrics.inc('bytes_skipped',os.path.getsize(item[2]))
+                    skipped += 1
+                    continue
+                if not self.stream:
+                    held.append(item)
+                    continue
+                if not sent:
+                    self.obj.logger.info("First file ready for client {} after {:.2f} sec".format(session.addr,time.time()-t1))
+                self.send_file(session,item[2])
+                sent += 1
+            for item in held:
+                self.send_file(session,item[2])
+                sent += 1
+            self.obj.logger.info("Total no of files sent : {}, already on client : {}".format(sent,skipped))
+            #Final states of the links
+            self.send_progress(session)
+            protocol.send_json(session.cs,protocol.MSG_END,{'files' : sent, 'skipped' : skipped})
+            session.delivered = True
         except Exception as e:
             self.obj.logger.error(e)
             self.obj.logger.error("Failed to send the data to client")
+            self.send_error(session,e)
 
+    def send_error(self,session,error):
+        """Function to report a failure to the client with an ERROR message.
+        Nothing is sent in the middle of a CHUNK, the client would read it as file data
+        """
+        if session.mid_frame:
+            return
+        try:
+            protocol.send_json(session.cs,protocol.MSG_ERROR,{'error' : str(error)})
+        except Exception as e:
+            self.obj.logger.debug("Could not send error to client {}: {}".format(session.addr,e))
+
+
+    def add_file(self,session,item):
+        """Function to hand a file over to the sending side of the session
+        """
+        session.files.append(item)
+        session.ready.put(item)
+
+    def deliver(self,session,link,paths=None):
+        """Function to hand the files of a finished link the profile of a session wants to it. Files come from
+        the media cache, pinned until the session ends, or from the job folder when paths (audio,video) are given
+        Output : False when the files are gone, e.g. evicted from the cache
+        """
+        items = []
+        for (fmt,path) in zip(FORMATS,paths or (None,None)):
+            if fmt not in session.profile.formats:
+                continue
+            fmt = session.profile.cache_format(fmt)
+            cached = self.media_cache.acquire(link,fmt)
+            if cached is not None:
+                items.append((link,fmt,cached,True))
+            elif path and os.path.exists(path):
+                items.append((link,fmt,path,False))
+            else:
+                for item in items:
+                    if item[3]:
+                        self.media_cache.release(link,item[1])
+                return(False)
+        for item in items:
+            self.add_file(session,item)
+        return(True)
+
+    def submit(self,links,job_id=None,profile=None):
+        """Function to queue links for the workers, as a new job of profile or added to job_id
+        Output : job id
+        """
+        self.start_workers()
+        if job_id is None:
+            job_id = self.jobs.submit(links,profile.to_json() if profile else None)
+        else:
+            self.jobs.add_links(job_id,links)
+        self.pending.put(job_id)
+        self.obj.logger.info("Queued {} links for job {}".format(len(links),job_id))
+        return(job_id)
+
+    def retry_failed(self):
+        """Function to download again the links which failed. Failed links of the jobs still in the job file are
+        queued again in their job. Links the ledger recorded as failed are queued as a new job of the default profile,
+        its files go to the media cache for the clients asking for them later
+        Output : ids of the jobs queued
+        """
+        self.start_workers()
+        job_ids = self.jobs.requeue_failed()
+        for job_id in job_ids:
+            self.pending.put(job_id)
+        #Ledger of the downloads, the one Youtubedl objects of the workers record failures in
+        links = Youtubedl([],self.concurrency).ledger.failedLinks()
+        if links:
+            job_ids.append(self.submit(links))
+        self.obj.logger.info("Retrying failed links in jobs {}".format(', '.join(job_ids) or 'none'))
+        return(job_ids)
+
+    def job_profile(self,job_id):
+        """Function to return the format profile of a job
+        """
+        profile = self.profiles.get(job_id)
+        if profile is None:
+            profile = self.profiles[job_id] = profile_from_json(self.jobs.profile(job_id))
+        return(profile)
+
+    def attach(self,session):
+        """Function to stream the results of the job of a session. Links finished already are handed over at once,
+        the others as the workers finish them. Finished links whose files are gone are queued again
+        """
+        requeued = False
+        #Files are sent for the profile the job was submitted with
+        session.profile = self.job_profile(session.job_id)
+        with self.watch_lock:
+            done = True
+            for item in self.jobs.links(session.job_id):
+                (link,state) = (item['link'],item['state'])
+                if state == FINISHED and not self.deliver(session,link,(item['audio'],item['video'])):
+                    self.obj.logger.info("Files of {} are gone, downloading it again".format(link))
+                    self.jobs.set_state(session.job_id,link,QUEUED)
+                    (state,requeued) = (QUEUED,True)
+                self.report_progress(session,link,state)
+                done = done and state in FINAL_STATES
+            self.watchers.setdefault(session.job_id,[]).append(session)
+            if done:
+                session.ready.put(None)
+        if requeued:
+            self.pending.put(session.job_id)
+
+    def link_done(self,job_id,link,state,paths=None,event=None):
+        """Function to record the final state of a link of a job and pass it to the sessions streaming the job.
+        state is finished, cached or failed. paths are the (audio,video) files the media cache did not take
+        """
+        (audio,video) = paths or (None,None)
+        with self.watch_lock:
+            self.jobs.set_state(job_id,link,FAILED if state == 'failed' else FINISHED,audio,video)
+            done = self.jobs.done(job_id)
+            for session in self.watchers.get(job_id,[]):
+                if state != 'failed':
+                    self.deliver(session,link,paths)
+                self.report_progress(session,link,state,event)
+                if done:
+                    session.ready.put(None)
+
+    def job_progress(self,job_id,link,event):
+        """Function to pass the progress of a download to the sessions streaming the job and the jobs waiting for it
+        """
+        targets = [(job_id,link)]
+        with self.inflight_lock:
+            entry = self.inflight.get(self.download_key(job_id,link))
+            if entry and entry['job'] == job_id:
+                targets.extend(entry['waiters'])
+        with self.watch_lock:
+            sessions = [(session,target_link) for (target_job,target_link) in targets
+                        for session in self.watchers.get(target_job,[])]
+        for (session,target_link) in sessions:
+            self.report_progress(session,target_link,'downloading',event)
+
+    def is_cached(self,link,profile,count=False):
+        """Function to check if every format of a link the profile wants is in the media cache.
+        With count, every format is counted as a cache hit or miss
+        """
+        check = self.media_cache.lookup if count else self.media_cache.contains
+        return(all([check(link,profile.cache_format(fmt)) for fmt in profile.formats]))
+
+    def download_key(self,job_id,link):
+        """Function to return the key of the download of a link in inflight. Jobs share a download
+        when they want the same video with the same profile
+        """
+        return("{}/{}".format(video_id(link),self.job_profile(job_id).key))
+
+    def claim_download(self,job_id,link):
+        """Function to decide how a link of a job is served: 'cached', 'waiting' for the download of the same
+        video by another job, or 'download' when this job downloads it
+        """
+        key = self.download_key(job_id,link)
+        with self.inflight_lock:
+            #The one counted cache lookup of every file the job wants. Looked up under the lock,
+            #a download finishing meanwhile is either still in flight or cached
+            cached = self.is_cached(link,self.job_profile(job_id),count=True)
+            entry = self.inflight.get(key)
+            if entry is not None:
+                entry['waiters'].append((job_id,link))
+                return('waiting')
+            if cached:
+                return('cached')
+            self.inflight[key] = {'job' : job_id, 'waiters' : []}
+            return('download')
+
+    def share_download(self,job_id,link,state,paths=None,event=None):
+        """Function to end the download of a link by job_id, passing its result to the jobs waiting for it
+        """
+        key = self.download_key(job_id,link)
+        with self.inflight_lock:
+            entry = self.inflight.get(key)
+            if entry is None or entry['job'] != job_id:
+                return
+            del self.inflight[key]
+        for (waiting_job,waiting_link) in entry['waiters']:
+            self.link_done(waiting_job,waiting_link,state,paths,event)
+
+    def cache_job(self,job_id,job):
+        """Function to move the files of a finished download into the media cache and pass them on
+        """
+        profile = self.job_profile(job_id)
+        paths = []
+        cached = []
+        for (fmt,path) in zip(FORMATS,(job.audioFile,job.videoFile)):
+            #Files the profile does not want were not downloaded
+            fmt = profile.cache_format(fmt)
+            cached_path = self.media_cache.put(job.link,fmt,path) if path else None
+            if cached_path is None:
+                paths.append(path)
+            else:
+                #Pinned until the watching sessions have pinned it too
+                paths.append(None)
+                cached.append(fmt)
+        try:
+            self.link_done(job_id,job.link,'finished',paths,job.progress)
+            self.share_download(job_id,job.link,'finished',paths,job.progress)
+        finally:
+            for fmt in cached:
+                self.media_cache.release(job.link,fmt)
+
+    def run_job(self,job_id,links):
+        """Function to download the claimed links of a job. Links in the media cache are not downloaded again,
+        links another job is downloading are finished with its result
+        """
+        missing = []
+        for link in links:
+            claim = self.claim_download(job_id,link)
+            if claim == 'download':
+                missing.append(link)
+            elif claim == 'cached':
+                self.obj.logger.info("{} served from media cache".format(link))
+                self.link_done(job_id,link,'cached')
+            else:
+                self.obj.logger.info("{} is being downloaded for another job, sharing it".format(link))
+                self.metrics.inc('downloads_coalesced')
+        if not missing:
+            return
+        try:
+            #One Youtubedl for the whole job, so the worker pool is used
+            #Links of a client are passed as a list, never read as a file of the server or split on commas
+            yt = Youtubedl(missing,self.concurrency)
+            #Only the files the client wants are downloaded
+            yt.profile = self.job_profile(job_id)
+            #Media cache decides what is downloaded again, not the ledger
+            yt.skipDownloaded = False
+            #Files of every link go to the watching clients as soon as the link is done
+            yt.onFinished = lambda job: self.cache_job(job_id,job)
+            yt.onProgress = lambda job,event: self.job_progress(job_id,job.link,event)
+            yt.onFailed = lambda link: self.download_failed(job_id,link)
+            #Jobs run in parallel, each one downloads in its own folder
+            yt.isolate("job{}".format(job_id))
+            self.jobs.set_folder(job_id,yt.youtubeDownloadFolder)
+            with self.metrics.timer('process'):
+                yt.runYoutube()
+        finally:
+            #Links the download did not report, e.g. after an exception, count as failed
+            missing = set(missing)
+            for item in self.jobs.links(job_id):
+                if item['link'] in missing and item['state'] not in FINAL_STATES:
+                    self.download_failed(job_id,item['link'])
+
+    def download_failed(self,job_id,link):
+        """Function to fail a link of a job and the links waiting for its download
+        """
+        self.link_done(job_id,link,'failed')
+        self.share_download(job_id,link,'failed')
+
+    def run_worker(self):
+        """Function run by each worker thread. Downloads the jobs of the pending queue until None is taken
+        """
+        while True:
+            job_id = self.pending.get()
+            if job_id is None:
+                break
+            links = self.jobs.claim(job_id)
+            if not links:
+                continue
+            try:
+                self.run_job(job_id,links)
+            except Exception as e:
+                self.obj.logger.error(e)
+                self.obj.logger.error("Failed to run job {}".format(job_id))
+
+    def start_workers(self):
+        """Function to start the worker threads once, queueing the jobs left by a previous run
+        """
+        with self.watch_lock:
+            if self.workers:
+                return
+            for job_id in self.jobs.pending_jobs():
+                self.obj.logger.info("Resuming job {}".format(job_id))
+                self.pending.put(job_id)
+            for index in range(self.worker_count):
+                t = threading.Thread(target = self.run_worker, name = "worker-{}".format(index))
+                t.daemon = True
+                t.start()
+                self.workers.append(t)
+
+    def stop_workers(self):
+        """Function to stop the worker threads after their current job. Jobs still queued stay in the job file
+        """
+        with self.watch_lock:
+            workers = self.workers
+            self.workers = []
+        for t in workers:
+            self.pending.put(None)
+        for t in workers:
+            t.join()
+
+    def finish_session(self,session):
+        """Function to unpin the cached files of a session. A job whose results were delivered is forgotten
+        with its folder, unless another client is still fetching it
+        """
+        folder = None
+        with self.watch_lock:
+            watchers = self.watchers.get(session.job_id,[])
+            if session in watchers:
+                watchers.remove(session)
+            if not watchers:
+                self.watchers.pop(session.job_id,None)
+                if session.delivered:
+                    folder = self.jobs.remove(session.job_id)
+                    self.profiles.pop(session.job_id,None)
+        for (link,fmt,path,cached) in session.files:
+            if cached:
+                self.media_cache.release(link,fmt)
+        session.files = []
+        if folder:
+            shutil.rmtree(folder,ignore_errors=True)
+        self.obj.logger.info("Media cache : {}".format(self.media_cache.stats()))
+
+    def handle_client(self,session):
+        """Function to serve one connected client: receive links, download them and send back the files
+        """
+        self.metrics.inc('sessions')
+        try:
+            self.receive_data(session)
+            protocol.send_json(session.cs,protocol.MSG_JOB,{'job' : session.job_id, 'links' : session.link_count})
+            if session.detach:
+                self.obj.logger.info("Client {} detached from job {}".format(session.addr,session.job_id))
+                return
+            self.attach(session)
+            self.obj.logger.info("Now sending data to client {}".format(session.addr))
+            self.send_data(session)
+        except Exception as e:
+            self.obj.logger.error(e)
+            self.obj.logger.error("Failed to serve client {}".format(session.addr))
+            self.send_error(session,e)
+        finally:
+            self.obj.logger.info("Closing the connection with Client {}\n".format(session.addr))
+            self.obj.logger.info("************************************\n")
+            session.cs.close()
+            #Downloads of the job go on without the client, it can fetch them later
+            self.finish_session(session)
+            self.client_slots.release()
 
-    def process_client_youtube_link(self):
-        """Function to download youtube links
-        Use thread here. One to download youtube videos and one to send the status of download to client
-        """
-        for link in self.client_youtube_links:
-            self.yt = Youtubedl(link)
-            #time.sleep(10)
-            status = self.yt.runYoutube()
-        #return
-        #Reset youtube_links_list
-        self.client_youtube_links = []
-        #Set the flag once download is complete
-        #self.download_flag = 0
-        time.sleep(5)
-
-    def send_download_status(self):
-        """Function to send download status to client every 5 sec
-        """
-        while self.download_flag:
-            time.sleep(5)
-            self.obj.logger.debug("Download is in progress")
-        #Reset flag to 1
-        self.download_flag = 1
-    
     def run_server(self):
-        """Server will be running in a forever loop unless there is an error or manual interrupt
+        """Server will be running in a forever loop unless there is an error or manual interrupt.
+        With max_clients > 1 every connection is served by its own thread
         """
+        self.start_workers()
         while True:
+            #Wait for a free slot so at most max_clients are served at once
+            self.client_slots.acquire()
             try:
                 self.obj.logger.info("Initiating a connection with Client")
-                self.cs, addr = self.so_obj.accept()
+                cs, addr = self.so_obj.accept()
                 self.obj.logger.info("Got connection from {}".format(addr))
             except Exception as e:
+                self.client_slots.release()
                 self.obj.logger.error(e)
                 self.obj.logger.error("Failed to connect with Client")
                 raise e
 
-            self.receive_data()
-            t1 = threading.Thread(target = self.process_client_youtube_link)
-            #t2 = threading.Thread(target = self.send_download_status)
-            t1.start()
-            #t2.start()
-            t1.join()
-            #t2.join()
-            time.sleep(5)
-            self.obj.logger.info("Now sending data to client")
-            self.send_data()
-            self.yt.save_to_youtube_downloads_folder()
-            self.obj.logger.info("Closing the connection with Client\n")
-            self.obj.logger.info("************************************\n")
-            self.cs.close()
-            #self.yt.save_to_youtube_downloads_folder()
+            session = ClientSession(cs,addr)
+            if self.max_clients > 1:
+                t = threading.Thread(target = self.handle_client, args = (session,), name = "client-{}".format(addr[1]))
+                t.daemon = True
+                t.start()
+            else:
+                self.handle_client(session)
 
     def runTest(self):
         #Define steps here
@@ -179,7 +690,43 @@ class ServerConnect(object):
         self.run_server()
     
 
+def getArgs():
+    """Function to get command line arguments
+    """
+    parser = argparse.ArgumentParser(description='Server which downloads youtube links sent by clients and sends back the files', formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('-i','--ip',dest='ip',default='192.168.0.101',help='Server IP to bind to (default 192.168.0.101)')
+    parser.add_argument('-p','--port',dest='port',type=int,default=1947,help='Server port to bind to (default 1947)')
+    parser.add_argument('-m','--max-clients',dest='max_clients',type=int,default=1,help='Number of clients served at the same time, each in its own thread (default 1)')
+    parser.add_argument('-c','--concurrency',dest='concurrency',type=int,default=1,help='Number of links of one client downloaded in parallel (default 1)')
+    parser.add_argument('-w','--workers',dest='workers',type=int,help='Number of jobs downloaded at the same time (default max clients)')
+    parser.add_argument('--max-rate',dest='max_rate',type=float,help='Downloads started per second per host (default no limit)')
+    parser.add_argument('--burst',dest='burst',type=int,default=1,help='Downloads which may start at once within --max-rate (default 1)')
+    parser.add_argument('--max-downloads',dest='max_downloads',type=int,default=16,help='Most downloads per host at once, the scheduler adapts below it (default 16)')
+    parser.add_argument('--fixed-concurrency',dest='fixed_concurrency',action='store_true',help='Always allow --max-downloads per host instead of adapting to throughput and failures')
+    parser.add_argument('--job-file',dest='job_file',help='Job queue database, kept across restarts (default jobs.db next to the cache folder)')
+    parser.add_argument('--retry-failed',dest='retry_failed',action='store_true',help='Download again the links which failed, in their jobs or as a new job')
+    parser.add_argument('--cache-dir',dest='cache_folder',default='/home/neo/youtube/cache/',help='Folder of the media cache (default /home/neo/youtube/cache/)')
+    parser.add_argument('--cache-size',dest='cache_size',type=int,default=10*1024,help='Disk budget of the media cache in MB (default 10240)')
+    parser.add_argument('--log-level',dest='log_level',default='DEBUG',choices=['DEBUG','INFO','WARNING','ERROR'],help='Console log level (default DEBUG)')
+    parser.add_argument('--output-level',dest='output_level',default='INFO',choices=['DEBUG','INFO','WARNING','ERROR'],help='Level of youtube-dl/avconv output lines, WARNING hides them (default INFO)')
+    parser.add_argument('--metrics-port',dest='metrics_port',type=int,help='Serve /metrics (Prometheus text) and /metrics.json on this local port')
+    parser.add_argument('--profile-dir',dest='profile_dir',help='Save a cProfile of every download job in this folder')
+    parser.add_argument('--tracemalloc',dest='tracemalloc',action='store_true',help='With --profile-dir also save the memory allocated by every job')
+    parser.add_argument('-B','--batch',dest='stream',action='store_false',help='Send files only after every link of the job is downloaded\n(default streams each file as soon as its link is done)')
+    args = parser.parse_args()
+    return args
+
+
 if __name__ == '__main__':
-    obj = ServerConnect()
+    args = getArgs()
+    setupLogging(level=args.log_level,outputLevel=args.output_level)
+    getMetrics().profileFolder = args.profile_dir
+    getMetrics().traceMemory = args.tracemalloc
+    scheduler = getScheduler()
+    (scheduler.rate,scheduler.burst,scheduler.maximum,scheduler.adaptive) = (args.max_rate,args.burst,args.max_downloads,not args.fixed_concurrency)
+    if args.metrics_port:
+        startMetricsServer('127.0.0.1',args.metrics_port)
+    obj = ServerConnect(args.ip,args.port,args.max_clients,args.concurrency,args.cache_folder,args.cache_size,args.stream,args.workers,args.job_file)
+    if args.retry_failed:
+        obj.retry_failed()
     obj.runTest()
-
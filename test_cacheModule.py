@@ -0,0 +1,87 @@
+import os
+import shutil
+import socket
+import tempfile
+import unittest
+from unittest import mock
+from cacheModule import MediaCache
+from ledgerModule import getLedger
+from server_oop import ServerConnect, ClientSession
+from test_youtubeClass import StubYoutubedl
+
+
+class TestMediaCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.folder = tempfile.mkdtemp()
+        os.chdir(self.folder)
+        self.cache_folder = os.path.join(self.folder, 'cache')
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.folder)
+
+    def make_file(self, name, size):
+        path = os.path.join(self.folder, name)
+        with open(path, 'wb') as fh:
+            fh.write(b'x' * size)
+        return path
+
+    def test_lru_eviction_skips_pinned_entries(self):
+        cache = MediaCache(self.cache_folder, 250)
+        for name in ('a', 'b'):
+            cache.put(name, 'mp3', self.make_file(name + '.mp3', 100))
+            cache.release(name, 'mp3')
+        # 'a' becomes the most recently used and stays pinned
+        self.assertIsNotNone(cache.acquire('a', 'mp3'))
+        cache.put('c', 'mp3', self.make_file('c.mp3', 100))
+        cache.release('c', 'mp3')
+        self.assertIsNone(cache.acquire('b', 'mp3'))
+        self.assertEqual(cache.stats()['evictions'], 1)
+        self.assertEqual(cache.stats()['bytes'], 200)
+        # Oversized files are not cached
+        self.assertIsNone(cache.put('d', 'mp4', self.make_file('d.mp4', 300)))
+        # Only lookups are counted, not pins or checks
+        self.assertTrue(cache.contains('a', 'mp3'))
+        self.assertEqual((cache.stats()['hits'], cache.stats()['misses']), (0, 0))
+        self.assertTrue(cache.lookup('a', 'mp3'))
+        self.assertFalse(cache.lookup('b', 'mp3'))
+        self.assertEqual((cache.stats()['hits'], cache.stats()['misses']), (1, 1))
+        # Index survives a restart
+        cache = MediaCache(self.cache_folder, 250)
+        self.assertEqual(sorted(cache.entries), sorted([cache.key('a', 'mp3'), cache.key('c', 'mp3')]))
+
+    def test_server_downloads_popular_link_once(self):
+        parent = os.path.join(self.folder, 'youtube') + '/'
+        server = ServerConnect(cache_folder=self.cache_folder)
+        created = []
+
+        def factory(links, concurrency):
+            created.append(links)
+            return StubYoutubedl(links, concurrency, parent)
+        with mock.patch('server_oop.Youtubedl', factory):
+            for _ in range(3):
+                (a, b) = socket.socketpair()
+                session = ClientSession(a, ('test', 0))
+                session.job_id = server.submit(['good1', 'bad1'])
+                server.attach(session)
+                while session.ready.get(timeout=5) is not None:
+                    pass
+                self.assertEqual([(link, fmt) for (link, fmt, path, cached) in session.files], [('good1', 'mp3'), ('good1', 'mp4')])
+                self.assertTrue(all(os.path.exists(f[2]) and f[3] for f in session.files))
+                server.finish_session(session)
+                a.close()
+                b.close()
+        server.stop_workers()
+        server.jobs.close()
+        # Failed link is retried, cached one is not
+        self.assertEqual(created, [['good1', 'bad1'], ['bad1'], ['bad1']])
+        stats = server.media_cache.stats()
+        # One lookup per requested file: good1 misses once and hits twice, bad1 always misses
+        self.assertEqual((stats['hits'], stats['misses'], stats['entries']), (4, 8, 2))
+        getLedger(parent + 'downloads/youtubeDownloadLedger.db').close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import types
+import unittest
+from downloaderModule import LibraryBackend, SubprocessBackend, makeBackend
+from youtubeClass import Youtubedl
+
+
+class StubExtractor(object):
+    """Stand-in for yt_dlp.YoutubeDL. The "video" of a link is the link itself
+    """
+    created = []
+
+    def __init__(self, params):
+        self.params = dict(params, outtmpl='%(title)s.%(ext)s')
+        self.thread = threading.current_thread()
+        StubExtractor.created.append(self)
+
+    def prepare_filename(self, info):
+        return self.params['outtmpl'] % info
+
+    def extract_info(self, url, download=True):
+        assert threading.current_thread() is self.thread
+        if 'bad' in url:
+            raise Exception('ERROR: Unsupported URL: {}'.format(url))
+        info = {'title': url, 'ext': 'mp4'}
+        video = self.prepare_filename(info)
+        with open(video, 'w') as fh:
+            fh.write(url)
+        if self.params.get('postprocessors'):
+            with open(os.path.splitext(video)[0] + '.mp3', 'w') as fh:
+                fh.write(url)
+        return info
+
+
+class TestLibraryBackend(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        StubExtractor.created = []
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def make(self, concurrency):
+        yt = Youtubedl('bad1,good1,good2,bad2,good3,good4', concurrency, os.path.join(self.folder, 'youtube') + '/', backend='subprocess')
+        yt.checkYoutubeDl = lambda: None
+        yt.backend = LibraryBackend(yt, library=types.SimpleNamespace(YoutubeDL=StubExtractor))
+        return yt
+
+    def test_batch_reuses_one_extractor_per_thread(self):
+        for concurrency in (1, 3):
+            yt = self.make(concurrency)
+            StubExtractor.created = []
+            self.assertEqual(yt.runYoutube(), 1)
+            self.assertEqual(sorted(yt.failedLinks), ['bad1', 'bad2'])
+            self.assertEqual(sorted(os.listdir(yt.youtubeAudioFolder)), ['good1.mp3', 'good2.mp3', 'good3.mp3', 'good4.mp3'])
+            self.assertLessEqual(len(StubExtractor.created), concurrency)
+            yt.ledger.close()
+
+    def test_video_only_download(self):
+        yt = self.make(1)
+        job = yt.newJob('good1')
+        self.assertEqual(yt.downloadVideo(job), job.folder + 'good1.mp4')
+        self.assertEqual(os.listdir(job.folder), ['good1.mp4'])
+        yt.cleanUp(job)
+        yt.ledger.close()
+
+    def test_deadline_and_socket_timeout(self):
+        yt = self.make(1)
+        yt.runner.timeout = 0.05
+
+        class SlowExtractor(StubExtractor):
+            def extract_info(self, url, download=True):
+                for hook in self.params['progress_hooks']:
+                    hook({'status': 'downloading', 'downloaded_bytes': 1, 'total_bytes': 10})
+                    time.sleep(0.1)
+                    hook({'status': 'downloading', 'downloaded_bytes': 2, 'total_bytes': 10})
+                return StubExtractor.extract_info(self, url, download)
+        yt.backend = LibraryBackend(yt, library=types.SimpleNamespace(YoutubeDL=SlowExtractor))
+        job = yt.newJob('good1')
+        (path, output) = yt.backend.download(job, extractAudio=False)
+        self.assertIsNone(path)
+        self.assertIn('timed out', output)
+        self.assertEqual(yt.backend.downloader(False).params['socket_timeout'], yt.runner.stallTimeout)
+        yt.cleanUp(job)
+        yt.ledger.close()
+
+    def test_command_keeps_progress_output(self):
+        yt = self.make(1)
+        cmd = SubprocessBackend(yt).buildCmd(yt.newJob('good1'), True)
+        # --print-json would make youtube-dl quiet: no progress lines, and the stall timeout kills long downloads
+        self.assertNotIn('--print-json', cmd)
+        self.assertIn('--newline', cmd)
+        self.assertEqual(SubprocessBackend(yt).parseOutput('[download] 100%\nYTDL_FILE: /tmp/a b.mp3\n'), '/tmp/a b.mp3')
+        yt.ledger.close()
+
+    def test_make_backend(self):
+        self.assertIsInstance(makeBackend('subprocess', None), SubprocessBackend)
+        self.assertRaises(ValueError, makeBackend, 'ftp', None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,254 @@
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+import protocolModule as protocol
+from client_oop import ClientServer
+from jobQueueModule import JobQueue
+from profileModule import FormatProfile
+from ledgerModule import ledgers
+from server_oop import ServerConnect, ClientSession
+from test_youtubeClass import StubYoutubedl
+
+
+class TestJobQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.folder = tempfile.mkdtemp()
+        os.chdir(self.folder)
+        self.job_file = os.path.join(self.folder, 'jobs.db')
+        self.cache_folder = os.path.join(self.folder, 'cache')
+        self.parent = os.path.join(self.folder, 'youtube') + '/'
+        self.patch = mock.patch('server_oop.Youtubedl', lambda links, concurrency: StubYoutubedl(links, concurrency, self.parent))
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+        ledger = ledgers.get(self.parent + 'downloads/youtubeDownloadLedger.db')
+        if ledger:
+            ledger.close()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.folder)
+
+    def test_claim_and_recover(self):
+        jobs = JobQueue(self.job_file)
+        job_id = jobs.submit(['link1', 'link2', 'link1'])
+        self.assertEqual(jobs.pending_jobs(), [job_id])
+        self.assertEqual(jobs.claim(job_id), ['link1', 'link2'])
+        self.assertEqual(jobs.claim(job_id), [])
+        jobs.set_state(job_id, 'link2', 'finished', None, '/tmp/link2.mp4')
+        jobs.close()
+        # link1 was running when the server stopped
+        jobs = JobQueue(self.job_file)
+        self.assertEqual(jobs.recovered, 2)
+        self.assertEqual([(item['link'], item['state']) for item in jobs.links(job_id)], [('link1', 'queued'), ('link2', 'finished')])
+        self.assertEqual(jobs.pending_jobs(), [job_id])
+        jobs.set_state(job_id, 'link1', 'failed')
+        self.assertTrue(jobs.done(job_id))
+        jobs.set_folder(job_id, '/tmp/job')
+        self.assertEqual(jobs.remove(job_id), '/tmp/job')
+        self.assertFalse(jobs.exists(job_id))
+        jobs.close()
+
+    def serve(self, server, client, request):
+        """Function to run one connection between client and server, request being the client side of it
+        """
+        (a, b) = socket.socketpair()
+        client.cobj = b
+        client.connect_server = lambda: None
+        session = ClientSession(a, ('test', 0))
+        server.client_slots.acquire()
+        t = threading.Thread(target=server.handle_client, args=(session,))
+        t.start()
+        request()
+        t.join()
+        b.close()
+        return session
+
+    def wait_done(self, server, job_id):
+        for _ in range(500):
+            if server.jobs.done(job_id):
+                return
+            time.sleep(0.01)
+        self.fail("job {} did not finish".format(job_id))
+
+    def test_submit_detach_and_fetch_after_restart(self):
+        server = ServerConnect(cache_folder=self.cache_folder, job_file=self.job_file)
+        client = ClientServer('good1,bad1')
+        self.serve(server, client, client.submit)
+        self.wait_done(server, client.job)
+        server.stop_workers()
+        server.jobs.close()
+
+        server = ServerConnect(cache_folder=self.cache_folder, job_file=self.job_file)
+        fetcher = ClientServer('', job=client.job)
+
+        def fetch():
+            fetcher.send_data()
+            fetcher.recv_data()
+        self.serve(server, fetcher, fetch)
+        self.assertTrue(os.path.exists('good1.mp3') and os.path.exists('good1.mp4'))
+        self.assertEqual(dict((link, p['state']) for (link, p) in fetcher.progress.items()), {'good1': 'finished', 'bad1': 'failed'})
+        # Delivered job is forgotten
+        self.assertFalse(server.jobs.exists(client.job))
+        server.jobs.close()
+
+    def test_retry_failed_links(self):
+        server = ServerConnect(cache_folder=self.cache_folder, job_file=self.job_file)
+        job_id = server.submit(['good1', 'bad1'])
+        self.wait_done(server, job_id)
+        self.assertEqual(server.jobs.links(job_id)[1]['state'], 'failed')
+
+        class FixedYoutubedl(StubYoutubedl):
+            """Downloads of bad links work again
+            """
+            def runCmd(self, cmd, *argv, **kwargs):
+                return StubYoutubedl.runCmd(self, cmd.replace('bad', 'fixed'), *argv, **kwargs)
+
+        with mock.patch('server_oop.Youtubedl', lambda links, concurrency: FixedYoutubedl(links, concurrency, self.parent)):
+            # Failed link is queued again in its job, and the ledger failure as a new job
+            job_ids = server.retry_failed()
+            self.assertEqual(job_ids[0], job_id)
+            self.assertEqual(len(job_ids), 2)
+            for retried in job_ids:
+                self.wait_done(server, retried)
+        self.assertEqual([item['state'] for item in server.jobs.links(job_id)], ['finished', 'finished'])
+        self.assertEqual(ledgers[self.parent + 'downloads/youtubeDownloadLedger.db'].failedLinks(), [])
+        server.stop_workers()
+        server.jobs.close()
+
+    def test_interrupted_job_runs_after_restart(self):
+        jobs = JobQueue(self.job_file)
+        job_id = jobs.submit(['good1'])
+        jobs.claim(job_id)
+        jobs.close()
+        server = ServerConnect(cache_folder=self.cache_folder, job_file=self.job_file)
+        self.assertEqual(server.jobs.recovered, 1)
+        server.start_workers()
+        fetcher = ClientServer('', job=job_id)
+
+        def fetch():
+            fetcher.send_data()
+            fetcher.recv_data()
+        self.serve(server, fetcher, fetch)
+        self.assertTrue(os.path.exists('good1.mp3'))
+        server.stop_workers()
+        server.jobs.close()
+
+    def test_concurrent_jobs_share_one_download(self):
+        started = threading.Event()
+        release = threading.Event()
+        created = []
+
+        class BlockingYoutubedl(StubYoutubedl):
+            def runCmd(self, cmd, *argv, **kwargs):
+                started.set()
+                release.wait(5)
+                return StubYoutubedl.runCmd(self, cmd, *argv, **kwargs)
+
+        def factory(links, concurrency):
+            created.append(links)
+            return BlockingYoutubedl(links, concurrency, self.parent)
+        with mock.patch('server_oop.Youtubedl', factory):
+            server = ServerConnect(cache_folder=self.cache_folder, job_file=self.job_file, workers=2)
+            first = server.submit(['goodAAAAAAA'])
+            self.assertTrue(started.wait(5))
+            second = server.submit(['https://youtu.be/goodAAAAAAA?t=3'])
+            for _ in range(500):
+                if server.inflight['goodAAAAAAA/both']['waiters']:
+                    break
+                time.sleep(0.01)
+            release.set()
+            self.wait_done(server, first)
+            self.wait_done(server, second)
+        self.assertEqual(created, [['goodAAAAAAA']])
+        self.assertEqual(server.inflight, {})
+        session = ClientSession(None, ('test', 0))
+        session.job_id = second
+        server.attach(session)
+        self.assertEqual([(link, fmt) for (link, fmt, path, cached) in session.files],
+                         [('https://youtu.be/goodAAAAAAA?t=3', 'mp3'), ('https://youtu.be/goodAAAAAAA?t=3', 'mp4')])
+        server.finish_session(session)
+        server.stop_workers()
+        server.jobs.close()
+
+    def test_links_are_queued_as_they_arrive(self):
+        server = ServerConnect(cache_folder=self.cache_folder, job_file=self.job_file)
+        (a, b) = socket.socketpair()
+        session = ClientSession(a, ('test', 0))
+        server.client_slots.acquire()
+        t = threading.Thread(target=server.handle_client, args=(session,))
+        t.start()
+        protocol.send_json(b, protocol.MSG_LINKS, ['good1', 'good1'])
+        # First link is downloaded while the client is still sending links
+        for _ in range(500):
+            if session.job_id and server.jobs.done(session.job_id):
+                break
+            time.sleep(0.01)
+        self.assertTrue(os.path.exists(server.media_cache.acquire('good1', 'mp3')))
+        server.media_cache.release('good1', 'mp3')
+        protocol.send_json(b, protocol.MSG_LINKS, ['good2', 'good1'])
+        protocol.send_json(b, protocol.MSG_LINKS, [])
+        protocol.send_json(b, protocol.MSG_RESUME, [])
+        protocol.send_json(b, protocol.MSG_MANIFEST, {})
+        client = ClientServer('')
+        client.cobj = b
+        client.recv_data()
+        t.join()
+        b.close()
+        self.assertEqual(client.job, session.job_id)
+        self.assertEqual(session.link_count, 2)
+        self.assertEqual(sorted(f for f in os.listdir('.') if f.endswith('.mp3')), ['good1.mp3', 'good2.mp3'])
+        server.stop_workers()
+        server.jobs.close()
+
+    def test_audio_only_client(self):
+        server = ServerConnect(cache_folder=self.cache_folder, job_file=self.job_file)
+        created = []
+
+        def factory(links, concurrency):
+            created.append(StubYoutubedl(links, concurrency, self.parent))
+            return created[-1]
+        client = ClientServer('good1')
+        client.profile = FormatProfile('audio')
+
+        def request():
+            client.send_data()
+            client.recv_data()
+        with mock.patch('server_oop.Youtubedl', factory):
+            self.serve(server, client, request)
+        self.assertNotIn(' -k ', created[0].commands[0])
+        self.assertEqual(sorted(f for f in os.listdir('.') if f.startswith('good1')), ['good1.mp3'])
+        self.assertEqual(sorted(server.media_cache.entries), [server.media_cache.key('good1', 'mp3')])
+        # Client wanting both files needs the video too, only the mp3 is served from the cache by audio clients
+        self.assertFalse(server.is_cached('good1', FormatProfile()))
+        self.assertTrue(server.is_cached('good1', FormatProfile('audio')))
+        self.assertFalse(server.is_cached('good1', FormatProfile('audio', 128)))
+        server.stop_workers()
+        server.jobs.close()
+
+    def test_job_keeps_its_profile(self):
+        jobs = JobQueue(self.job_file)
+        job_id = jobs.submit(['good1'], FormatProfile('audio', 128).to_json())
+        self.assertEqual(jobs.profile(job_id), {'formats': 'audio', 'bitrate': 128})
+        self.assertEqual(jobs.profile(jobs.submit(['good2'])), None)
+        jobs.close()
+
+    def test_unknown_job(self):
+        server = ServerConnect(cache_folder=self.cache_folder, job_file=self.job_file)
+        fetcher = ClientServer('', job='nosuchjob')
+
+        def fetch():
+            fetcher.send_data()
+            self.assertRaises(Exception, fetcher.recv_data)
+        self.serve(server, fetcher, fetch)
+        server.jobs.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
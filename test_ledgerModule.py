@@ -0,0 +1,55 @@
+import os
+import shutil
+import tempfile
+import unittest
+from ledgerModule import DownloadLedger, getLedger
+
+
+class TestDownloadLedger(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.ledgerFile = os.path.join(self.folder, 'ledger.db')
+        self.legacyFile = os.path.join(self.folder, 'links.txt')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_import_legacy_file_once(self):
+        with open(self.legacyFile, 'w') as fh:
+            fh.write("link1,song1.mp3\nlink2,song2.mp3\n\n")
+        ledger = DownloadLedger(self.ledgerFile, self.legacyFile)
+        self.assertEqual(ledger.imported, 2)
+        self.assertEqual(ledger.getFile('link2'), 'song2.mp3')
+        ledger.close()
+        ledger = DownloadLedger(self.ledgerFile, self.legacyFile)
+        self.assertEqual(ledger.imported, 0)
+        self.assertEqual(ledger.count(), 2)
+        ledger.close()
+
+    def test_add_and_lookup_links(self):
+        ledger = DownloadLedger(self.ledgerFile, cacheSize=1)
+        ledger.addLink('link1', 'song1.mp3')
+        ledger.addLink('link2', 'song2.mp3')
+        self.assertTrue(ledger.isDownloaded('link1'))
+        self.assertFalse(ledger.isDownloaded('link3'))
+        found = ledger.lookupLinks(['link1', 'link2', 'link3'])
+        self.assertEqual(found, {'link1': 'song1.mp3', 'link2': 'song2.mp3'})
+        ledger.compact()
+        self.assertEqual(ledger.count(), 2)
+        ledger.close()
+
+    def test_shared_ledger_and_auto_compact(self):
+        ledger = getLedger(self.ledgerFile)
+        self.assertIs(getLedger(self.ledgerFile), ledger)
+        ledger.compactEvery = 2
+        ledger.addLink('link1', 'song1.mp3')
+        ledger.addLink('link2', 'song2.mp3')
+        self.assertEqual(ledger.inserts, 2)
+        ledger.close()
+        self.assertIsNot(getLedger(self.ledgerFile), ledger)
+        getLedger(self.ledgerFile).close()
+
+
+if __name__ == '__main__':
+    unittest.main()
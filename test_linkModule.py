@@ -0,0 +1,52 @@
+import os
+import shutil
+import tempfile
+import unittest
+from linkModule import LinkSource, batched, canonical_link, iter_unique, unique_links, video_id
+
+
+class TestLinks(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_video_id(self):
+        variants = ('https://www.youtube.com/watch?v=dQw4w9WgXcQ&t=1', 'https://youtu.be/dQw4w9WgXcQ',
+                    'https://www.youtube.com/shorts/dQw4w9WgXcQ', 'dQw4w9WgXcQ', 'https://youtu.be/dQw4w9WgXcQ?si=abc',
+                    'https://m.youtube.com/watch?feature=share&v=dQw4w9WgXcQ', 'https://www.youtube.com/live/dQw4w9WgXcQ',
+                    ' https://www.youtube-nocookie.com/embed/dQw4w9WgXcQ?start=5 ')
+        for link in variants:
+            self.assertEqual(video_id(link.strip()), 'dQw4w9WgXcQ')
+            self.assertEqual(canonical_link(link), 'https://www.youtube.com/watch?v=dQw4w9WgXcQ')
+        self.assertTrue(video_id('https://example.com/a.mp4').startswith('url-'))
+        self.assertEqual(canonical_link(' https://example.com/a.mp4'), 'https://example.com/a.mp4')
+        self.assertEqual(unique_links(list(variants) + ['https://example.com/a.mp4', 'x']), [variants[0], 'https://example.com/a.mp4', 'x'])
+
+    def test_link_file_is_read_lazily(self):
+        path = os.path.join(self.folder, 'links.txt')
+        with open(path, 'w') as fh:
+            fh.write("# my list\nlink1\n\n link2 ,link3\n")
+            for i in range(100000):
+                fh.write("https://youtu.be/{:011d}\n".format(i % 50000))
+        source = LinkSource(path)
+        links = iter(source)
+        self.assertEqual([next(links) for _ in range(3)], ['link1', 'link2', 'link3'])
+        # First batch comes before the file is read to its end
+        batches = batched(iter_unique(source), 1000)
+        self.assertEqual(len(next(batches)), 1000)
+        self.assertEqual(sum(len(batch) for batch in batches), 50003 - 1000)
+        # Source can be iterated again
+        self.assertEqual(sum(1 for link in source), 100003)
+
+    def test_comma_separated_links(self):
+        self.assertEqual(list(LinkSource(' link1, ,link2,')), ['link1', 'link2'])
+        seen = set()
+        self.assertEqual(list(iter_unique(['a', 'b'], seen)), ['a', 'b'])
+        self.assertEqual(list(iter_unique(['b', 'c'], seen)), ['c'])
+
+
+if __name__ == '__main__':
+    unittest.main()
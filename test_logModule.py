@@ -0,0 +1,49 @@
+import logging
+import logging.handlers
+import os
+import shutil
+import tempfile
+import unittest
+import logModule
+from logModule import Logs, setupLogging, stopLogging, logOutput
+
+
+class TestLogs(unittest.TestCase):
+
+    def setUp(self):
+        stopLogging()
+        self.folder = tempfile.mkdtemp()
+        self.logfile = os.path.join(self.folder, 'logs.txt')
+
+    def tearDown(self):
+        stopLogging()
+        shutil.rmtree(self.folder)
+
+    def read_log(self):
+        # Stopping the listener writes out the queued records
+        stopLogging()
+        with open(self.logfile) as fh:
+            return fh.read()
+
+    def test_handlers_added_once(self):
+        for _ in range(5):
+            obj = Logs(self.logfile)
+        root = logging.getLogger()
+        self.assertEqual(len([h for h in root.handlers if isinstance(h, logging.handlers.QueueHandler)]), 1)
+        obj.logger.info("only once")
+        self.assertEqual(self.read_log().count("only once"), 1)
+
+    def test_output_volume_controls(self):
+        setupLogging(self.logfile, outputLevel=logging.INFO, lines=2)
+        logOutput("line1\nline2\nline3", logging.INFO)
+        logOutput("hidden", logging.DEBUG)
+        log = self.read_log()
+        self.assertIn("1 lines skipped", log)
+        self.assertNotIn("line1", log)
+        self.assertIn("line2\nline3", log)
+        self.assertNotIn("hidden", log)
+        logModule.outputLines = 20
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import os
+import json
+import shutil
+import tempfile
+import tracemalloc
+import unittest
+import urllib.error
+import urllib.request
+from metricsModule import Metrics, startMetricsServer
+import metricsModule
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_stage_histogram_and_counters(self):
+        metrics = Metrics()
+        metrics.observe('download', 0.2)
+        metrics.observe('download', 2)
+        with metrics.timer('move'):
+            pass
+        metrics.inc('files_sent')
+        metrics.inc('bytes_sent', 100)
+        metrics.addGauge('cache', lambda: {'hits': 3, 'misses': 1})
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot['stages']['download']['count'], 2)
+        self.assertAlmostEqual(snapshot['stages']['download']['sum'], 2.2)
+        self.assertEqual(snapshot['stages']['download']['max'], 2)
+        self.assertEqual(snapshot['stages']['move']['count'], 1)
+        self.assertEqual(snapshot['counters'], {'files_sent': 1, 'bytes_sent': 100})
+        self.assertEqual(snapshot['gauges'], {'cache_hits': 3, 'cache_misses': 1})
+        text = metrics.prometheus()
+        #Buckets are cumulative
+        self.assertIn('youtube_stage_seconds_bucket{stage="download",le="0.5"} 1', text)
+        self.assertIn('youtube_stage_seconds_bucket{stage="download",le="5"} 2', text)
+        self.assertIn('youtube_stage_seconds_bucket{stage="download",le="+Inf"} 2', text)
+        self.assertIn('youtube_stage_seconds_count{stage="download"} 2', text)
+        self.assertIn('youtube_bytes_sent_total 100', text)
+        self.assertIn('youtube_cache_hits 3', text)
+
+    def test_failing_gauge_is_skipped(self):
+        metrics = Metrics()
+        metrics.addGauge('broken', lambda: 1 / 0)
+        metrics.addGauge('ok', lambda: 5)
+        self.assertEqual(metrics.gaugeValues(), {'ok': 5})
+
+    def test_endpoint(self):
+        metrics = metricsModule.metrics
+        metrics.observe('probe', 0.01)
+        server = startMetricsServer('127.0.0.1', 0)
+        try:
+            url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+            text = urllib.request.urlopen(url + '/metrics').read().decode()
+            self.assertIn('youtube_stage_seconds_count{stage="probe"}', text)
+            data = json.loads(urllib.request.urlopen(url + '/metrics.json').read().decode())
+            self.assertIn('probe', data['stages'])
+            with self.assertRaises(urllib.error.HTTPError):
+                urllib.request.urlopen(url + '/other')
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_profile_is_opt_in(self):
+        metrics = Metrics()
+        with metrics.profile('job1'):
+            sum(range(1000))
+        self.assertEqual(os.listdir(self.folder), [])
+        metrics.profileFolder = self.folder
+        metrics.traceMemory = True
+        self.addCleanup(tracemalloc.stop)
+        with metrics.profile('job1'):
+            data = [bytes(1000) for i in range(100)]
+        self.assertEqual(sorted(os.listdir(self.folder)), ['job1.mem.txt', 'job1.prof'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,29 @@
+import unittest
+from profileModule import FormatProfile, profile_from_json
+
+
+class TestFormatProfile(unittest.TestCase):
+
+    def test_formats_and_cache_keys(self):
+        both = FormatProfile()
+        self.assertEqual((both.formats, both.key), (('mp3', 'mp4'), 'both'))
+        self.assertEqual(both.audio_quality(2), 2)
+        audio = FormatProfile('audio', 128)
+        self.assertEqual((audio.formats, audio.key, audio.video), (('mp3',), 'audio-128k', False))
+        self.assertEqual(audio.audio_quality(2), '128K')
+        # mp3 of another bitrate is another cache entry, default mp3/mp4 are shared by every profile
+        self.assertEqual(audio.cache_format('mp3'), 'mp3-128k')
+        self.assertEqual(FormatProfile('audio').cache_format('mp3'), both.cache_format('mp3'))
+        self.assertEqual(FormatProfile('video').formats, ('mp4',))
+
+    def test_json(self):
+        self.assertEqual(profile_from_json(FormatProfile('audio', 96).to_json()).key, 'audio-96k')
+        self.assertEqual(profile_from_json(None).key, 'both')
+        self.assertEqual(profile_from_json({'formats': 'video'}).key, 'video')
+        self.assertRaises(ValueError, profile_from_json, {'formats': 'flac'})
+        self.assertRaises(ValueError, profile_from_json, {'formats': 'audio', 'bitrate': 5000})
+        self.assertRaises(ValueError, profile_from_json, ['audio'])
+
+
+if __name__ == '__main__':
+    unittest.main()
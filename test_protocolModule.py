@@ -0,0 +1,37 @@
+import socket
+import unittest
+import protocolModule as protocol
+
+
+class TestProtocol(unittest.TestCase):
+
+    def setUp(self):
+        (self.a, self.b) = socket.socketpair()
+
+    def tearDown(self):
+        self.a.close()
+        self.b.close()
+
+    def test_json_roundtrip(self):
+        protocol.send_json(self.a, protocol.MSG_LINKS, ['link1', 'link2'])
+        self.assertEqual(protocol.expect_json(self.b, protocol.MSG_LINKS), ['link1', 'link2'])
+
+    def test_coalesced_messages(self):
+        # Header, chunk and end written back to back must still be split correctly
+        protocol.send_json(self.a, protocol.MSG_FILE_HEADER, {'name': 'a.mp3', 'size': 3})
+        protocol.send_message(self.a, protocol.MSG_CHUNK, b'abc')
+        protocol.send_json(self.a, protocol.MSG_END, {'files': 1})
+        self.assertEqual(protocol.expect_json(self.b, protocol.MSG_FILE_HEADER)['size'], 3)
+        self.assertEqual(protocol.recv_header(self.b), (protocol.MSG_CHUNK, 3))
+        self.assertEqual(protocol.recv_exact(self.b, 3), b'abc')
+        self.assertEqual(protocol.expect_json(self.b, protocol.MSG_END), {'files': 1})
+
+    def test_bad_magic_and_eof(self):
+        self.a.sendall(b'XX' + b'\x00' * (protocol.HEADER_SIZE - 2))
+        self.assertRaises(protocol.ProtocolError, protocol.recv_header, self.b)
+        self.a.close()
+        self.assertRaises(protocol.ProtocolError, protocol.recv_exact, self.b, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+import protocolModule as protocol
+from client_oop import ClientServer
+from server_oop import ServerConnect, ClientSession
+
+
+class TestResumableTransfer(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.folder = tempfile.mkdtemp()
+        os.chdir(self.folder)
+        self.server = ServerConnect(cache_folder=os.path.join(self.folder, 'cache'))
+        self.client = ClientServer('')
+        self.data = os.urandom(2 * protocol.RESUME_BLOCK + 123)
+        self.source = os.path.join(self.folder, 'Foo Bar.mp3')
+        with open(self.source, 'wb') as fh:
+            fh.write(self.data)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.folder)
+
+    def transfer(self, expected_offset=0):
+        (a, b) = socket.socketpair()
+        session = ClientSession(a, ('test', 0))
+        session.resume = dict((p['name'], p) for p in self.client.find_partials())
+        self.assertEqual(self.server.resume_offset(session, self.source, 'FooBar.mp3', len(self.data)), expected_offset)
+        self.client.cobj = b
+
+        def serve():
+            self.server.send_file(session, self.source)
+            protocol.send_json(a, protocol.MSG_END, {'files': 1})
+        t = threading.Thread(target=serve)
+        t.start()
+        self.client.recv_data()
+        t.join()
+        a.close()
+        b.close()
+        with open('FooBar.mp3', 'rb') as fh:
+            self.assertEqual(fh.read(), self.data)
+        self.assertEqual(self.client.failed_files, [])
+        self.assertFalse(os.path.exists('FooBar.mp3.part.progress'))
+
+    def test_resume_after_killed_client(self):
+        # Killed client: .part keeps its preallocated size, progress file has the real count
+        with open('FooBar.mp3.part', 'wb') as fh:
+            fh.write(self.data[:protocol.RESUME_BLOCK + 10])
+            fh.write(b'\0' * (len(self.data) - protocol.RESUME_BLOCK - 10))
+        with open('FooBar.mp3.part.progress', 'w') as fh:
+            fh.write(str(protocol.RESUME_BLOCK + 10))
+        self.transfer(protocol.RESUME_BLOCK)
+
+    def test_corrupt_partial_is_sent_again(self):
+        # Second send of the same file uses sendfile() and the cached hash
+        self.transfer()
+        os.remove('FooBar.mp3')
+        with open('FooBar.mp3.part', 'wb') as fh:
+            fh.write(b'x' * protocol.RESUME_BLOCK)
+        self.transfer()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import shlex
+import sys
+import time
+import unittest
+from runnerModule import CommandRunner, parseProgress, TIMEOUT_STATUS
+
+
+class TestCommandRunner(unittest.TestCase):
+
+    def python(self, code):
+        return '{} -c {}'.format(sys.executable, shlex.quote(code))
+
+    def test_parse_progress(self):
+        event = parseProgress('[download]  50.0% of ~10.00MiB at  2.00MiB/s ETA 01:05')
+        self.assertEqual(event, {'percent': 50.0, 'downloaded_bytes': 5 * 1024 * 1024, 'total_bytes': 10 * 1024 * 1024,
+                                 'speed': 2.0 * 1024 * 1024, 'eta': 65})
+        event = parseProgress('[download]   0.0% of 3.50MiB at Unknown speed ETA Unknown ETA')
+        self.assertEqual((event['speed'], event['eta']), (None, None))
+        self.assertIsNone(parseProgress('[youtube] abc: Downloading webpage'))
+
+    def test_progress_events_and_bounded_output(self):
+        events = []
+        code = ("import sys\n"
+                "for i in range(3): sys.stdout.write('\\r[download] %d.0%% of 1.00KiB at 1.00KiB/s ETA 00:01' % (i * 50))\n"
+                "print()\n"
+                "for i in range(10000): print('line', i)\n"
+                "sys.exit(3)")
+        (output, status) = CommandRunner(keepLines=5).run(self.python(code), events.append)
+        self.assertEqual(status, 3)
+        self.assertEqual([e['percent'] for e in events], [0.0, 50.0, 100.0])
+        self.assertEqual(output.splitlines(), ['line {}'.format(i) for i in range(9995, 10000)])
+
+    def test_stall_and_wall_clock_timeouts(self):
+        runner = CommandRunner(stallTimeout=0.5)
+        runner.pollInterval = 0.1
+        t1 = time.monotonic()
+        (output, status) = runner.run(self.python("import time; print('start', flush=True); time.sleep(30)"))
+        self.assertLess(time.monotonic() - t1, 10)
+        self.assertEqual(status, TIMEOUT_STATUS)
+        self.assertIn('without output', output)
+        # Chatty command never stalls but still hits the wall clock limit
+        runner = CommandRunner(timeout=0.5, stallTimeout=0.5)
+        runner.pollInterval = 0.1
+        (output, status) = runner.run(self.python("import time\nwhile True: print('x', flush=True); time.sleep(0.05)"))
+        self.assertEqual(status, TIMEOUT_STATUS)
+        self.assertIn('running for', output)
+
+
+if __name__ == '__main__':
+    unittest.main()
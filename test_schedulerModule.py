@@ -0,0 +1,117 @@
+import threading
+import time
+import unittest
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from schedulerModule import DownloadScheduler, TokenBucket, hostOf
+
+
+class ThrottlingHandler(BaseHTTPRequestHandler):
+    """Stub media host serving 64 KB per request, answering 429 when more than capacity requests run at once
+    """
+    capacity = 3
+    lock = threading.Lock()
+    active = 0
+    peak = 0
+    throttled = 0
+
+    def do_GET(self):
+        cls = ThrottlingHandler
+        with cls.lock:
+            cls.peak = max(cls.peak, cls.active + 1)
+            over = cls.active >= cls.capacity
+            if over:
+                cls.throttled += 1
+            else:
+                cls.active += 1
+        if over:
+            self.send_error(429, 'Too Many Requests')
+            return
+        try:
+            # Every connection is limited in speed, so throughput grows with concurrency up to capacity
+            time.sleep(0.02)
+            body = b'x' * 65536
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with cls.lock:
+                cls.active -= 1
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestDownloadScheduler(unittest.TestCase):
+
+    def test_host_of_link(self):
+        self.assertEqual(hostOf('https://youtu.be/dQw4w9WgXcQ'), 'youtube.com')
+        self.assertEqual(hostOf('https://m.youtube.com/watch?v=dQw4w9WgXcQ'), 'youtube.com')
+        self.assertEqual(hostOf('https://cdn.example.com/a.mp4'), 'cdn.example.com')
+        self.assertEqual(hostOf('good1'), 'unknown')
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(50, burst=2)
+        t1 = time.monotonic()
+        for _ in range(7):
+            bucket.acquire()
+        # Burst of 2, then 5 tokens at 50 per second
+        self.assertGreaterEqual(time.monotonic() - t1, 0.09)
+
+    def test_decisions(self):
+        scheduler = DownloadScheduler(initial=4, maximum=8)
+        slots = [scheduler.acquire('https://example.com/a') for _ in range(4)]
+        scheduler.release(slots[0], False, 0, 'ERROR: unable to download video data: HTTP Error 429: Too Many Requests')
+        self.assertEqual(scheduler.hosts['example.com'].limit, 2)
+        # Started before the decrease, the same congestion is not counted twice
+        scheduler.release(slots[1], False)
+        self.assertEqual(scheduler.hosts['example.com'].limit, 2)
+        scheduler.release(slots[2], True, 100)
+        scheduler.release(slots[3], True, 100)
+        self.assertEqual(scheduler.hosts['example.com'].limit, 3)
+        self.assertEqual([decision[4].split()[0] for decision in scheduler.decisions], ['throttled', 'throughput'])
+        self.assertEqual(scheduler.stats(), {'example_com_limit': 3, 'example_com_active': 0})
+        fixed = DownloadScheduler(initial=1, maximum=5, adaptive=False)
+        fixed.release(fixed.acquire('https://example.com/a'), False)
+        self.assertEqual(fixed.hosts['example.com'].limit, 5)
+
+    def test_adapts_to_throttling_host(self):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), ThrottlingHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = 'http://127.0.0.1:{}/video.mp4'.format(server.server_address[1])
+        scheduler = DownloadScheduler(initial=1, maximum=8, rate=500, burst=8)
+        results = []
+
+        def worker():
+            for _ in range(20):
+                slot = scheduler.acquire(url)
+                (ok, size, output) = (False, 0, '')
+                try:
+                    size = len(urllib.request.urlopen(url).read())
+                    ok = True
+                except urllib.error.HTTPError as e:
+                    output = 'ERROR: HTTP Error {}: {}'.format(e.code, e.reason)
+                finally:
+                    scheduler.release(slot, ok, size, output)
+                results.append(ok)
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        server.shutdown()
+        server.server_close()
+        reasons = [decision[4] for decision in scheduler.decisions]
+        # Grew from 1 while throughput rose, and backed off when the host throttled
+        self.assertTrue(any(reason.startswith('throughput') for reason in reasons))
+        self.assertIn('throttled', reasons)
+        self.assertLessEqual(max(decision[3] for decision in scheduler.decisions), ThrottlingHandler.capacity + 2)
+        self.assertLessEqual(ThrottlingHandler.peak, ThrottlingHandler.capacity + 2)
+        # Throttling stays the exception
+        self.assertLess(results.count(False), len(results) // 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from client_oop import ClientServer
+from server_oop import ServerConnect, ClientSession
+from test_youtubeClass import StubYoutubedl
+
+
+class TestStreamingDelivery(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.folder = tempfile.mkdtemp()
+        os.chdir(self.folder)
+        self.parent = os.path.join(self.folder, 'youtube') + '/'
+        self.first_received = threading.Event()
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.folder)
+
+    def serve(self, stream):
+        """Function to run one session where link 'slow' finishes only after the client got a file
+        """
+        first_received = self.first_received
+
+        class SlowYoutubedl(StubYoutubedl):
+            def runCmd(self, cmd, *argv, **kwargs):
+                if cmd.split()[-1] == 'slow':
+                    first_received.wait(5)
+                return StubYoutubedl.runCmd(self, cmd, *argv, **kwargs)
+
+        server = ServerConnect(cache_folder=os.path.join(self.folder, 'cache'), stream=stream)
+        client = ClientServer('')
+        real_recv_file = client.recv_file
+
+        def recv_file(receiver, header):
+            taken = real_recv_file(receiver, header)
+            first_received.set()
+            return taken
+        client.recv_file = recv_file
+        (a, b) = socket.socketpair()
+        client.cobj = b
+        session = ClientSession(a, ('test', 0))
+        server.receive_data = lambda session: setattr(session, 'job_id', server.submit(['fast', 'slow']))
+        server.client_slots.acquire()
+        created = []
+
+        def factory(links, concurrency):
+            created.append(SlowYoutubedl(links, concurrency, self.parent))
+            return created[-1]
+        with mock.patch('server_oop.Youtubedl', factory):
+            t = threading.Thread(target=server.handle_client, args=(session,))
+            t.start()
+            client.recv_data()
+            t.join()
+        b.close()
+        server.stop_workers()
+        # Delivered job is forgotten with its folder
+        self.assertFalse(server.jobs.exists(session.job_id))
+        self.assertEqual(client.job, session.job_id)
+        created[0].ledger.close()
+        server.jobs.close()
+        return client
+
+    def test_first_file_sent_before_batch_ends(self):
+        client = self.serve(stream=True)
+        self.assertEqual(sorted(f for f in os.listdir('.') if f.endswith('.mp3')), ['fast.mp3', 'slow.mp3'])
+        self.assertEqual(client.failed_files, [])
+        # 'slow' was released by the client receiving 'fast', not by the timeout
+        self.assertLess(client.first_file_time, 4)
+        # Final link states arrived as PROGRESS messages
+        self.assertEqual(dict((link, p['state']) for (link, p) in client.progress.items()), {'fast': 'finished', 'slow': 'finished'})
+
+    def test_progress_between_chunks(self):
+        (a, b) = socket.socketpair()
+        server = ServerConnect(cache_folder=os.path.join(self.folder, 'cache'))
+        server.chunk_size = 1024
+        session = ClientSession(a, ('test', 0))
+        client = ClientServer('')
+        client.cobj = b
+        path = os.path.join(self.folder, 'song.mp3')
+        with open(path, 'wb') as fh:
+            fh.write(os.urandom(4096))
+        server.report_progress(session, 'link1', 'downloading', {'downloaded_bytes': 10, 'total_bytes': 100, 'speed': 5.0, 'eta': 18})
+
+        def serve():
+            server.send_file(session, path)
+            server.report_progress(session, 'link1', 'failed')
+            server.send_progress(session)
+            server.send_error(session, 'done')
+        t = threading.Thread(target=serve)
+        t.start()
+        self.assertRaises(Exception, client.recv_data)
+        t.join()
+        a.close()
+        b.close()
+        self.assertTrue(os.path.exists('song.mp3'))
+        self.assertEqual(client.progress['link1']['state'], 'failed')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+from unittest import mock
+import protocolModule as protocol
+from client_oop import ClientServer
+from server_oop import ServerConnect, ClientSession
+from transferModule import HashCache
+
+
+class TestManifestSync(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.folder = tempfile.mkdtemp()
+        os.chdir(self.folder)
+        self.server = ServerConnect(cache_folder=os.path.join(self.folder, 'cache'))
+        self.client = ClientServer('')
+        self.client.sync = True
+        # Files of the job on the server
+        os.makedirs('served')
+        self.files = {}
+        for (name, data) in (('song.mp3', b'a' * 1000), ('song.mp4', b'v' * 3000)):
+            self.files[name] = os.path.join(self.folder, 'served', name)
+            with open(self.files[name], 'wb') as fh:
+                fh.write(data)
+
+    def tearDown(self):
+        self.server.hash_cache.close()
+        if self.client.hash_cache:
+            self.client.hash_cache.close()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.folder)
+
+    def transfer(self):
+        """Function to run one session sending both files, the client announcing what it holds
+        Output : names of the files sent
+        """
+        (a, b) = socket.socketpair()
+        session = ClientSession(a, ('test', 0))
+        session.manifest = self.client.build_manifest()
+        for path in self.files.values():
+            session.ready.put(('link', os.path.splitext(path)[1][1:], path, False))
+        session.ready.put(None)
+        self.client.cobj = b
+        received = []
+        real_recv_file = self.client.recv_file
+
+        def recv_file(receiver, header):
+            received.append(header['name'])
+            return real_recv_file(receiver, header)
+        self.client.recv_file = recv_file
+        t = threading.Thread(target=self.server.send_data, args=(session,))
+        t.start()
+        self.client.recv_data()
+        t.join()
+        a.close()
+        b.close()
+        return sorted(received)
+
+    def test_held_files_are_skipped(self):
+        self.assertEqual(self.transfer(), ['song.mp3', 'song.mp4'])
+        self.assertEqual(self.client.skipped, 0)
+        # Second session sends nothing, hashes of both sides come from their caches
+        with mock.patch.object(HashCache, 'index', side_effect=AssertionError('file read again')):
+            self.assertEqual(self.transfer(), [])
+        self.assertEqual(self.client.skipped, 2)
+
+    def test_changed_files_are_sent_again(self):
+        self.transfer()
+        # Same size, other content
+        with open('song.mp3', 'wb') as fh:
+            fh.write(b'b' * 1000)
+        # Other size
+        with open('song.mp4', 'ab') as fh:
+            fh.write(b'v')
+        self.assertEqual(self.transfer(), ['song.mp3', 'song.mp4'])
+        self.assertEqual(self.client.skipped, 0)
+        with open('song.mp4', 'rb') as fh:
+            self.assertEqual(fh.read(), b'v' * 3000)
+
+    def test_manifest_skips_partial_files(self):
+        with open('other.mp3.part', 'wb') as fh:
+            fh.write(b'x')
+        with open('other.mp3', 'wb') as fh:
+            fh.write(b'x')
+        self.assertEqual(list(self.client.build_manifest()), ['other.mp3'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import unittest
+from unittest import mock
+from toolchainModule import ToolchainRegistry
+
+
+class TestToolchainRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.calls = os.path.join(self.folder, 'calls')
+        # Fake youtube-dl recording every invocation
+        self.tool = os.path.join(self.folder, 'youtube-dl')
+        with open(self.tool, 'w') as fh:
+            fh.write("#!{}\nimport sys\nopen({!r}, 'a').write(' '.join(sys.argv[1:]) + '\\n')\nprint('2020.01.01')\n".format(sys.executable, self.calls))
+        os.chmod(self.tool, stat.S_IRWXU)
+        self.env = mock.patch.dict(os.environ, {'PATH': self.folder})
+        self.env.start()
+
+    def tearDown(self):
+        self.env.stop()
+        shutil.rmtree(self.folder)
+
+    def read_calls(self):
+        if not os.path.exists(self.calls):
+            return []
+        with open(self.calls) as fh:
+            return fh.read().split('\n')[:-1]
+
+    def test_probe_is_cached_until_ttl(self):
+        registry = ToolchainRegistry(ttl=3600)
+        for _ in range(5):
+            self.assertEqual(registry.resolve('youtube-dl'), self.tool)
+        self.assertEqual(registry.get('youtube-dl').version, '2020.01.01')
+        self.assertIsNone(registry.resolve('avconv'))
+        self.assertEqual(self.read_calls(), ['--version'])
+        registry.ttl = 0
+        registry.resolve('youtube-dl')
+        self.assertEqual(self.read_calls(), ['--version', '--version'])
+
+    def test_updates_run_in_background_once(self):
+        registry = ToolchainRegistry(updateInterval=3600)
+        t = registry.scheduleUpdates('youtube-dl')
+        self.assertIs(registry.scheduleUpdates('youtube-dl'), t)
+        registry.stop()
+        self.assertFalse(t.is_alive())
+        self.assertEqual(self.read_calls(), ['--version', '-U'])
+        # Update dropped the cached version
+        self.assertNotIn('youtube-dl', registry.tools)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+import errno
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from transferModule import FileSender, FileReceiver, HashCache
+
+
+class TestFileSender(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.data = os.urandom(3 * 1024 * 1024 + 7)
+        self.source = os.path.join(self.folder, 'source.mp4')
+        with open(self.source, 'wb') as fh:
+            fh.write(self.data)
+        (self.a, self.b) = socket.socketpair()
+
+    def tearDown(self):
+        self.a.close()
+        self.b.close()
+        shutil.rmtree(self.folder)
+
+    def read_all(self, size, result):
+        chunks = []
+        received = 0
+        while received < size:
+            data = self.b.recv(1024 * 1024)
+            if not data:
+                break
+            chunks.append(data)
+            received += len(data)
+        result.append(b''.join(chunks))
+
+    def send(self, sender, offset, count):
+        result = []
+        t = threading.Thread(target=self.read_all, args=(count, result))
+        t.start()
+        with open(self.source, 'rb') as fh:
+            sent = sender.send_range(self.a, fh, offset, count)
+        t.join()
+        self.assertEqual(sent, count)
+        return result[0]
+
+    def test_sendfile_and_buffered_paths(self):
+        for use_sendfile in (True, False):
+            sender = FileSender(buffer_size=64 * 1024, use_sendfile=use_sendfile)
+            self.assertEqual(self.send(sender, 0, len(self.data)), self.data)
+            self.assertEqual(self.send(sender, 1000, 5000), self.data[1000:6000])
+
+    def test_sendfile_on_socket_with_timeout(self):
+        self.a.settimeout(5)
+        self.assertEqual(self.send(FileSender(), 0, len(self.data)), self.data)
+
+    def test_fallback_continues_after_partial_sendfile(self):
+        real_sendfile = os.sendfile
+        calls = []
+
+        def flaky_sendfile(out_fd, in_fd, offset, count):
+            calls.append(offset)
+            if len(calls) > 1:
+                raise OSError(errno.EINVAL, 'not supported')
+            return real_sendfile(out_fd, in_fd, offset, min(count, 4096))
+
+        sender = FileSender(buffer_size=64 * 1024)
+        with mock.patch('transferModule.os.sendfile', flaky_sendfile):
+            self.assertEqual(self.send(sender, 0, len(self.data)), self.data)
+        self.assertFalse(sender.use_sendfile)
+
+
+class TestFileReceiver(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.data = os.urandom(1024 * 1024 + 3)
+        self.target = os.path.join(self.folder, 'target.mp3')
+        (self.a, self.b) = socket.socketpair()
+        self.receiver = FileReceiver(buffer_size=64 * 1024)
+
+    def tearDown(self):
+        self.receiver.close()
+        self.a.close()
+        self.b.close()
+        shutil.rmtree(self.folder)
+
+    def feed(self, data, close=False):
+        def run():
+            self.a.sendall(data)
+            if close:
+                self.a.shutdown(socket.SHUT_WR)
+        t = threading.Thread(target=run)
+        t.start()
+        return t
+
+    def test_reads_exactly_announced_size(self):
+        # Bytes of the next message must stay in the socket
+        t = self.feed(self.data + b'NEXT')
+        incoming = self.receiver.open_file(self.target, len(self.data))
+        self.receiver.recv_into_file(self.b, incoming, len(self.data))
+        self.receiver.finish_file(incoming)
+        t.join()
+        with open(self.target, 'rb') as fh:
+            self.assertEqual(fh.read(), self.data)
+        self.assertEqual(self.b.recv(4), b'NEXT')
+
+    def test_eof_mid_file_truncates_preallocated_tail(self):
+        half = len(self.data) // 2
+        t = self.feed(self.data[:half], close=True)
+        incoming = self.receiver.open_file(self.target, len(self.data))
+        self.assertRaises(EOFError, self.receiver.recv_into_file, self.b, incoming, len(self.data))
+        self.receiver.finish_file(incoming)
+        t.join()
+        self.assertEqual(incoming.written, half)
+        with open(self.target, 'rb') as fh:
+            self.assertEqual(fh.read(), self.data[:half])
+
+
+class TestHashCache(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'song.mp3')
+        with open(self.path, 'wb') as fh:
+            fh.write(b'x' * 10000)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_digests_survive_reopen(self):
+        cache_file = os.path.join(self.folder, 'hashes.db')
+        cache = HashCache(4096, cache_file)
+        digest = cache.digest(self.path)
+        blocks = cache.get(self.path)['blocks']
+        self.assertEqual(len(blocks), 2)
+        cache.close()
+        cache = HashCache(4096, cache_file)
+        with mock.patch.object(HashCache, 'index', side_effect=AssertionError('file read again')):
+            self.assertEqual(cache.digest(self.path), digest)
+            self.assertEqual(cache.prefix_digest(self.path, 8192), blocks[1])
+        # Changed file is hashed again
+        with open(self.path, 'ab') as fh:
+            fh.write(b'y')
+        self.assertNotEqual(cache.digest(self.path), digest)
+        cache.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
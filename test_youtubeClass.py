@@ -1,16 +1,227 @@
+import os
+import re
+import shutil
+import stat
+import sys
+import tempfile
 import unittest
+from downloaderModule import FILE_MARKER
+from profileModule import FormatProfile
+from schedulerModule import RetryPolicy
 from youtubeClass import Youtubedl
 
 
+class StubYoutubedl(Youtubedl):
+    """Youtubedl with youtube-dl replaced by a stub which writes the mp3/mp4 of the link
+    """
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('backend', 'subprocess')
+        Youtubedl.__init__(self, *args, **kwargs)
+        #Failures are retried without waiting
+        self.retry = RetryPolicy(attempts=2, base=0)
+        #youtube-dl commands run
+        self.commands = []
+
+    def checkYoutubeDl(self):
+        pass
+
+    def runCmd(self, cmd, *argv, **kwargs):
+        link = cmd.split()[-1]
+        if 'bad' in link:
+            return ('ERROR: unable to download', 1)
+        folder = re.search(r"-o '(.*)%\(title\)s", cmd).group(1)
+        #Without -x only the video is downloaded, audio comes from the pipeline transcoder.
+        #Without -k the audio stream is dropped after extraction
+        source = 'm4a' if 'bestaudio' in cmd else 'mp4'
+        extensions = (source,) if ' -x ' not in cmd else ('mp3', source) if ' -k ' in cmd else ('mp3',)
+        for ext in extensions:
+            with open('{}{}.{}'.format(folder, link, ext), 'w') as fh:
+                fh.write(link)
+        self.commands.append(cmd)
+        #--exec reports the mp3 when audio is extracted
+        final = 'mp3' if ' -x ' in cmd else source
+        return ('[download] Destination\n{} {}{}.{}'.format(FILE_MARKER, folder, link, final), 0)
+
+
 class TestYoutubedl(unittest.TestCase):
 
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.parentFolder = os.path.join(self.folder, 'youtube') + '/'
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
     def test_create_folder(self):
-        example = 'ut2'
+        example = os.path.join(self.folder, 'ut2')
         # obj  = Youtubedl()
         result = Youtubedl.createFolder(self, folder=example)
         self.assertEqual(result, None)
 
+    def check_batch(self, concurrency):
+        yt = StubYoutubedl('bad1,good1,good2,bad2,good3', concurrency, self.parentFolder)
+        self.assertEqual(yt.runYoutube(), 1)
+        self.assertEqual(sorted(yt.failedLinks), ['bad1', 'bad2'])
+        self.assertEqual(sorted(os.listdir(yt.youtubeAudioFolder)), ['good1.mp3', 'good2.mp3', 'good3.mp3'])
+        self.assertEqual(yt.ledger.lookupLinks(yt.links), {'good1': 'good1.mp3', 'good2': 'good2.mp3', 'good3': 'good3.mp3'})
+        # Job folders are removed once their files are moved
+        self.assertEqual([d for d in os.listdir(yt.youtubeDownloadFolder) if d.startswith('job')], [])
+        yt.ledger.close()
+
+    def test_failures_do_not_block_sequential_batch(self):
+        self.check_batch(1)
+
+    def test_parallel_batch(self):
+        self.check_batch(3)
+
+    def test_isolated_objects_keep_their_own_files(self):
+        # Two server sessions downloading the same link at the same time
+        sessions = []
+        for name in ('session1', 'session2'):
+            yt = StubYoutubedl('good1', 1, self.parentFolder)
+            yt.skipDownloaded = False
+            yt.isolate(name)
+            sessions.append(yt)
+        for yt in sessions:
+            job = yt.newJob('good1')
+            job.videoFile = yt.backend.download(job, extractAudio=True)[0]
+            job.audioFile = os.path.splitext(job.videoFile)[0] + '.mp3'
+            yt.finalizeJob(job)
+            yt.cleanUp(job)
+        self.assertNotEqual(sessions[0].finishedJobs[0].audioFile, sessions[1].finishedJobs[0].audioFile)
+        for yt in sessions:
+            self.assertTrue(os.path.exists(yt.finishedJobs[0].audioFile))
+        yt.ledger.close()
+
+    def test_pipeline_batch(self):
+        # Stub transcoder copies the "video" to the mp3 path: <transcoder> ... -i <video> ... <audio>
+        transcoder = os.path.join(self.folder, 'transcoder')
+        with open(transcoder, 'w') as fh:
+            fh.write("#!{}\nimport sys, shutil\nshutil.copy(sys.argv[sys.argv.index('-i') + 1], sys.argv[-1])\n".format(sys.executable))
+        os.chmod(transcoder, stat.S_IRWXU)
+        yt = StubYoutubedl('bad1,good1,good2,bad2,good3', 2, self.parentFolder, pipeline=True)
+        yt.transcoder = transcoder
+        self.assertEqual(yt.runYoutube(), 1)
+        self.assertEqual(sorted(yt.failedLinks), ['bad1', 'bad2'])
+        self.assertEqual(sorted(os.listdir(yt.youtubeAudioFolder)), ['good1.mp3', 'good2.mp3', 'good3.mp3'])
+        self.assertEqual(sorted(os.listdir(yt.youtubeVideoFolder)), ['good1.mp4', 'good2.mp4', 'good3.mp4'])
+        self.assertEqual(len(yt.ledger.lookupLinks(yt.links)), 3)
+        yt.ledger.close()
+
+
+    def test_link_file(self):
+        path = os.path.join(self.folder, 'links.txt')
+        with open(path, 'w') as fh:
+            fh.write("good1\nbad1\n# good9\n\ngood2,good3\ngood1\n")
+        yt = StubYoutubedl(path, 2, self.parentFolder)
+        self.assertEqual(yt.runYoutube(), 1)
+        self.assertEqual(yt.failedLinks, ['bad1'])
+        self.assertEqual(sorted(os.listdir(yt.youtubeAudioFolder)), ['good1.mp3', 'good2.mp3', 'good3.mp3'])
+        yt.ledger.close()
+
+    def test_link_list_is_not_read(self):
+        # Links given as a list are never opened as a file or split on commas
+        path = os.path.join(self.folder, 'links.txt')
+        with open(path, 'w') as fh:
+            fh.write("good1\n")
+        yt = StubYoutubedl([path, 'good2,good3'], 1, self.parentFolder)
+        self.assertEqual(list(yt.links), [path, 'good2,good3'])
+        yt.ledger.close()
+
+    def test_repeated_and_variant_links(self):
+        # Stub files are named after the first spelling of a link, so it is a bare video id
+        yt = StubYoutubedl('goodAAAAAAA,https://youtu.be/goodAAAAAAA?t=3,good1,good1', 2, self.parentFolder)
+        self.assertEqual(yt.runYoutube(), 0)
+        self.assertEqual(sorted(os.listdir(yt.youtubeAudioFolder)), ['good1.mp3', 'goodAAAAAAA.mp3'])
+        self.assertEqual(len(yt.finishedJobs), 2)
+        # Any variant of a downloaded link is found in the ledger
+        yt = StubYoutubedl('https://m.youtube.com/watch?feature=share&v=goodAAAAAAA', 1, self.parentFolder)
+        self.assertEqual(yt.runYoutube(), 0)
+        self.assertEqual(yt.finishedJobs, [])
+        yt.ledger.close()
+
+    def test_retry_resumes_partial_download(self):
+        size = 1000
+
+        class FlakyYoutubedl(StubYoutubedl):
+            """Connection of a 'flaky' link drops after each 400 bytes. Bytes fetched by every attempt are counted
+            """
+            fetched = []
+
+            def runCmd(self, cmd, *argv, **kwargs):
+                link = cmd.split()[-1]
+                if 'flaky' not in link:
+                    return StubYoutubedl.runCmd(self, cmd, *argv, **kwargs)
+                folder = re.search(r"-o '(.*)%\(title\)s", cmd).group(1)
+                part = '{}{}.mp4.part'.format(folder, link)
+                have = os.path.getsize(part) if '--continue' in cmd and os.path.exists(part) else 0
+                get = min(400, size - have)
+                with open(part, 'a' if have else 'w') as fh:
+                    fh.write('x' * get)
+                self.fetched.append(get)
+                if have + get < size:
+                    return ('ERROR: unable to download video data: Connection reset by peer', 1)
+                os.rename(part, part[:-len('.part')])
+                for ext in ('mp3',):
+                    with open('{}{}.{}'.format(folder, link, ext), 'w') as fh:
+                        fh.write(link)
+                return ('{} {}{}.mp3'.format(FILE_MARKER, folder, link), 0)
+
+        # Three attempts are needed, every byte is fetched once
+        yt = FlakyYoutubedl('flaky1,good1', 1, self.parentFolder)
+        yt.retry = RetryPolicy(attempts=3, base=0)
+        self.assertEqual(yt.runYoutube(), 0)
+        self.assertEqual(yt.fetched, [400, 400, 200])
+        self.assertEqual(os.path.getsize(os.path.join(yt.youtubeVideoFolder, 'flaky1.mp4')), size)
+        # Out of attempts, the partial file is kept in the shared downloads folder and the link recorded as failed
+        FlakyYoutubedl.fetched = []
+        yt = FlakyYoutubedl('flaky2,good2', 1, self.parentFolder)
+        yt.isolate('job1')
+        self.assertEqual(yt.runYoutube(), 1)
+        self.assertEqual(yt.fetched, [400, 400])
+        self.assertEqual(yt.ledger.failedLinks(), ['flaky2'])
+        downloads = os.path.join(self.parentFolder, 'downloads')
+        self.assertEqual(os.path.dirname(yt.partialFolder('flaky2')), downloads)
+        self.assertEqual(os.listdir(yt.partialFolder('flaky2')), ['flaky2.mp4.part'])
+        # Private folder of the first object is gone, next one retries only the failed link from the kept bytes
+        shutil.rmtree(yt.youtubeDownloadFolder)
+        FlakyYoutubedl.fetched = []
+        yt = FlakyYoutubedl(yt.ledger.failedLinks(), 1, self.parentFolder)
+        yt.isolate('job2')
+        self.assertEqual(yt.runYoutube(), 0)
+        self.assertEqual(yt.fetched, [200])
+        self.assertEqual(yt.ledger.failedLinks(), [])
+        self.assertEqual(os.listdir(yt.youtubeAudioFolder), ['flaky2.mp3'])
+        self.assertEqual([d for d in os.listdir(downloads) if d.startswith('partial')], [])
+        yt.ledger.close()
+
+    def test_retry_policy(self):
+        policy = RetryPolicy(attempts=5, base=1, cap=6)
+        for attempt in range(1, 6):
+            self.assertTrue(min(6, 2 ** (attempt - 1)) / 2 <= policy.delay(attempt) <= min(6, 2 ** (attempt - 1)))
+        self.assertTrue(policy.retryable('ERROR: HTTP Error 429: Too Many Requests'))
+        self.assertFalse(policy.retryable('ERROR: Video unavailable'))
+
+    def test_profiles_download_only_wanted_files(self):
+        yt = StubYoutubedl('good1', 1, self.parentFolder)
+        yt.profile = FormatProfile('audio', 128)
+        self.assertEqual(yt.runYoutube(), 0)
+        # Audio only stream, not kept after the extraction
+        self.assertIn('-x --audio-quality 128K --audio-format mp3 -f bestaudio', yt.commands[0])
+        self.assertNotIn(' -k ', yt.commands[0])
+        self.assertEqual(os.listdir(yt.youtubeAudioFolder), ['good1.mp3'])
+        self.assertEqual(os.listdir(yt.youtubeVideoFolder), [])
+        self.assertEqual(yt.finishedJobs[0].videoFile, None)
+        yt = StubYoutubedl('good2', 1, self.parentFolder)
+        yt.profile = FormatProfile('video')
+        self.assertEqual(yt.runYoutube(), 0)
+        self.assertNotIn(' -x ', yt.commands[0])
+        self.assertEqual(os.listdir(yt.youtubeVideoFolder), ['good2.mp4'])
+        self.assertEqual(os.listdir(yt.youtubeAudioFolder), ['good1.mp3'])
+        self.assertEqual(yt.ledger.getFile('good2'), 'good2.mp4')
+        yt.ledger.close()
+
 
 if __name__ == '__main__':
-    if __name__ == '__main__':
-        unittest.main()
+    unittest.main()
@@ -0,0 +1,144 @@
+#!/usr/bin/python
+import shutil
+import threading
+import time
+import logging
+import subprocess as sp
+
+#Seconds a probed binary path and version stay valid
+TOOLCHAIN_TTL = 3600
+#Seconds between two background update checks of a tool
+UPDATE_INTERVAL = 24*3600
+
+#Registry shared by all Youtubedl objects of this process
+toolchain = None
+toolchainLock = threading.Lock()
+
+
+def getToolchain(ttl=TOOLCHAIN_TTL,updateInterval=UPDATE_INTERVAL):
+    """Function to return the process wide toolchain registry, creating it on first use
+    """
+    global toolchain
+    with toolchainLock:
+        if toolchain is None:
+            toolchain = ToolchainRegistry(ttl,updateInterval)
+        return(toolchain)
+
+
+class Tool(object):
+    """Cached probe result of one external binary
+    """
+
+    def __init__(self,name,path,version,probedAt):
+        self.name = name
+        #None when the binary is not on PATH
+        self.path = path
+        self.version = version
+        self.probedAt = probedAt
+
+
+class ToolchainRegistry(object):
+    """Registry of external binaries (youtube-dl, avconv, ...).
+       Each binary is looked up and its version read once, then served from memory until the TTL expires.
+       Update checks run in a daemon thread, never on the request path
+    """
+
+    def __init__(self,ttl=TOOLCHAIN_TTL,updateInterval=UPDATE_INTERVAL,logger=None):
+        self.ttl = ttl
+        self.updateInterval = updateInterval
+        self.logger = logger or logging.getLogger()
+        #name -> Tool
+        self.tools = {}
+        #name -> update thread
+        self.updaters = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def probe(self,name,versionArgs=('--version',)):
+        """Function to locate a binary and read its version
+        Output : Tool
+        """
+        path = shutil.which(name)
+        version = None
+        if path:
+            try:
+                result = sp.run([path]+list(versionArgs),stdout=sp.PIPE,stderr=sp.STDOUT,timeout=30)
+                lines = result.stdout.decode(errors='replace').strip().splitlines()
+                version = lines[0] if lines else None
+            except (OSError,sp.SubprocessError) as e:
+                self.logger.debug("Can not get version of {} : {}".format(name,e))
+        return(Tool(name,path,version,time.monotonic()))
+
+    def get(self,name,versionArgs=('--version',)):
+        """Function to return the Tool of name, probing it only when missing or older than the TTL
+        """
+        with self.lock:
+            tool = self.tools.get(name)
+            if tool is not None and time.monotonic()-tool.probedAt < self.ttl:
+                return(tool)
+        tool = self.probe(name,versionArgs)
+        with self.lock:
+            self.tools[name] = tool
+        return(tool)
+
+    def resolve(self,name):
+        """Function to return the absolute path of a binary or None if it is not installed
+        """
+        return(self.get(name).path)
+
+    def invalidate(self,name=None):
+        """Function to drop cached probes so the next get() looks the binary up again
+        """
+        with self.lock:
+            if name is None:
+                self.tools.clear()
+            else:
+                self.tools.pop(name,None)
+
+    def runUpdate(self,name,updateArgs):
+        """Function to run the update command of a tool once and forget its cached version
+        Output : statusCode
+        """
+        path = self.resolve(name)
+        if path is None:
+            return(1)
+        self.logger.info("Checking for {} updates".format(name))
+        try:
+            result = sp.run([path]+list(updateArgs),stdout=sp.PIPE,stderr=sp.STDOUT)
+        except OSError as e:
+            self.logger.debug("Can not update {} : {}".format(name,e))
+            return(1)
+        if result.returncode == 0:
+            self.logger.info(result.stdout.decode(errors='replace').strip())
+        else:
+            self.logger.debug("Can not update {} to latest version".format(name))
+        #Version may have changed
+        self.invalidate(name)
+        return(result.returncode)
+
+    def updateLoop(self,name,updateArgs):
+        """Function run by the update thread of a tool
+        """
+        while True:
+            self.runUpdate(name,updateArgs)
+            if self.stopped.wait(self.updateInterval):
+                break
+
+    def scheduleUpdates(self,name,updateArgs=('-U',)):
+        """Function to start the background update checks of a tool. Only the first call per tool starts a thread
+        """
+        with self.lock:
+            if name in self.updaters:
+                return(self.updaters[name])
+            t = threading.Thread(target=self.updateLoop,args=(name,updateArgs),name="update-{}".format(name))
+            t.daemon = True
+            self.updaters[name] = t
+        t.start()
+        return(t)
+
+    def stop(self):
+        """Function to stop the update threads
+        """
+        self.stopped.set()
+        for t in list(self.updaters.values()):
+            t.join()
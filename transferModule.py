@@ -0,0 +1,316 @@
+#!/usr/bin/python
+import errno
+import hashlib
+import os
+import queue
+import select
+import socket
+import sqlite3
+import threading
+
+#errno values meaning sendfile() is not supported for this file/socket pair
+SENDFILE_UNSUPPORTED = (errno.EINVAL,errno.ENOSYS,errno.ENOTSOCK,errno.EOPNOTSUPP)
+
+
+class FileSender(object):
+    """Class to send byte ranges of a file over a socket.
+       Uses the kernel sendfile() path when available, else large buffered reads through one reusable buffer
+    """
+    def __init__(self,buffer_size=1024*1024,use_sendfile=True):
+        self.buffer = bytearray(buffer_size)
+        self.view = memoryview(self.buffer)
+        self.use_sendfile = use_sendfile and hasattr(os,'sendfile')
+
+    def send_range(self,sock,fh,offset,count,hasher=None):
+        """Function to send count bytes of an open binary file starting at offset.
+        With a hasher the data goes through the buffered path and is hashed on the way
+        Output : number of bytes sent
+        """
+        #Progress is kept here so a fallback to the buffered path continues where sendfile stopped
+        self.sent = 0
+        if self.use_sendfile and hasher is None:
+            try:
+                self.send_zero_copy(sock,fh,offset,count)
+            except OSError as e:
+                #Filesystems or sockets without sendfile support. Any other error is a real connection error
+                if e.errno not in SENDFILE_UNSUPPORTED:
+                    raise
+                self.use_sendfile = False
+        if self.sent < count:
+            self.sent += self.send_buffered(sock,fh,offset+self.sent,count-self.sent,hasher)
+        return(self.sent)
+
+    def send_zero_copy(self,sock,fh,offset,count):
+        """Function to send the range with os.sendfile. Data never enters python.
+        Sockets with a timeout are non blocking underneath, so wait for them to be writable
+        """
+        timeout = sock.gettimeout()
+        while self.sent < count:
+            try:
+                n = os.sendfile(sock.fileno(),fh.fileno(),offset+self.sent,count-self.sent)
+            except BlockingIOError:
+                (readable,writable,errored) = select.select([],[sock],[],timeout)
+                if not writable:
+                    raise socket.timeout("timed out")
+                continue
+            if n == 0:
+                raise EOFError("File is shorter than {} bytes".format(offset+count))
+            self.sent += n
+
+    def send_buffered(self,sock,fh,offset,count,hasher=None):
+        """Function to send the range by reading into the reusable buffer
+        """
+        fh.seek(offset)
+        sent = 0
+        while sent < count:
+            n = fh.readinto(self.view[:min(len(self.buffer),count-sent)])
+            if not n:
+                raise EOFError("File is shorter than {} bytes".format(offset+count))
+            sock.sendall(self.view[:n])
+            if hasher is not None:
+                hasher.update(self.view[:n])
+            sent += n
+        return(sent)
+
+
+class IncomingFile(object):
+    """Class to hold the state of one file being received
+    """
+    def __init__(self,path,fh,offset=0,hasher=None,progress_path=None):
+        self.path = path
+        self.fh = fh
+        #Bytes on disk, starting with the resumed prefix. Updated by the writer thread
+        self.written = offset
+        #Running sha256 of the file content, updated by the writer thread
+        self.hasher = hasher if hasher is not None else hashlib.sha256()
+        #Optional file recording how many bytes are safely on disk, survives a killed process
+        self.progress_path = progress_path
+        self.progress_step = 4*1024*1024
+        self.saved = offset
+
+    def save_progress(self,force=False):
+        """Function to record the bytes written so far, every progress_step bytes
+        """
+        if self.progress_path is None:
+            return
+        if not force and self.written - self.saved < self.progress_step:
+            return
+        #Data must reach the OS before the progress claims it
+        self.fh.flush()
+        with open(self.progress_path,'w') as fh:
+            fh.write(str(self.written))
+        self.saved = self.written
+
+
+class FileReceiver(object):
+    """Class to receive files from a socket.
+       Network reads go with recv_into() into a small pool of reusable buffers, and a write-behind thread
+       hashes and writes the filled buffers so network reads and disk work overlap
+    """
+    def __init__(self,buffer_size=1024*1024,buffers=4):
+        #Buffers ready to be filled from the network
+        self.free = queue.Queue()
+        for i in range(buffers):
+            self.free.put(bytearray(buffer_size))
+        #Filled buffers waiting for the writer thread : (incoming,buffer,length)
+        self.pending = queue.Queue()
+        #First exception raised by the writer thread
+        self.error = None
+        self.writer = threading.Thread(target=self.write_behind,name="write-behind")
+        self.writer.daemon = True
+        self.writer.start()
+
+    def write_behind(self):
+        """Function run by the writer thread
+        """
+        while True:
+            item = self.pending.get()
+            if item is None:
+                break
+            (incoming,buf,length) = item
+            if buf is None:
+                #End of file marker, length carries the event to set once everything before it is on disk.
+                #Drop the preallocated tail if the file is incomplete so its size matches its content
+                try:
+                    incoming.fh.truncate(incoming.written)
+                    incoming.save_progress(True)
+                    incoming.fh.close()
+                except Exception as e:
+                    self.error = self.error or e
+                length.set()
+                continue
+            try:
+                if self.error is None:
+                    view = memoryview(buf)[:length]
+                    incoming.fh.write(view)
+                    incoming.hasher.update(view)
+                    incoming.written += length
+                    incoming.save_progress()
+            except Exception as e:
+                self.error = e
+            self.free.put(buf)
+
+    def open_file(self,path,size,offset=0,hasher=None,progress_path=None):
+        """Function to open the target file and reserve its size on disk.
+        With offset > 0 the first offset bytes are kept and hasher must already cover them
+        Output : IncomingFile
+        """
+        if offset:
+            fh = open(path,'r+b')
+            fh.truncate(offset)
+            fh.seek(offset)
+        else:
+            fh = open(path,'wb')
+        try:
+            if size > offset:
+                os.posix_fallocate(fh.fileno(),offset,size-offset)
+        except (AttributeError,OSError):
+            #Platform or filesystem without fallocate, sparse file is fine
+            pass
+        return(IncomingFile(path,fh,offset,hasher,progress_path))
+
+    def recv_into_file(self,sock,incoming,count):
+        """Function to read exactly count bytes from the socket and queue them for writing
+        """
+        remaining = count
+        while remaining:
+            buf = self.free.get()
+            view = memoryview(buf)
+            filled = 0
+            want = min(len(buf),remaining)
+            while filled < want:
+                n = sock.recv_into(view[filled:want],want-filled)
+                if not n:
+                    #Keep what already arrived on disk
+                    self.pending.put((incoming,buf,filled))
+                    raise EOFError("Connection closed with {} bytes left".format(remaining-filled))
+                filled += n
+            self.pending.put((incoming,buf,filled))
+            remaining -= filled
+        if self.error is not None:
+            raise self.error
+
+    def finish_file(self,incoming):
+        """Function to wait until all queued data of the file is written and the file is closed.
+        Raises the error of the writer thread, if any
+        """
+        done = threading.Event()
+        self.pending.put((incoming,None,done))
+        done.wait()
+        if self.error is not None:
+            (error,self.error) = (self.error,None)
+            raise error
+
+    def close(self):
+        """Function to stop the writer thread
+        """
+        self.pending.put(None)
+        self.writer.join()
+
+
+def hash_file(path,length=None,block_size=1024*1024):
+    """Function to compute the sha256 of a file, or of its first length bytes
+    Output : hashlib object
+    """
+    hasher = hashlib.sha256()
+    buf = bytearray(block_size)
+    view = memoryview(buf)
+    remaining = length
+    with open(path,'rb') as fh:
+        while remaining is None or remaining > 0:
+            want = block_size if remaining is None else min(block_size,remaining)
+            n = fh.readinto(view[:want])
+            if not n:
+                break
+            hasher.update(view[:n])
+            if remaining is not None:
+                remaining -= n
+    return(hasher)
+
+
+class HashCache(object):
+    """Class to cache the sha256 of served files, keyed by path, size and modification time.
+       Besides the whole file digest it keeps the digest of every block_size prefix, so resume requests
+       are checked without reading the file again. With a cache_file the digests are also kept in sqlite
+       and outlive the process
+    """
+    def __init__(self,block_size=4*1024*1024,cache_file=None):
+        self.block_size = block_size
+        self.lock = threading.Lock()
+        #key -> {'sha256' : digest, 'blocks' : [digest of first n*block_size bytes, ...]}
+        self.entries = {}
+        self.conn = None
+        if cache_file:
+            self.conn = sqlite3.connect(cache_file,check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            #blocks are the prefix digests separated by commas
+            self.conn.execute("CREATE TABLE IF NOT EXISTS hashes (path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, sha256 TEXT, blocks TEXT)")
+            self.conn.commit()
+
+    def key(self,path):
+        st = os.stat(path)
+        return((path,st.st_size,st.st_mtime_ns))
+
+    def get(self,path):
+        """Function to return the cached entry of a file or None if it changed or was never hashed
+        """
+        key = self.key(path)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None and self.conn is not None:
+                row = self.conn.execute("SELECT sha256, blocks FROM hashes WHERE path = ? AND size = ? AND mtime = ?",key).fetchone()
+                if row:
+                    entry = self.entries[key] = {'sha256' : row[0], 'blocks' : row[1].split(',') if row[1] else []}
+            return(entry)
+
+    def put(self,key,digest,blocks):
+        with self.lock:
+            #Drop entries of older versions of the same file
+            for old in [old for old in self.entries if old[0] == key[0]]:
+                del self.entries[old]
+            self.entries[key] = {'sha256' : digest, 'blocks' : blocks}
+            if self.conn is not None:
+                self.conn.execute("INSERT OR REPLACE INTO hashes (path, size, mtime, sha256, blocks) VALUES (?, ?, ?, ?, ?)",
+                                  key+(digest,','.join(blocks)))
+                self.conn.commit()
+
+    def digest(self,path):
+        """Function to return the sha256 of a whole file, hashing it only if it is not cached
+        """
+        entry = self.get(path) or self.index(path)
+        return(entry['sha256'])
+
+    def close(self):
+        if self.conn is not None:
+            with self.lock:
+                self.conn.close()
+                self.conn = None
+
+    def index(self,path):
+        """Function to hash a file which is not cached yet: a file to resume or to compare with a
+        client manifest which was never streamed, or a local file listed in a manifest for the first time
+        """
+        key = self.key(path)
+        hasher = hashlib.sha256()
+        blocks = []
+        with open(path,'rb') as fh:
+            while True:
+                data = fh.read(self.block_size)
+                if not data:
+                    break
+                hasher.update(data)
+                if len(data) == self.block_size:
+                    blocks.append(hasher.copy().hexdigest())
+        self.put(key,hasher.hexdigest(),blocks)
+        return(self.entries[key])
+
+    def prefix_digest(self,path,offset):
+        """Function to return the sha256 of the first offset bytes, offset being a multiple of block_size
+        """
+        entry = self.get(path) or self.index(path)
+        if offset % self.block_size or offset // self.block_size > len(entry['blocks']):
+            return(None)
+        if offset == 0:
+            return(hashlib.sha256().hexdigest())
+        return(entry['blocks'][offset // self.block_size - 1])
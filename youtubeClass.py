@@ -7,29 +7,94 @@ import re
 import threading
 import glob
 import pdb
+import itertools
 import logging
+from logModule import Logs, setupLogging, logOutput
+from ledgerModule import getLedger
+from pipelineModule import DownloadPipeline
+from toolchainModule import getToolchain
+from runnerModule import CommandRunner, TIMEOUT_STATUS
+from metricsModule import getMetrics
+from linkModule import LinkSource, canonical_link, video_id, iter_unique, batched
+from schedulerModule import getScheduler, RetryPolicy
+from downloaderModule import makeBackend, BACKENDS
+from profileModule import FormatProfile, KINDS
+
+
+class DownloadJob(object):
+    """State of one link download: its private working folder, error flag and the files it produced
+    """
+    #Source of unique job ids
+    ids = itertools.count(1)
+
+    def __init__(self,link,downloadFolder):
+        self.link = link
+        #Process id keeps folders of several processes sharing downloadFolder apart
+        self.id = next(DownloadJob.ids)
+        self.folder = "{}job{}-{}/".format(downloadFolder,os.getpid(),self.id)
+        self.error = 0
+        #Paths reported by the downloader
+        self.videoFile = None
+        self.audioFile = None
+        #Last progress event of the download
+        self.progress = None
 
 
 class Youtubedl(object):
     """Using youtube-dl to download the audio and video of the given link
     """
-    def __init__(self,link):
+    def __init__(self,link,concurrency=1,parentFolder=r"/home/neo/youtube/",pipeline=False,backend='auto'):
 
-        #Store youtube links in a list
-        self.links = link.split(',')
+        #A list of links is taken as it is. A string is the -l option of the command line: links separated by commas,
+        #or a file with links per line, read lazily on every iteration
+        self.links = LinkSource(link) if isinstance(link,str) else list(link)
 
         #setting error to 0
         self.error = 0
 
+        #Number of links downloaded in parallel. 1 keeps the sequential behaviour
+        self.concurrency = max(1,concurrency)
+        #Download and audio extraction run as separate overlapping stages
+        self.pipeline = pipeline
+        #VBR quality of extracted mp3 (0 best - 9 worst)
+        self.audioQuality = 2
+        #Files wanted of every link (mp3, mp4 or both) and the mp3 bitrate. Decides what is downloaded
+        self.profile = FormatProfile()
+        #Program used by the pipeline to extract mp3 from mp4
+        self.transcoder = 'avconv'
+        #Links which failed to download
+        self.failedLinks = []
+        #Audio and video files produced by this batch
+        self.downloadedFiles = []
+        #Jobs of this batch which finished without error, with the final paths of their files
+        self.finishedJobs = []
+        #Links found in the ledger are not downloaded again. Server keeps its own media cache and turns this off
+        self.skipDownloaded = True
+        #Called with every job as soon as its files are final, from the thread which finished it
+        self.onFinished = None
+        #Called with (job,event) for every progress event of a download
+        self.onProgress = None
+        #Called with every link which failed
+        self.onFailed = None
+        #Lock shared by all workers when touching shared state (failed links, audio/video folders)
+        self.lock = threading.Lock()
+        #Workers take links one at a time from a shared iterator
+        self.linkLock = threading.Lock()
+
         #Project Youtube Folders and Log file
-        self.parentFolder = r"/home/neo/youtube/"
+        self.parentFolder = parentFolder
         self.youtubeDownloadFolder = "{}downloads/".format(self.parentFolder)
         self.youtubeAudioFolder = "{}audio".format(self.youtubeDownloadFolder)
         self.youtubeVideoFolder = "{}video".format(self.youtubeDownloadFolder)
+        #Partial downloads of failed links. Stays in the shared downloads folder after isolate(), so a later
+        #object resumes them once the private folder of this one is deleted
+        self.partialsFolder = self.youtubeDownloadFolder
         self.youtubeLogsFolder = "{}logs/".format(self.parentFolder)
         self.youtubeLogFile = "{}youtubeLogs.txt".format(self.youtubeLogsFolder)
         #This file will contain the youtube links which are already downloaded
         self.youtubeDownloadLinksFile = "{}youtubeDownlaodLinkFile.txt".format(self.youtubeDownloadFolder)
+        #Indexed ledger replacing the text file above. Text file is imported on first start
+        self.youtubeLedgerFile = "{}youtubeDownloadLedger.db".format(self.youtubeDownloadFolder)
 
         #Check folder existence
         self.checkAndCreateFolders()
@@ -37,6 +102,30 @@ class Youtubedl(object):
         #Create logger instance
         self.obj = Logs(self.youtubeLogFile)
 
+        #Open download ledger, shared by every Youtubedl object of this process
+        self.ledger = getLedger(self.youtubeLedgerFile,self.youtubeDownloadLinksFile)
+        if self.ledger.imported:
+            self.obj.logger.info("Imported {} links from {}".format(self.ledger.imported,self.youtubeDownloadLinksFile))
+
+        #Stage timers and counters shared by the whole process
+        self.metrics = getMetrics()
+
+        #Runs external commands. A download is killed after an hour, or after 5 minutes without output
+        self.runner = CommandRunner(timeout=3600,stallTimeout=300)
+
+        #Cached paths and versions of youtube-dl and avconv, shared by every Youtubedl object of this process
+        self.toolchain = getToolchain()
+
+        #Per host rate limit and adaptive concurrency, shared by every Youtubedl object of this process.
+        #concurrency above is the number of worker threads, the scheduler decides how many of them download
+        self.scheduler = getScheduler()
+        #Failed downloads are retried after a backoff, resuming their partial files
+        self.retry = RetryPolicy()
+
+        #Downloader used for every link, youtube-dl library in this process or the youtube-dl command
+        self.backend = makeBackend(backend,self)
+        self.obj.logger.debug("Using {} downloader backend".format(self.backend.name))
+
     def checkAndCreateFolders(self):
         """Create project youtube folders
         """
@@ -70,20 +159,24 @@ class Youtubedl(object):
             print("Exiting from script")
             sys.exit(-1)
 
-    def runCmd(self,cmd,*argv):
+    def runCmd(self,cmd,*argv,onProgress=None):
         """Function to run command and return output and result
-        Input : cmd
+        Input : cmd, optional onProgress(event) called for every youtube-dl progress line
         Output : (output,statusCode)
         """
         self.obj.logger.info(cmd)
         try:
-            (statusCode,output) = sp.getstatusoutput(cmd)
-            self.obj.logger.info(output) if len(argv) else None
-        except sp.CalledProcessError as e:
+            #Output is read while the command runs, progress lines become events for onProgress
+            (output,statusCode) = self.runner.run(cmd,onProgress)
+            #Output goes to the output logger, its level and length are set by setupLogging
+            logOutput(output,logging.INFO) if len(argv) else None
+            if statusCode == TIMEOUT_STATUS:
+                self.obj.logger.error("{} timed out".format(cmd))
+        except OSError as e:
             self.obj.logger.error("Fail to run {} cmd".format(cmd))
             #self.obj.logger.error(e)
-            statusCode = e.returncode
-            output = e.output
+            statusCode = 1
+            output = str(e)
 
         return(output,statusCode)
 
@@ -118,38 +211,31 @@ class Youtubedl(object):
                 sys.exit(1)
 
     def checkForUpdate(self):
-        """function to check YoutubeDl version
+        """function to check YoutubeDl version.
+           Version comes from the toolchain cache, the update itself runs in the background
         """
-        cmd = "youtube-dl --version"
-        (output,statusCode) = self.runCmd(cmd)
-        if(statusCode == 0):
-            self.obj.logger.info("Current youtube-dl version is {}".format(output))
+        version = self.toolchain.get('youtube-dl').version
+        if version:
+            self.obj.logger.info("Current youtube-dl version is {}".format(version))
         else:
             self.obj.logger.debug("Can not get current Youtube-Dl version")
-
-        self.obj.logger.info("Checking for any updates")
-        cmd = "youtube-dl -U"
-        (output,statusCode) = self.runCmd(cmd)
-        if(statusCode == 0):
-            version = self.regEx(output,r'[\d.]+').group(0)
-            self.obj.logger.info("Updated version is {}".format(version))
-        else:
-            self.obj.logger.debug("Can not update Youtube-Dl to latest version")
-
+        self.toolchain.scheduleUpdates('youtube-dl')
 
     def checkYoutubeDl(self):
         """Function to check if youtube-dl exists or not.
            If not then call install youtube-dl and avconv()
+           Binaries are probed once per process and cached by the toolchain registry
         """
-        ytdl = "which youtube-dl"
-        avconv = "which avconv"
-        if not os.system(ytdl) and not os.system(avconv):
+        with self.metrics.timer('probe'):
+            present = self.toolchain.resolve('youtube-dl') and self.toolchain.resolve(self.transcoder)
+        if present:
             self.obj.logger.info("Youtube-dl and avconv are present")
             #Check for update
             self.checkForUpdate()
         else:
             self.obj.logger.info("Youtube-dl and avconv are not present")
             self.installYoutbedlAvconv()
+            self.toolchain.invalidate()
 
 
     def checkFileExists(self,filename,folder):
@@ -159,141 +245,282 @@ class Youtubedl(object):
         fileToRemove = folder+'/'+filename.split('/')[-1]
         return (os.path.exists(fileToRemove))
 
-    def moveAudioVideoFiles(self):
-        """Function to move mp3 and mp4 files to audio and video folder
+    def moveAudioVideoFiles(self,job):
+        """Function to move the mp3 and mp4 of a job to audio and video folder.
+        Paths are known from the job, each move is a single rename on the same filesystem
         """
-
-        dictionary = {self.youtubeAudioFolder : '*mp3', self.youtubeVideoFolder : '*mp4'}
-
-        for folder,format in dictionary.items():
-            for filename in glob.glob(self.youtubeDownloadFolder+format):
-                try:
-                    if not self.checkFileExists(filename,folder):
-                        shutil.move(filename,folder)
-                except Exception as e:
-                    self.obj.logger.debug("Error while moving {} to {}".format(filename, folder))
-                    self.obj.logger.debug(e)
-                    self.error = 1
+        for (attr,folder) in (('audioFile',self.youtubeAudioFolder),('videoFile',self.youtubeVideoFolder)):
+            filename = getattr(job,attr)
+            if filename is None:
+                continue
+            target = os.path.join(folder,os.path.basename(filename))
+            try:
+                if not self.checkFileExists(filename,folder):
+                    os.replace(filename,target)
+                #Job now refers to the final location of its file
+                setattr(job,attr,target)
+            except Exception as e:
+                self.obj.logger.debug("Error while moving {} to {}".format(filename, folder))
+                self.obj.logger.debug(e)
+                job.error = 1
 
     def displayFiles(self):
-        """Function to display downloaded audio and video files
+        """Function to display audio and video files downloaded by this batch
         """
-        filesDict = {'audio' : self.youtubeAudioFolder , 'video' : self.youtubeVideoFolder}
+        self.obj.logger.info("List of downloaded files")
+        for file in self.downloadedFiles:
+            self.obj.logger.info(file)
 
-        for format,folder in filesDict.items():
-            self.obj.logger.info("List of {} files".format(format))
-            for file in glob.glob(folder+'/*'):
-                self.obj.logger.info(file)
+    def partialFolder(self,link):
+        """Function to return the folder keeping the partial download of a link between runs
+        """
+        return("{}partial-{}".format(self.partialsFolder,video_id(canonical_link(link))))
 
-    def removeFiles(self):
-        """Function to remove files containing ' ' and '&' in their filename from youtube download folder
+    def partialBytes(self,job):
+        """Function to return the size of the partial files in the folder of a job
         """
-        for filename in glob.glob(self.youtubeDownloadFolder+"*mp*"):
-            if '&' in filename or ' ' in filename:
-                os.remove(filename)
+        return(sum(os.path.getsize(f) for f in glob.glob(job.folder+'*.part')))
 
-    def downloadLink(self,link):
-        """Function to download youtube link.
+    def newJob(self,link):
+        """Function to create a download job with its own working folder.
+        Folder starts with the partial files an earlier failed download of the link left behind
+        """
+        job = DownloadJob(link,self.youtubeDownloadFolder)
+        try:
+            #Rename is atomic, so a partial download is taken by one job only
+            os.rename(self.partialFolder(link),job.folder)
+            self.obj.logger.info("Resuming partial download of {}".format(link))
+        except OSError:
+            os.makedirs(job.folder)
+        return(job)
+
+    def reportProgress(self,job,event):
+        """Function called by the downloader backend for every progress event of a job
         """
+        job.progress = event
+        if self.onProgress:
+            self.onProgress(job,event)
 
+    def downloadLink(self,link):
+        """Function to download youtube link into its own job folder and move the results to audio/video folders
+        Output : error status of this link
+        """
+        job = self.newJob(link)
         self.obj.logger.info("Going to download : {}".format(link))
-        #restrict filename option is to create a file with ASCII char only. No space and & in filename
-        cmd = r"youtube-dl -o '{}%(title)s.%(ext)s' --restrict-filenames -k -x --audio-quality 2 --audio-format mp3 -f mp4 {}".format(self.youtubeDownloadFolder,link)
-        (output,statusCode) = self.runCmd(cmd,1)
-        if(statusCode != 0):
+        (downloaded,output) = self.fetch(job,extractAudio=self.profile.audio)
+        if downloaded is None:
             self.obj.logger.error("Fails to download link : {}".format(link))
-            self.error = 1
-        if not self.error:
-            #above command will create two files.One downloaded and one which is modified using restrict filename option
-            #Remove file which contains space and & in file name
-            self.removeFiles()
-            #Update DownloadLinkFile
-            self.updateDownloadLinksFile(link)
-
-        return(self.error)
-
-    def cleanUp(self):
-        """Function to delete any duplicate audio and video files from downloads folder
+            self.obj.logger.debug(output)
+            job.error = 1
+        else:
+            #Source of an audio only profile is not kept
+            job.videoFile = downloaded if self.profile.video else None
+            job.audioFile = os.path.splitext(downloaded)[0]+'.mp3' if self.profile.audio else None
+            self.finalizeJob(job)
+        self.cleanUp(job)
+        return(job.error)
+
+    def fetch(self,job,extractAudio):
+        """Function to download a job, retrying failures which may be transient after a backoff.
+        Partial files stay in the job folder and the downloader continues them, so a retry
+        only fetches the bytes the failed attempt did not get
+        Output : (path of the mp4 or None,output)
+        """
+        attempt = 1
+        while True:
+            (videoFile,output) = self.fetchOnce(job,extractAudio)
+            if videoFile is not None or attempt >= self.retry.attempts or not self.retry.retryable(output):
+                return(videoFile,output)
+            delay = self.retry.delay(attempt)
+            resumed = self.partialBytes(job)
+            self.obj.logger.warning("Download of {} failed (attempt {} of {}), retrying in {:.1f}s from {} bytes".format(
+                job.link,attempt,self.retry.attempts,delay,resumed))
+            self.metrics.inc('download_retries')
+            self.metrics.inc('bytes_resumed',resumed)
+            time.sleep(delay)
+            attempt += 1
+
+    def fetchOnce(self,job,extractAudio):
+        """Function to run the downloader backend on a job once the scheduler lets it start.
+        Result, size and output of the download are reported back to the scheduler
+        Output : (path of the mp4 or None,output)
         """
+        slot = self.scheduler.acquire(job.link)
+        (videoFile,output) = (None,"")
         try:
-            for file in glob.glob(self.youtubeDownloadFolder+'*mp*'):
-                os.remove(file)
-        except Exception as e:
-            self.obj.logger.debug("No stale files found")
-
-    def updateDownloadLinksFile(self,link):
-        """Function to update YoutubeDownloadLinksFile with link and corresponding donwloaded file
+            #Profiled only when enabled in metrics
+            with self.metrics.profile("job{}".format(job.id)):
+                with self.metrics.timer('download'):
+                    (videoFile,output) = self.backend.download(job,extractAudio=extractAudio)
+        finally:
+            #Audio only downloads leave just the mp3
+            size = 0
+            for path in (videoFile,os.path.splitext(videoFile)[0]+'.mp3') if videoFile else ():
+                if os.path.exists(path):
+                    size = os.path.getsize(path)
+                    break
+            self.scheduler.release(slot,videoFile is not None,size,output)
+        return(videoFile,output)
+
+    def downloadVideo(self,job):
+        """Function to download only the mp4 of a job, audio is extracted later by the pipeline
+        Output : path of the mp4 or None on failure
+        """
+        self.obj.logger.info("Going to download video : {}".format(job.link))
+        (job.videoFile,output) = self.fetch(job,extractAudio=False)
+        if job.videoFile is None:
+            self.obj.logger.error("Fails to download link : {}".format(job.link))
+            self.obj.logger.debug(output)
+            job.error = 1
+        return(job.videoFile)
+
+    def finalizeJob(self,job):
+        """Function to move the files of a finished job and record its link
+        """
+        with self.metrics.timer('move'):
+            self.moveAudioVideoFiles(job)
+        if not job.error:
+            self.metrics.inc('links_downloaded')
+            with self.metrics.timer('ledger'):
+                self.updateDownloadLinksFile(job.link,job.audioFile or job.videoFile)
+                self.ledger.removeFailure(canonical_link(job.link))
+            with self.lock:
+                self.downloadedFiles.extend(f for f in (job.audioFile,job.videoFile) if f)
+                self.finishedJobs.append(job)
+            if self.onFinished:
+                self.onFinished(job)
+
+    def cleanUp(self,job):
+        """Function to delete the working folder of a job with anything left in it.
+        Folder of a failed job holding partial files is kept for newJob() to resume
+        """
+        kept = self.partialBytes(job) if job.error else 0
+        if kept:
+            partial = self.partialFolder(job.link)
+            shutil.rmtree(partial,ignore_errors=True)
+            try:
+                os.rename(job.folder,partial)
+                self.obj.logger.info("Keeping {} bytes of {} in {}".format(kept,job.link,partial))
+                return
+            except OSError as e:
+                self.obj.logger.debug(e)
+        shutil.rmtree(job.folder,ignore_errors=True)
+
+    def updateDownloadLinksFile(self,link,audioFile):
+        """Function to update download ledger with link and corresponding donwloaded file
         """
-
-        downloadFile = os.path.basename(glob.glob(self.youtubeDownloadFolder+'*mp3')[0])
-        #Open the file in append mode and write link,downloaded file
         try:
-            with open(self.youtubeDownloadLinksFile,'a') as fh:
-                toWrite = link+','+downloadFile
-                fh.write(toWrite+"\n")
-                #fh.write("\n")
+            #Stored under one spelling, so any variant of the link is found again
+            self.ledger.addLink(canonical_link(link),os.path.basename(audioFile))
         except Exception as e:
-            self.obj.logger.error("Error updating {} file")
+            self.obj.logger.error("Error updating {} file".format(self.youtubeLedgerFile))
             self.obj.logger.debug(e)
 
 
-    def isLinkPreviouslyDownloaded(self,link):
+    def isLinkPreviouslyDownloaded(self,link,downloaded=None):
         """Function to check if given youtube link is already downloaded.
+        Input : link, optional result of ledger.lookupLinks() for the whole batch
+        """
+        #Entries written before links were normalised are stored as given
+        if downloaded is not None:
+            downloadFile = downloaded.get(canonical_link(link)) or downloaded.get(link)
+        else:
+            downloadFile = self.ledger.getFile(canonical_link(link)) or self.ledger.getFile(link)
+        if downloadFile is None:
+            return(False)
+        self.obj.logger.info("{} already downloaded. Corresponding file is {}".format(link,downloadFile))
+        return(True)
+
+    def recordFailure(self,link):
+        """Function to record a failed link. failedLinks keeps the aggregate status of the batch
         """
-        isDownload = False
-        if os.path.exists(self.youtubeDownloadLinksFile):
-            with open(self.youtubeDownloadLinksFile) as fh:
-                #Read line by line
-                for line in fh:
-                    if link == line.split(',')[0]:
-                        self.obj.logger.info("{} already downloaded. Corresponding file is".format(link))
-                        self.obj.logger.info(line)
-                        isDownload = True
-                        break
-        return(isDownload)
+        self.obj.logger.error("Downloading {} failed. Check if link is correct. Check n/w connections".format(link))
+        with self.lock:
+            self.failedLinks.append(link)
+        #Kept across runs for --retry-failed
+        self.ledger.addFailure(canonical_link(link))
+        self.metrics.inc('links_failed')
+        if self.onFailed:
+            self.onFailed(link)
+
+    def isolate(self,name):
+        """Function to download into a private sub-folder of the downloads folder.
+        Finished files also go to private audio/video folders, so downloads of the same link
+        by another object never replace or take away the files of this one
+        """
+        self.youtubeDownloadFolder = "{}{}/".format(self.youtubeDownloadFolder,name)
+        self.youtubeAudioFolder = "{}audio".format(self.youtubeDownloadFolder)
+        self.youtubeVideoFolder = "{}video".format(self.youtubeDownloadFolder)
+        for folder in (self.youtubeDownloadFolder,self.youtubeAudioFolder,self.youtubeVideoFolder):
+            if not os.path.exists(folder):
+                self.createFolder(folder)
+
+    def nextLink(self,links):
+        """Function to take the next link of an iterator shared by worker threads
+        Output : link or None when there are no more links
+        """
+        with self.linkLock:
+            return(next(links,None))
+
+    def runWorker(self,links):
+        """Function run by each worker thread. Downloads links from the shared iterator until it is exhausted.
+        Every link is a separate job with its own folder and error flag
+        """
+        while True:
+            link = self.nextLink(links)
+            if link is None:
+                break
+            if self.downloadLink(link):
+                self.recordFailure(link)
+
+    def runParallel(self,links):
+        """Function to download links using a bounded pool of worker threads
+        """
+        links = iter(links)
+        threads = []
+        for index in range(self.concurrency):
+            t = threading.Thread(target=self.runWorker,args=(links,),name="worker{}".format(index))
+            threads.append(t)
+            t.start()
+        for t in threads:
+            t.join()
+
+    def pendingLinks(self):
+        """Function to yield the links which have to be downloaded. Links are read lazily, variants of a video
+        seen before are dropped and the rest is looked up in the ledger one batch at a time,
+        so downloads start before a long link file is read to its end
+        """
+        for batch in batched(iter_unique(self.links),self.ledger.batchSize):
+            if self.skipDownloaded:
+                downloaded = self.ledger.lookupLinks(batch+[canonical_link(link) for link in batch])
+                batch = [link for link in batch if not self.isLinkPreviouslyDownloaded(link,downloaded)]
+            for link in batch:
+                yield link
 
     def runYoutube(self):
         # check if youtube-dl exists or not
         self.checkYoutubeDl()
 
-        #Iterate for each link
-        for link in self.links:
-            if not self.isLinkPreviouslyDownloaded(link):
-                if not self.downloadLink(link):
-                    self.moveAudioVideoFiles()
-                else:
-                    self.obj.logger.error("Downloading {} failed. Check if link is correct. Check n/w connections".format(link))
-        # Cleanup code
-        self.cleanUp()
+        links = self.pendingLinks()
+        #Pipeline overlaps the mp3 extraction with the next downloads, it is of use only when both files are kept
+        if self.pipeline and self.profile.audio and self.profile.video:
+            DownloadPipeline(self).run(links)
+        elif self.concurrency > 1:
+            self.runParallel(links)
+        else:
+            #Iterate for each link
+            for link in links:
+                if self.downloadLink(link):
+                    self.recordFailure(link)
         # Display list of downloaded audio and videos
         self.displayFiles()
 
-        return(self.error)
-
+        #Aggregate status of the whole batch
+        self.error = 1 if self.failedLinks else 0
+        if self.failedLinks:
+            self.obj.logger.error("Failed links : {}".format(','.join(self.failedLinks)))
 
-class Logs(object):
-    """Function to display script logs and save it in the log file
-    """
-
-    def __init__(self,logfile):
-        self.logfile = logfile
-        #1.Create logger instance
-        self.logger = logging.getLogger()
-        self.logger.setLevel(logging.DEBUG)
-        #2.Create file handler to save test logs to file.
-        log_fh = logging.FileHandler(self.logfile,mode='w')
-        log_fh.setLevel(logging.DEBUG)
-        #3.Create console handler to ouput logs to Console as well.
-        log_ch = logging.StreamHandler()
-        log_ch.setLevel(logging.DEBUG)
-        #4.Create log formatter string
-        #formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)8s - %(message)s')
-        formatter = logging.Formatter('%(asctime)s - %(threadName)10s - %(levelname)8s - %(message)s')
-        log_fh.setFormatter(formatter)
-        log_ch.setFormatter(formatter)
-        #5.Add 4 to handlers
-        self.logger.addHandler(log_fh)
-        self.logger.addHandler(log_ch)
+        return(self.error)
 
 
 def getArgs():
@@ -302,16 +529,43 @@ def getArgs():
     Should show help if required no. of args are not passed.
     """
     parser = argparse.ArgumentParser(description='Provide youtube link to download. Script will download video and will also convert it to audio file.', formatter_class=argparse.RawTextHelpFormatter)
-    parser.add_argument('-l','--link',dest='link',help='Single or multiple links separated by csv or a file containing youtube links per line',required=True)
+    parser.add_argument('-l','--link',dest='link',help='Single or multiple links separated by csv or a file containing youtube links per line')
+    parser.add_argument('--retry-failed',dest='retryFailed',action='store_true',help='Also download the links which failed in earlier runs')
+    parser.add_argument('--retries',dest='retries',type=int,default=4,help='Attempts per download before a link counts as failed (default 4)')
+    parser.add_argument('-c','--concurrency',dest='concurrency',type=int,default=1,help='Number of links to download in parallel (default 1)')
+    parser.add_argument('-P','--pipeline',dest='pipeline',action='store_true',help='Download videos and extract mp3 in separate overlapping stages,\none transcoder process per CPU')
+    parser.add_argument('--log-level',dest='logLevel',default='DEBUG',choices=['DEBUG','INFO','WARNING','ERROR'],help='Console log level (default DEBUG)')
+    parser.add_argument('--output-level',dest='outputLevel',default='INFO',choices=['DEBUG','INFO','WARNING','ERROR'],help='Level of youtube-dl/avconv output lines, WARNING hides them (default INFO)')
+    parser.add_argument('--output-lines',dest='outputLines',type=int,default=20,help='Number of last lines of a command output which are logged, 0 for all (default 20)')
+    parser.add_argument('--timeout',dest='timeout',type=int,default=3600,help='Seconds after which a download is killed (default 3600)')
+    parser.add_argument('--stall-timeout',dest='stallTimeout',type=int,default=300,help='Seconds without any output after which a download is killed (default 300)')
+    parser.add_argument('--max-rate',dest='maxRate',type=float,help='Downloads started per second per host (default no limit)')
+    parser.add_argument('--burst',dest='burst',type=int,default=1,help='Downloads which may start at once within --max-rate (default 1)')
+    parser.add_argument('--fixed-concurrency',dest='fixedConcurrency',action='store_true',help='Always run --concurrency downloads per host instead of\nadapting to throughput and failures')
+    parser.add_argument('-f','--formats',dest='formats',choices=KINDS,default='both',help='audio : mp3 only, from an audio only stream\nvideo : mp4 only, no extraction\nboth : mp4 and mp3 (default)')
+    parser.add_argument('--bitrate',dest='bitrate',type=int,help='Bitrate of the mp3 in kbit/s (default VBR quality 2)')
+    parser.add_argument('-b','--backend',dest='backend',choices=BACKENDS,default='auto',help='library : youtube-dl/yt-dlp called in this process\nsubprocess : youtube-dl command per link\nauto : library if installed (default)')
     args = parser.parse_args()
-    return args.link
+    if not args.link and not args.retryFailed:
+        parser.error("-l/--link or --retry-failed is required")
+    return args
 
 if __name__ == "__main__":
     #Get arguments from cmd line
-    link = getArgs()
+    args = getArgs()
+    setupLogging(level=args.logLevel,outputLevel=args.outputLevel,lines=args.outputLines)
     #setting status initial value to 0
     status = 0
-    ytObj = Youtubedl(link)
+    scheduler = getScheduler()
+    (scheduler.rate,scheduler.burst,scheduler.adaptive) = (args.maxRate,args.burst,not args.fixedConcurrency)
+    scheduler.maximum = args.concurrency
+    ytObj = Youtubedl(args.link or '',args.concurrency,pipeline=args.pipeline,backend=args.backend)
+    ytObj.retry.attempts = max(1,args.retries)
+    ytObj.profile = FormatProfile(args.formats,args.bitrate)
+    if args.retryFailed:
+        ytObj.links = itertools.chain(ytObj.ledger.failedLinks(),ytObj.links)
+    ytObj.runner.timeout = args.timeout
+    ytObj.runner.stallTimeout = args.stallTimeout
     status = ytObj.runYoutube()
     #ytObj.save_to_youtube_downloads_folder()
     print("Test finished with return status as {}".format(status))